@@ -1,9 +1,649 @@
+import asyncio
+import json
+import threading
+
 import gspread as gs
 import pandas as pd
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from httplib2 import Http
 from oauth2client import client, file, tools
+import instrumentation
+from request_scheduler import scheduler
+from sheet_cache import default_cache
+
+class ClientRegistry:
+    def __init__(self):
+        """
+        Initializes a process-wide registry of authenticated Google clients. Credentials are loaded once per
+        credentials file and scope set, discovery-built services are shared across instances, and opened
+        Spreadsheet/Worksheet handles are cached by URL and title until invalidated.
+        """
+        self._lock = threading.RLock()
+        self._credentials = {}
+        self._services = {}
+        self._clients = {}
+        self._spreadsheets = {}
+        self._worksheets = {}
+        self._snapshots = {}
+        self._formats = {}
+
+    @staticmethod
+    def spreadsheet_key(url: str) -> str:
+        """
+        Reduces a Google Sheet URL to its spreadsheet ID so that links to different tabs share one handle.
+
+        :param url: str
+            URL of the Google Sheet.
+        :return: str
+            The spreadsheet ID, or the URL itself if no ID can be found.
+        """
+        try:
+            return gs.utils.extract_id_from_url(url)
+        except gs.exceptions.NoValidUrlKeyFound:
+            return url
+
+    def credentials(self, credentials_path, scopes, **kwargs):
+        """
+        Returns service account credentials for the credentials file and scopes, loading them on first use.
+
+        :param credentials_path: str
+            Path to the Google API credentials JSON file.
+        :param scopes: list
+            List of scopes to authorize the API access.
+        :param kwargs: dict
+            Optional arguments to be passed during the authentication process.
+        :return: service_account.Credentials
+            The shared credentials object.
+        """
+        key = (credentials_path, tuple(sorted(scopes)), tuple(sorted(kwargs.items())))
+        with self._lock:
+            if key not in self._credentials:
+                self._credentials[key] = service_account.Credentials.from_service_account_file(
+                    filename=credentials_path, scopes=scopes, **kwargs)
+            return self._credentials[key]
+
+    def service(self, api, version, credentials_path, scopes):
+        """
+        Returns a discovery-built service, building it only once per API, version, credentials file and scopes.
+
+        :param api: str
+            Name of the API, e.g. 'sheets' or 'drive'.
+        :param version: str
+            Version of the API, e.g. 'v4'.
+        :param credentials_path: str
+            Path to the Google API credentials JSON file.
+        :param scopes: list
+            List of scopes to authorize the API access.
+        :return: googleapiclient.discovery.Resource
+            The shared service object.
+        """
+        key = (api, version, credentials_path, tuple(sorted(scopes)))
+        with self._lock:
+            if key not in self._services:
+                credentials = self.credentials(credentials_path, scopes)
+                self._services[key] = build(api, version, credentials=credentials)
+            return self._services[key]
+
+    def client(self, credentials_path):
+        """
+        Returns an authorized gspread client for the credentials file, authenticating only once.
+
+        :param credentials_path: str
+            Path to the Google API credentials JSON file.
+        :return: gspread.Client
+            The shared gspread client.
+        """
+        with self._lock:
+            if credentials_path not in self._clients:
+                self._clients[credentials_path] = gs.service_account(filename=credentials_path)
+            return self._clients[credentials_path]
+
+    def spreadsheet(self, credentials_path, url):
+        """
+        Returns the opened Spreadsheet for the URL, opening it only if it is not cached.
+
+        :param credentials_path: str
+            Path to the Google API credentials JSON file.
+        :param url: str
+            URL of the Google Sheet.
+        :return: gspread.Spreadsheet
+            The cached Spreadsheet handle.
+        """
+        key = (credentials_path, self.spreadsheet_key(url))
+        with self._lock:
+            if key in self._spreadsheets:
+                return self._spreadsheets[key]
+        spreadsheet = scheduler.call(self.client(credentials_path).open_by_url, url, key=('open_by_url',) + key)
+        with self._lock:
+            return self._spreadsheets.setdefault(key, spreadsheet)
+
+    def worksheet(self, credentials_path, url, title):
+        """
+        Returns the Worksheet with the given title, looking it up only if it is not cached.
+
+        :param credentials_path: str
+            Path to the Google API credentials JSON file.
+        :param url: str
+            URL of the Google Sheet.
+        :param title: str
+            Title of the worksheet.
+        :return: gspread.Worksheet
+            The cached Worksheet handle.
+        """
+        key = (credentials_path, self.spreadsheet_key(url), title)
+        with self._lock:
+            if key in self._worksheets:
+                return self._worksheets[key]
+        worksheet = scheduler.call(self.spreadsheet(credentials_path, url).worksheet, title, key=('worksheet',) + key)
+        with self._lock:
+            return self._worksheets.setdefault(key, worksheet)
+
+    def cache_worksheet(self, credentials_path, url, worksheet):
+        """
+        Stores a Worksheet handle that was obtained elsewhere, e.g. from add_worksheet.
+
+        :param credentials_path: str
+            Path to the Google API credentials JSON file.
+        :param url: str
+            URL of the Google Sheet.
+        :param worksheet: gspread.Worksheet
+            The worksheet to cache under its title.
+        """
+        with self._lock:
+            self._worksheets[(credentials_path, self.spreadsheet_key(url), worksheet.title)] = worksheet
+
+    def snapshot(self, credentials_path, url, title, revision):
+        """
+        Returns the cached contents of a worksheet as last read or written, or None if nothing is cached or the
+        spreadsheet has changed since.
+
+        :param credentials_path: str
+            Path to the Google API credentials JSON file.
+        :param url: str
+            URL of the Google Sheet.
+        :param title: str
+            Title of the worksheet.
+        :param revision: str
+            The current Drive modifiedTime of the spreadsheet.
+        :return: list
+            Grid of normalized cell strings, header row included.
+        """
+        with self._lock:
+            cached = self._snapshots.get((credentials_path, self.spreadsheet_key(url), title))
+        if cached is None or cached[0] != revision:
+            return None
+        return cached[1]
+
+    def cache_snapshot(self, credentials_path, url, title, revision, grid):
+        """
+        Stores the contents of a worksheet so later writes can be diffed against it.
+
+        :param credentials_path: str
+            Path to the Google API credentials JSON file.
+        :param url: str
+            URL of the Google Sheet.
+        :param title: str
+            Title of the worksheet.
+        :param revision: str
+            The Drive modifiedTime of the spreadsheet that the grid is current for.
+        :param grid: list
+            Grid of normalized cell strings, header row included.
+        """
+        with self._lock:
+            self._snapshots[(credentials_path, self.spreadsheet_key(url), title)] = (revision, grid)
+
+    def applied_format(self, credentials_path, url, title):
+        """
+        Returns the worksheet ID and FormatSpec key last applied to or verified on a worksheet in this process, or
+        None. A worksheet recreated under the same title has a new ID, so it does not match.
+
+        :param credentials_path: str
+            Path to the Google API credentials JSON file.
+        :param url: str
+            URL of the Google Sheet.
+        :param title: str
+            Title of the worksheet.
+        :return: tuple
+            The worksheet ID and FormatSpec key.
+        """
+        with self._lock:
+            return self._formats.get((credentials_path, self.spreadsheet_key(url), title))
+
+    def cache_format(self, credentials_path, url, title, applied):
+        """
+        Records that a FormatSpec has been applied to or verified on a worksheet.
+
+        :param credentials_path: str
+            Path to the Google API credentials JSON file.
+        :param url: str
+            URL of the Google Sheet.
+        :param title: str
+            Title of the worksheet.
+        :param applied: tuple
+            The worksheet ID and FormatSpec key.
+        """
+        with self._lock:
+            self._formats[(credentials_path, self.spreadsheet_key(url), title)] = applied
+
+    def invalidate(self, url=None, worksheet_name=None):
+        """
+        Drops cached Spreadsheet/Worksheet handles so they are reopened on next use. Credentials and services are kept.
+
+        :param url: str
+            URL of the Google Sheet to invalidate, default is every sheet.
+        :param worksheet_name: str
+            Title of the worksheet to invalidate, default is every worksheet (and the spreadsheet handle itself).
+        """
+        spreadsheet_key = self.spreadsheet_key(url) if url is not None else None
+        with self._lock:
+            for cache in (self._worksheets, self._snapshots, self._formats):
+                for key in list(cache):
+                    if spreadsheet_key not in (None, key[1]):
+                        continue
+                    if worksheet_name not in (None, key[2]):
+                        continue
+                    del cache[key]
+            if worksheet_name is None:
+                for key in list(self._spreadsheets):
+                    if spreadsheet_key in (None, key[1]):
+                        del self._spreadsheets[key]
+
+    def clear(self):
+        """
+        Drops everything in the registry, including credentials and services.
+        """
+        with self._lock:
+            self._credentials.clear()
+            self._services.clear()
+            self._clients.clear()
+            self._spreadsheets.clear()
+            self._worksheets.clear()
+            self._snapshots.clear()
+            self._formats.clear()
+
+client_registry = ClientRegistry()
+
+def cell_text(value) -> str:
+    """
+    Normalizes a cell value to the text Google Sheets would hold for it, so written and read values compare equal.
+
+    :param value:
+        The cell value.
+    :return: str
+        The normalized text.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        if value != value:
+            return ''
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+def frame_to_values(df: pd.DataFrame) -> list:
+    """
+    Converts a DataFrame into the list of rows sent to Google Sheets, header row included.
+
+    :param df: pd.DataFrame
+        DataFrame object to convert.
+    :return: list
+        Rows of plain Python values.
+    """
+    df = df.fillna('')
+    return [df.columns.values.tolist()] + df.values.tolist()
+
+def diff_ranges(old_grid: list, new_values: list) -> list:
+    """
+    Finds the rectangles of cells that differ between the current worksheet contents and the new values. Changed cells
+    are grouped into runs per row, and consecutive rows with the same run are merged into one rectangle. Cells that
+    only exist in the old grid are cleared by writing empty strings.
+
+    :param old_grid: list
+        Grid of normalized cell strings currently in the worksheet.
+    :param new_values: list
+        Rows of values to write, header row included.
+    :return: list
+        Tuples of (first_row, first_col, rows) with 1-based coordinates and rows a list of value lists.
+    """
+    n_rows = max(len(old_grid), len(new_values))
+    n_cols = max([len(row) for row in old_grid] + [len(row) for row in new_values] + [0])
+    ranges = []
+    for r in range(n_rows):
+        old_row = old_grid[r] if r < len(old_grid) else []
+        new_row = new_values[r] if r < len(new_values) else []
+        c = 0
+        while c < n_cols:
+            new_value = new_row[c] if c < len(new_row) else ''
+            old_value = old_row[c] if c < len(old_row) else ''
+            if cell_text(new_value) == old_value:
+                c += 1
+                continue
+            start = c
+            run = []
+            while c < n_cols:
+                new_value = new_row[c] if c < len(new_row) else ''
+                old_value = old_row[c] if c < len(old_row) else ''
+                if cell_text(new_value) == old_value:
+                    break
+                run.append(new_value)
+                c += 1
+            last = ranges[-1] if ranges else None
+            if last and last[1] == start + 1 and len(last[2][0]) == len(run) and last[0] + len(last[2]) == r + 1:
+                last[2].append(run)
+            else:
+                ranges.append((r + 1, start + 1, [run]))
+    return ranges
+
+def chunk_ranges(ranges: list, max_cells: int = 20000) -> list:
+    """
+    Splits rectangles into row slices of at most max_cells cells and packs them into batches of at most max_cells.
+
+    :param ranges: list
+        Tuples of (first_row, first_col, rows) as returned by diff_ranges.
+    :param max_cells: int
+        Maximum number of cells per batch request, default is 20000.
+    :return: list
+        Batches, each a list of (first_row, first_col, rows) tuples.
+    """
+    batches, batch, batch_cells = [], [], 0
+    for first_row, first_col, rows in ranges:
+        width = len(rows[0])
+        step = max(1, max_cells // width)
+        for offset in range(0, len(rows), step):
+            piece = rows[offset:offset + step]
+            cells = width * len(piece)
+            if batch and batch_cells + cells > max_cells:
+                batches.append(batch)
+                batch, batch_cells = [], 0
+            batch.append((first_row + offset, first_col, piece))
+            batch_cells += cells
+    if batch:
+        batches.append(batch)
+    return batches
+
+def cell_data(value) -> dict:
+    """
+    Converts a cell value into the CellData sent by an updateCells request, matching a RAW values write.
+
+    :param value:
+        The cell value.
+    :return: dict
+        The CellData; empty for blank cells so that they are cleared.
+    """
+    if value is None or value == '':
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+def values_request(sheet_id: int, first_row: int, first_col: int, rows: list) -> dict:
+    """
+    Builds an updateCells request that writes a rectangle of values, so value writes can share a
+    spreadsheets.batchUpdate with formatting requests.
+
+    :param sheet_id: int
+        ID of the worksheet.
+    :param first_row: int
+        1-based row of the top left cell.
+    :param first_col: int
+        1-based column of the top left cell.
+    :param rows: list
+        Rows of values to write.
+    :return: dict
+        The updateCells request.
+    """
+    return {'updateCells': {
+        'start': {'sheetId': sheet_id, 'rowIndex': first_row - 1, 'columnIndex': first_col - 1},
+        'rows': [{'values': [cell_data(value) for value in row]} for row in rows],
+        'fields': 'userEnteredValue'}}
+
+class FormatSpec:
+    def __init__(self, frozen_rows=0, frozen_cols=0, cell_formats=None, column_widths=None):
+        """
+        Initializes a declarative description of worksheet formatting that compiles into spreadsheets.batchUpdate
+        requests.
+
+        :param frozen_rows: int
+            Number of rows to freeze.
+        :param frozen_cols: int
+            Number of columns to freeze.
+        :param cell_formats: dict
+            CellFormat dictionaries keyed by A1 range, e.g. {'1': {'textFormat': {'bold': True}}}.
+        :param column_widths: dict
+            Pixel widths keyed by column letter.
+        """
+        self.frozen_rows = frozen_rows
+        self.frozen_cols = frozen_cols
+        self.cell_formats = cell_formats or {}
+        self.column_widths = column_widths or {}
+
+    def key(self) -> str:
+        """
+        Returns a string that is equal for equal specs, used to tell whether a spec is already applied.
+
+        :return: str
+            The spec key.
+        """
+        return json.dumps([self.frozen_rows, self.frozen_cols, self.cell_formats, self.column_widths], sort_keys=True)
+
+    @staticmethod
+    def _field_paths(cell_format: dict, prefix: str) -> list:
+        paths = []
+        for name, value in sorted(cell_format.items()):
+            if isinstance(value, dict):
+                paths += FormatSpec._field_paths(value, f"{prefix}.{name}")
+            else:
+                paths.append(f"{prefix}.{name}")
+        return paths
+
+    @staticmethod
+    def _clamp(grid_range: dict, col_count: int):
+        if col_count is None:
+            return grid_range
+        if grid_range.get('startColumnIndex', 0) >= col_count:
+            return None
+        grid_range['endColumnIndex'] = min(grid_range.get('endColumnIndex', col_count), col_count)
+        return grid_range
+
+    def requests(self, sheet_id: int, col_count: int = None) -> list:
+        """
+        Compiles the spec into spreadsheets.batchUpdate requests for one worksheet.
+
+        :param sheet_id: int
+            ID of the worksheet.
+        :param col_count: int
+            Number of columns of the worksheet; ranges past it are clamped or dropped so the batch is not rejected.
+        :return: list
+            The requests.
+        """
+        requests = [{'updateSheetProperties': {
+            'properties': {'sheetId': sheet_id,
+                           'gridProperties': {'frozenRowCount': self.frozen_rows,
+                                              'frozenColumnCount': self.frozen_cols}},
+            'fields': 'gridProperties.frozenRowCount,gridProperties.frozenColumnCount'}}]
+        for a1_range, cell_format in self.cell_formats.items():
+            grid_range = self._clamp(gs.utils.a1_range_to_grid_range(a1_range, sheet_id), col_count)
+            if grid_range is None:
+                continue
+            requests.append({'repeatCell': {
+                'range': grid_range,
+                'cell': {'userEnteredFormat': cell_format},
+                'fields': ','.join(self._field_paths(cell_format, 'userEnteredFormat'))}})
+        for column, width in self.column_widths.items():
+            index = gs.utils.column_letter_to_index(column) - 1
+            if col_count is not None and index >= col_count:
+                continue
+            requests.append({'updateDimensionProperties': {
+                'range': {'sheetId': sheet_id, 'dimension': 'COLUMNS', 'startIndex': index, 'endIndex': index + 1},
+                'properties': {'pixelSize': width},
+                'fields': 'pixelSize'}})
+        return requests
+
+    def _probes(self, col_count: int = None, cells: bool = True) -> dict:
+        # The cells read back to check the spec: the first cell of each sized column and of each formatted range
+        probes = {}
+        for column, width in self.column_widths.items():
+            index = gs.utils.column_letter_to_index(column) - 1
+            if col_count is None or index < col_count:
+                probes.setdefault((0, index), {})['width'] = width
+        if cells:
+            for a1_range, cell_format in self.cell_formats.items():
+                grid_range = self._clamp(gs.utils.a1_range_to_grid_range(a1_range), col_count)
+                if grid_range is not None:
+                    start = (grid_range.get('startRowIndex', 0), grid_range.get('startColumnIndex', 0))
+                    probes.setdefault(start, {})['format'] = cell_format
+        return probes
+
+    def metadata_params(self, title: str, col_count: int = None, cells: bool = True) -> dict:
+        """
+        Builds the spreadsheets.get parameters that read back, in one request, what the spec sets on a worksheet: the
+        frozen rows and columns, the width of each sized column and, if cells is True, the format of the first cell of
+        each formatted range.
+
+        :param title: str
+            Title of the worksheet.
+        :param col_count: int
+            Number of columns of the worksheet.
+        :param cells: bool
+            Whether to read the cell formats too.
+        :return: dict
+            The query parameters.
+        """
+        # A1 is always read so that the response only holds this worksheet
+        cells_read = ['A1'] + [gs.utils.rowcol_to_a1(row + 1, col + 1) for row, col in self._probes(col_count, cells)]
+        ranges = [gs.utils.absolute_range_name(title, cell) for cell in dict.fromkeys(cells_read)]
+        data_fields = 'startRow,startColumn,columnMetadata(pixelSize)'
+        if cells:
+            data_fields += ',rowData(values(userEnteredFormat))'
+        return {'ranges': ranges, 'includeGridData': cells,
+                'fields': f"sheets(properties(sheetId,gridProperties),data({data_fields}))"}
+
+    @staticmethod
+    def _contains(actual: dict, expected: dict) -> bool:
+        for name, value in expected.items():
+            if isinstance(value, dict):
+                if not isinstance(actual.get(name), dict) or not FormatSpec._contains(actual[name], value):
+                    return False
+            elif actual.get(name) != value:
+                return False
+        return True
+
+    def is_applied(self, metadata: dict, sheet_id: int, col_count: int = None, cells: bool = True) -> bool:
+        """
+        Compares the live state of a worksheet, as read with metadata_params, with the spec.
+
+        :param metadata: dict
+            The spreadsheets.get response.
+        :param sheet_id: int
+            ID of the worksheet.
+        :param col_count: int
+            Number of columns of the worksheet.
+        :param cells: bool
+            Whether the cell formats were read and should be compared too.
+        :return: bool
+            Whether the worksheet already has the frozen rows and columns, widths and, if read, cell formats.
+        """
+        sheet = next((sheet for sheet in metadata.get('sheets', [])
+                      if sheet.get('properties', {}).get('sheetId') == sheet_id), None)
+        if sheet is None:
+            return False
+        grid = sheet['properties'].get('gridProperties', {})
+        if (grid.get('frozenRowCount', 0), grid.get('frozenColumnCount', 0)) != (self.frozen_rows, self.frozen_cols):
+            return False
+        data = {(piece.get('startRow', 0), piece.get('startColumn', 0)): piece for piece in sheet.get('data', [])}
+        for start, expected in self._probes(col_count, cells).items():
+            piece = data.get(start, {})
+            if 'width' in expected:
+                columns = piece.get('columnMetadata') or [{}]
+                if columns[0].get('pixelSize') != expected['width']:
+                    return False
+            if 'format' in expected:
+                values = (piece.get('rowData') or [{}])[0].get('values') or [{}]
+                if not self._contains(values[0].get('userEnteredFormat', {}), expected['format']):
+                    return False
+        return True
+
+# The formatting applied by new_sheet and update_sheet
+DEFAULT_FORMAT = FormatSpec(
+    frozen_rows=1,
+    frozen_cols=1,
+    cell_formats={'1': {'horizontalAlignment': 'CENTER', 'verticalAlignment': 'MIDDLE', 'textFormat': {'bold': True}},
+                  'F2:Z': {'horizontalAlignment': 'CENTER', 'verticalAlignment': 'MIDDLE'}},
+    column_widths={'A': 25})
+
+def records_frame(grid: list) -> pd.DataFrame:
+    """
+    Converts a grid of worksheet values into the DataFrame get_all_records() would produce: the first row is used as
+    the header and numeric-looking strings are converted to numbers.
+
+    :param grid: list
+        Grid of cell strings with the header row first.
+    :return: pd.DataFrame
+        Pandas DataFrame object representing the worksheet.
+    """
+    if not grid or grid == [[]]:
+        return pd.DataFrame()
+    keys = grid[0]
+    duplicates = sorted({key for key in keys if keys.count(key) > 1})
+    if duplicates:
+        raise gs.exceptions.GSpreadException(f"the header row in the worksheet contains duplicates: {duplicates}")
+    values = [gs.utils.numericise_all(row) for row in grid[1:]]
+    return pd.DataFrame(gs.utils.to_records(keys, values))
+
+def coerce_frame(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """
+    Applies declared dtypes to the columns of a worksheet DataFrame. Boolean columns accept the 'TRUE'/'FALSE' text
+    Google Sheets displays, and numeric columns turn unparsable cells into NaN.
+
+    :param df: pd.DataFrame
+        DataFrame object to convert in place.
+    :param dtypes: dict
+        Dtypes keyed by column name, e.g. {'animate': 'bool', 'type': 'category', 'score': 'float64'}. 'bool' treats
+        blank cells as False, 'boolean' keeps them as missing, and 'numeric' lets pandas pick int or float.
+    :return: pd.DataFrame
+        The converted DataFrame.
+    """
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        series = df[column]
+        if dtype in ('bool', 'boolean'):
+            if series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+                series = series.astype(str).str.upper().map({'TRUE': True, 'FALSE': False})
+            series = series.fillna(False).astype(bool) if dtype == 'bool' else series.astype('boolean')
+        elif dtype == 'numeric' or pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype)):
+            series = pd.to_numeric(series.replace('', None), errors='coerce')
+            if dtype != 'numeric':
+                series = series.astype(dtype)
+        else:
+            series = series.astype(dtype)
+        df[column] = series
+    return df
+
+def concat_frames(chunks) -> pd.DataFrame:
+    """
+    Concatenates DataFrame chunks, keeping categorical columns categorical even when chunks saw different categories.
+
+    :param chunks: iterable
+        The DataFrame chunks, all with the same columns.
+    :return: pd.DataFrame
+        The combined DataFrame.
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame()
+    df = pd.concat(chunks, ignore_index=True)
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype) and not isinstance(df[column].dtype,
+                                                                                          pd.CategoricalDtype):
+            df[column] = pd.api.types.union_categoricals([chunk[column] for chunk in chunks])
+    return df
 
 class GoogleAuthenticate:
     def __init__(self, credentials_path="/Users/dennisoshea/Documents/Python_Scripts/client_secret.json"):
@@ -25,7 +665,8 @@ class GoogleAuthenticate:
         :param kwargs: dict
             Optional arguments to be passed during the authentication process.
         """
-        self.credentials = service_account.Credentials.from_service_account_file(filename=self.credentials_path, scopes=scopes, **kwargs)
+        with instrumentation.span('authenticate'):
+            self.credentials = client_registry.credentials(self.credentials_path, scopes, **kwargs)
 
 class GoogleDriveAPI(GoogleAuthenticate):
     def __init__(self):
@@ -35,7 +676,7 @@ class GoogleDriveAPI(GoogleAuthenticate):
         self.scopes = ['https://www.googleapis.com/auth/drive']
         super().__init__()
         self.authenticate(self.scopes)
-        self.drive_service = build('drive', 'v3', credentials=self.credentials)
+        self.drive_service = client_registry.service('drive', 'v3', self.credentials_path, self.scopes)
 
     def create_form(self, form_name):
         """
@@ -47,7 +688,7 @@ class GoogleDriveAPI(GoogleAuthenticate):
             ID of the created form.
         """
         form_metadata = {'name': form_name, 'mimeType': 'application/vnd.google-apps.form'}
-        form = self.drive_service.files().create(body=form_metadata).execute()
+        form = scheduler.call(self.drive_service.files().create(body=form_metadata).execute)
         return form['id']
 
 class GoogleSheetsAPI(GoogleAuthenticate):
@@ -63,34 +704,120 @@ class GoogleSheetsAPI(GoogleAuthenticate):
         self.scopes = ['https://www.googleapis.com/auth/spreadsheets']
         super().__init__()
         self.authenticate(self.scopes)
-        self.service = build('sheets', 'v4', credentials=self.credentials)
         self.url = url
         self.worksheet_name = worksheet_name
 
+    @property
+    def service(self):
+        """
+        The shared Sheets v4 service, built on first use.
+        """
+        return client_registry.service('sheets', 'v4', self.credentials_path, self.scopes)
+
     def open_google_worksheet(self):
         """
         Opens the specified worksheet in the Google Sheet.
         """
         self.open_google_sheet()
-        self.ws = self.sh.worksheet(self.worksheet_name)
+        self.ws = client_registry.worksheet(self.credentials_path, self.url, self.worksheet_name)
 
     def open_google_sheet(self):
         """
         Opens the Google Sheet specified by the URL.
         """
-        gc = gs.service_account(filename=self.credentials_path)
-        self.sh = gc.open_by_url(self.url)
+        self.sh = client_registry.spreadsheet(self.credentials_path, self.url)
+
+    def get_revision(self) -> str:
+        """
+        Gets the Drive modifiedTime of the Google Sheet, which changes whenever any worksheet is edited.
+
+        :return: str
+            The modifiedTime timestamp.
+        """
+        self.open_google_sheet()
+        return scheduler.call(self.sh.get_lastUpdateTime, key=('revision', self.sh.id))
 
-    def open_csv(self) -> pd.DataFrame:
+    def fetch_grid(self) -> list:
+        """
+        Downloads every value of the worksheet as displayed in Google Sheets.
+
+        :return: list
+            Grid of cell strings with the header row first.
+        """
+        self.open_google_worksheet()
+        grid = list(scheduler.call(self.ws.get, pad_values=True, key=('values', self.sh.id, self.ws.title)))
+        if instrumentation.enabled():
+            instrumentation.count('rows_downloaded', max(len(grid) - 1, 0))
+            instrumentation.count('bytes_downloaded', sum(len(cell.encode('utf-8')) for row in grid for cell in row))
+        return grid
+
+    def refresh_grid(self, worksheet):
+        """
+        Reads the current row and column counts of a worksheet into its handle. Handles are cached for the whole
+        process, so without this they keep the size the worksheet had when it was first opened.
+
+        :param worksheet:
+            Worksheet to refresh.
+        """
+        params = {'ranges': gs.utils.absolute_range_name(worksheet.title, 'A1'),
+                  'fields': 'sheets.properties.gridProperties', 'includeGridData': False}
+        metadata = scheduler.call(self.sh.fetch_sheet_metadata, params, key=('grid', self.sh.id, worksheet.title))
+        worksheet._properties['gridProperties'].update(metadata['sheets'][0]['properties']['gridProperties'])
+
+    def iter_csv(self, page_size: int = 5000, dtypes: dict = None, start_row: int = 2):
+        """
+        Reads the worksheet in pages of page_size rows and yields each page as a DataFrame, so only one page of the
+        worksheet is held in memory at a time. Declared dtypes are applied as each page is parsed; undeclared columns
+        keep the text displayed in Google Sheets.
+
+        :param page_size: int
+            Number of rows per page, default is 5000.
+        :param dtypes: dict
+            Dtypes keyed by column name, see coerce_frame.
+        :param start_row: int
+            The first row to read, default is the row after the header; later rows only read what was appended.
+        :return: generator
+            DataFrame chunks with the header row as columns, indexed by sheet row number; blank rows are skipped, so
+            the index tells where a chunk ends in the worksheet.
+        """
+        self.open_google_worksheet()
+        # Rows appended since the handle was cached are only paged through once the row count is refreshed
+        self.refresh_grid(self.ws)
+        header = scheduler.call(self.ws.row_values, 1, key=('header', self.sh.id, self.ws.title))
+        if not header:
+            return
+        last_column = gs.utils.rowcol_to_a1(1, len(header))[:-1]
+        for start in range(max(start_row, 2), self.ws.row_count + 1, page_size):
+            end = min(start + page_size - 1, self.ws.row_count)
+            page_range = f"A{start}:{last_column}{end}"
+            rows = scheduler.call(self.ws.get, page_range, pad_values=True,
+                                  key=('values', self.sh.id, self.ws.title, page_range))
+            numbers = [start + offset for offset, row in enumerate(rows) if any(row)]
+            rows = [row + [''] * (len(header) - len(row)) for row in rows if any(row)]
+            if not rows:
+                continue
+            if instrumentation.enabled():
+                instrumentation.count('rows_downloaded', len(rows))
+                instrumentation.count('bytes_downloaded', sum(len(cell.encode('utf-8')) for row in rows
+                                                              for cell in row))
+            yield coerce_frame(pd.DataFrame(rows, columns=header, index=pd.Index(numbers, name='row')), dtypes or {})
+
+    def open_csv(self, cache=None) -> pd.DataFrame:
         """
         Converts a Google Sheet into a Pandas DataFrame.
 
+        :param cache: SheetCache
+            Optional on-disk cache to read through, default is to always download the worksheet.
         :return: pd.DataFrame
             Pandas DataFrame object representing the Google Sheet.
         """
-        self.open_google_worksheet()
-        df = pd.DataFrame(self.ws.get_all_records())
-        return df
+        with instrumentation.span('open_csv', worksheet=self.worksheet_name):
+            if cache is None:
+                grid = self.fetch_grid()
+            else:
+                grid = cache.read_through(client_registry.spreadsheet_key(self.url), self.worksheet_name,
+                                          self.get_revision, self.fetch_grid)
+            return records_frame(grid)
 
     def new_sheet(self, worksheet: str, df: pd.DataFrame, format_sheet=True):
         """
@@ -105,14 +832,31 @@ class GoogleSheetsAPI(GoogleAuthenticate):
         """
         self.open_google_sheet()
 
-        df = df.fillna('')
-
         self.worksheet_name = worksheet
-        self.worksheet_name = self.sh.add_worksheet(title=worksheet, rows=len(df), cols=len(df.columns))
+        self.worksheet_name = scheduler.call(self.sh.add_worksheet, title=worksheet, rows=len(df) + 1,
+                                             cols=len(df.columns))
+        client_registry.cache_worksheet(self.credentials_path, self.url, self.worksheet_name)
 
-        self.worksheet_name.update([df.columns.values.tolist()] + df.values.tolist())
-        if format_sheet:
-            self.format(self.worksheet_name)
+        self.write_values(self.worksheet_name, df, format_spec=DEFAULT_FORMAT if format_sheet else None)
+
+    def write_sheet(self, worksheet_name, df, format_sheet=True):
+        """
+        Writes a DataFrame to a worksheet, creating the worksheet if it does not exist yet.
+
+        :param worksheet_name: str
+            Name of the worksheet to write.
+        :param df: pd.DataFrame
+            DataFrame object to save.
+        :param format_sheet: bool
+            Whether or not to format the sheet with pre-specified formatting, default is True.
+        """
+        with instrumentation.span('write_sheet', worksheet=worksheet_name, rows=len(df)):
+            try:
+                client_registry.worksheet(self.credentials_path, self.url, worksheet_name)
+            except gs.exceptions.WorksheetNotFound:
+                self.new_sheet(worksheet_name, df, format_sheet=format_sheet)
+            else:
+                self.update_sheet(worksheet_name, df, format_sheet=format_sheet)
 
     def update_sheet(self, worksheet_name, df, format_sheet=True):
         """
@@ -127,30 +871,207 @@ class GoogleSheetsAPI(GoogleAuthenticate):
         """
         self.open_google_sheet()
 
-        self.worksheet_name = self.sh.worksheet(worksheet_name)
-        self.worksheet_name.clear()
+        self.worksheet_name = client_registry.worksheet(self.credentials_path, self.url, worksheet_name)
+        self.write_values(self.worksheet_name, df, format_spec=DEFAULT_FORMAT if format_sheet else None)
 
-        df = df.fillna('')
-        self.worksheet_name.update([df.columns.values.tolist()] + df.values.tolist())
+    def read_snapshot(self, worksheet) -> list:
+        """
+        Returns the current contents of a worksheet, from the registry if the spreadsheet has not been modified since
+        they were cached and otherwise from the API, so edits made outside this process are never diffed away.
 
-        if format_sheet:
-            self.format(self.worksheet_name)
+        :param worksheet:
+            Worksheet to read.
+        :return: list
+            Grid of normalized cell strings, header row included.
+        """
+        # The revision is read before the values, so an edit in between makes the snapshot stale rather than lost
+        revision = self.get_revision()
+        grid = client_registry.snapshot(self.credentials_path, self.url, worksheet.title, revision)
+        if grid is None:
+            values = scheduler.call(worksheet.get_all_values, value_render_option=gs.utils.ValueRenderOption.formula,
+                                    key=('formulas', worksheet.spreadsheet.id, worksheet.title))
+            grid = [[cell_text(value) for value in row] for row in values]
+            client_registry.cache_snapshot(self.credentials_path, self.url, worksheet.title, revision, grid)
+        return grid
 
-    def format(self, worksheet):
+    def format_requests(self, worksheet, spec: FormatSpec) -> list:
         """
-        Applies formatting to the specified worksheet.
+        Compiles a FormatSpec for a worksheet, or returns no requests if the worksheet already has it. The frozen rows
+        and columns and the column widths are always read back from the worksheet. The cell formats are read back too,
+        unless this process already applied the spec to this very worksheet, which is the one shortcut the registry
+        memo gives.
 
         :param worksheet:
             Worksheet to format.
+        :param spec: FormatSpec
+            The formatting to apply.
+        :return: list
+            The spreadsheets.batchUpdate requests still needed, clamped to the columns of the worksheet.
+        """
+        cells = client_registry.applied_format(self.credentials_path, self.url, worksheet.title) != \
+            (worksheet.id, spec.key())
+        params = spec.metadata_params(worksheet.title, worksheet.col_count, cells=cells)
+        metadata = scheduler.call(self.sh.fetch_sheet_metadata, params,
+                                  key=('format', self.sh.id, worksheet.title, worksheet.col_count, cells))
+        if spec.is_applied(metadata, worksheet.id, worksheet.col_count, cells=cells):
+            client_registry.cache_format(self.credentials_path, self.url, worksheet.title,
+                                         (worksheet.id, spec.key()))
+            return []
+        return spec.requests(worksheet.id, worksheet.col_count)
+
+    def write_values(self, worksheet, df: pd.DataFrame, max_cells: int = 20000, format_spec: FormatSpec = None):
+        """
+        Writes a DataFrame to a worksheet by sending only the cells that differ from its snapshot, batched into
+        values.batchUpdate calls of at most max_cells cells each. The snapshot is only reused while the Drive
+        modifiedTime is the one recorded after this process last wrote or read the worksheet. If formatting is still
+        needed, it is sent in the same spreadsheets.batchUpdate as the first batch of values.
+
+        :param worksheet:
+            Worksheet to write to.
+        :param df: pd.DataFrame
+            DataFrame object to save.
+        :param max_cells: int
+            Maximum number of cells per batch request, default is 20000.
+        :param format_spec: FormatSpec
+            Formatting to apply along with the values, default is no formatting.
+        :return: int
+            Number of cells sent.
+        """
+        old_grid = self.read_snapshot(worksheet)
+        values = frame_to_values(df)
+        ranges = diff_ranges(old_grid, values)
+        if not ranges:
+            if format_spec is not None:
+                self.format(worksheet, format_spec)
+            return 0
+
+        rows_needed = max(first_row + len(rows) - 1 for first_row, _, rows in ranges)
+        cols_needed = max(first_col + len(rows[0]) - 1 for _, first_col, rows in ranges)
+        if rows_needed > worksheet.row_count or cols_needed > worksheet.col_count:
+            scheduler.call(worksheet.resize, rows=max(rows_needed, worksheet.row_count),
+                           cols=max(cols_needed, worksheet.col_count), idempotent=True)
+        pending_format = self.format_requests(worksheet, format_spec) if format_spec is not None else []
+
+        # Every write below sets fixed ranges to fixed values, so repeating one after a 5xx is safe
+        sent = 0
+        for batch in chunk_ranges(ranges, max_cells=max_cells):
+            if pending_format:
+                requests = pending_format + [values_request(worksheet.id, *piece) for piece in batch]
+                scheduler.call(self.sh.batch_update, {'requests': requests}, idempotent=True)
+                client_registry.cache_format(self.credentials_path, self.url, worksheet.title,
+                                             (worksheet.id, format_spec.key()))
+                pending_format = []
+                sent += sum(len(rows) * len(rows[0]) for _, _, rows in batch)
+                continue
+            data = []
+            for first_row, first_col, rows in batch:
+                start = gs.utils.rowcol_to_a1(first_row, first_col)
+                end = gs.utils.rowcol_to_a1(first_row + len(rows) - 1, first_col + len(rows[0]) - 1)
+                data.append({'range': gs.utils.absolute_range_name(worksheet.title, f"{start}:{end}"),
+                             'values': rows})
+                sent += len(rows) * len(rows[0])
+            scheduler.call(self.sh.values_batch_update, {'valueInputOption': 'RAW', 'data': data}, idempotent=True)
+
+        grid = [[cell_text(value) for value in row] for row in values]
+        if instrumentation.enabled():
+            instrumentation.count('cells_uploaded', sent)
+            instrumentation.count('bytes_uploaded', sum(len(cell_text(value).encode('utf-8')) for _, _, rows in ranges
+                                                        for row in rows for value in row))
+        # An edit made between the last write and this read of the revision is the one change a later diff can miss
+        client_registry.cache_snapshot(self.credentials_path, self.url, worksheet.title, self.get_revision(), grid)
+        cache = default_cache(create=False)
+        if cache is not None:
+            cache.invalidate(client_registry.spreadsheet_key(self.url), worksheet.title)
+        return sent
+
+    def format(self, worksheet, spec: FormatSpec = DEFAULT_FORMAT):
+        """
+        Applies formatting to the specified worksheet in a single spreadsheets.batchUpdate, skipping the request when
+        the worksheet already has it.
+
+        :param worksheet:
+            Worksheet to format.
+        :param spec: FormatSpec
+            The formatting to apply, default is DEFAULT_FORMAT.
+        """
+        requests = self.format_requests(worksheet, spec)
+        if requests:
+            scheduler.call(self.sh.batch_update, {'requests': requests}, idempotent=True)
+            client_registry.cache_format(self.credentials_path, self.url, worksheet.title, (worksheet.id, spec.key()))
+
+
+class AsyncGoogleSheetsAPI:
+    def __init__(self, url: str, max_concurrency: int = 4, cache=None):
+        """
+        Initializes an asyncio front end to GoogleSheetsAPI that reads and writes many worksheets of one Google Sheet
+        concurrently. Each call runs in a worker thread, and a semaphore bounds how many run at once so bursts stay
+        inside the per-minute quota. The GoogleSheetsAPI of each call is also built in its worker thread, since
+        authenticating may block.
+
+        :param url: str
+            URL of the Google Sheet.
+        :param max_concurrency: int
+            Maximum number of API calls in flight at once, default is 4.
+        :param cache: SheetCache
+            Optional on-disk cache that reads go through.
+        """
+        self.url = url
+        self.cache = cache
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(self, function, *args, **kwargs):
+        async with self._semaphore:
+            return await asyncio.to_thread(function, *args, **kwargs)
+
+    def _open_csv(self, worksheet_name: str) -> pd.DataFrame:
+        return GoogleSheetsAPI(self.url, worksheet_name=worksheet_name).open_csv(cache=self.cache)
+
+    def _write_sheet(self, worksheet_name: str, df: pd.DataFrame, format_sheet: bool):
+        GoogleSheetsAPI(self.url).write_sheet(worksheet_name, df, format_sheet=format_sheet)
+
+    async def open_csv(self, worksheet_name: str) -> pd.DataFrame:
+        """
+        Converts one worksheet into a Pandas DataFrame, shaped as GoogleSheetsAPI.open_csv() returns it.
+
+        :param worksheet_name: str
+            Name of the worksheet to read.
+        :return: pd.DataFrame
+            Pandas DataFrame object representing the worksheet.
+        """
+        return await self._run(self._open_csv, worksheet_name)
+
+    async def open_csvs(self, worksheet_names: list) -> dict:
+        """
+        Converts several worksheets into Pandas DataFrames concurrently.
+
+        :param worksheet_names: list
+            Names of the worksheets to read.
+        :return: dict
+            DataFrames keyed by worksheet name.
+        """
+        frames = await asyncio.gather(*[self.open_csv(name) for name in worksheet_names])
+        return dict(zip(worksheet_names, frames))
+
+    async def write_sheet(self, worksheet_name: str, df: pd.DataFrame, format_sheet=False):
+        """
+        Writes a DataFrame to a worksheet, creating the worksheet if it does not exist yet.
+
+        :param worksheet_name: str
+            Name of the worksheet to write.
+        :param df: pd.DataFrame
+            DataFrame object to save.
+        :param format_sheet: bool
+            Whether or not to format the sheet with pre-specified formatting, default is False.
+        """
+        await self._run(self._write_sheet, worksheet_name, df, format_sheet)
+
+    async def write_sheets(self, frames: dict, format_sheet=False):
+        """
+        Writes several DataFrames to their worksheets concurrently.
+
+        :param frames: dict
+            DataFrames keyed by the name of the worksheet to write them to.
+        :param format_sheet: bool
+            Whether or not to format the sheets with pre-specified formatting, default is False.
         """
-        set_frozen(worksheet, rows=1, cols=1)
-        header_format = CellFormat(
-            horizontalAlignment='CENTER',
-            verticalAlignment='MIDDLE',
-            textFormat=textFormat(bold=True))
-        data_format = CellFormat(
-            horizontalAlignment='CENTER',
-            verticalAlignment='MIDDLE', )
-        format_cell_range(worksheet, "1", header_format)
-        format_cell_range(worksheet, "F2:Z", data_format)
-        set_column_width(worksheet, "A", 25)
+        await asyncio.gather(*[self.write_sheet(name, df, format_sheet=format_sheet) for name, df in frames.items()])
@@ -0,0 +1,348 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Setting this variable to a file path turns tracing on for the whole run and writes the trace there at exit
+TRACE_ENVIRONMENT_VARIABLE = 'SURVEY_TRACE'
+
+# Seconds between RSS samples where the kernel's high-water mark cannot be reset
+SAMPLE_INTERVAL = 0.01
+
+def current_rss() -> int:
+    """
+    Gets the resident set size of this process now.
+
+    :return: int
+        The RSS in bytes, or 0 where the platform does not report it.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+def peak_rss() -> int:
+    """
+    Gets the peak resident set size of this process over its whole lifetime, which a stage can only raise.
+
+    :return: int
+        The peak RSS in bytes, or 0 where the platform does not report it.
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def high_water_rss() -> int:
+    """
+    Gets the peak resident set size of this process since its high-water mark was last reset, on Linux.
+
+    :return: int
+        The peak RSS in bytes, or 0 where /proc does not report it.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+def reset_high_water_rss() -> bool:
+    """
+    Resets the peak resident set size of this process to its current RSS, on Linux.
+
+    :return: bool
+        Whether the high-water mark could be reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+class PeakMemory:
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        """
+        Initializes a tracker of the peak RSS of every open span. On Linux the kernel's high-water mark is reset when
+        a span opens and read when it closes; the peak it held before the reset is first credited to the spans already
+        open, so nested and concurrent spans each keep their own peak. Elsewhere, a background thread samples the RSS
+        every interval seconds while any span is open, which misses peaks shorter than the interval.
+
+        :param interval: float
+            Seconds between samples when the high-water mark cannot be reset.
+        """
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._open = {}
+        self._resettable = None
+        self._sampler = None
+
+    def enter(self) -> object:
+        """
+        Starts tracking the peak of a span.
+
+        :return: object
+            The token to pass to exit.
+        """
+        token = object()
+        with self._lock:
+            if self._resettable is not False:
+                peak = high_water_rss()
+                for other in self._open:
+                    self._open[other] = max(self._open[other], peak)
+                self._resettable = reset_high_water_rss()
+            if not self._resettable and self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, daemon=True)
+                self._sampler.start()
+            self._open[token] = current_rss()
+        return token
+
+    def exit(self, token: object) -> int:
+        """
+        Stops tracking the peak of a span.
+
+        :param token: object
+            The token returned by enter.
+        :return: int
+            The peak RSS in bytes while the span was open, or 0 where the platform does not report it.
+        """
+        with self._lock:
+            peak = self._open.pop(token)
+            return max(peak, high_water_rss() if self._resettable else current_rss())
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if self._open:
+                    rss = current_rss()
+                    for token in self._open:
+                        self._open[token] = max(self._open[token], rss)
+
+class Span:
+    def __init__(self, tracer, name: str, args: dict):
+        """
+        Initializes a timed span of a trace, recorded when its with block exits.
+
+        :param tracer: Tracer
+            The tracer to record the span in.
+        :param name: str
+            The name of the stage.
+        :param args: dict
+            Extra details shown with the span.
+        """
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.counters = self.tracer.counter_values()
+        self.depth = self.tracer.push()
+        self.rss = current_rss()
+        self.memory = self.tracer.memory.enter()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        peak = self.tracer.memory.exit(self.memory)
+        rss = current_rss()
+        self.tracer.pop()
+        counters = self.tracer.counter_values()
+        deltas = {name: value - self.counters.get(name, 0) for name, value in counters.items()
+                  if value != self.counters.get(name, 0)}
+        self.tracer.record({'name': self.name, 'ph': 'X', 'ts': self.tracer.microseconds(self.start),
+                            'dur': (end - self.start) / 1000, 'pid': self.tracer.pid, 'tid': threading.get_ident(),
+                            'args': {**self.args, **deltas, 'depth': self.depth, 'rss_bytes': rss,
+                                     'rss_delta_bytes': rss - self.rss, 'peak_rss_bytes': peak,
+                                     **({'error': exc_type.__name__} if exc_type is not None else {})}})
+        self.tracer.record({'name': 'counters', 'ph': 'C', 'ts': self.tracer.microseconds(end),
+                            'pid': self.tracer.pid, 'args': counters})
+        return False
+
+class NoSpan:
+    """
+    The span handed out while tracing is off; entering and leaving it does nothing.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NO_SPAN = NoSpan()
+
+class Tracer:
+    def __init__(self):
+        """
+        Initializes a trace of nested timing spans and named counters, e.g. API calls, bytes transferred and rows
+        processed. The trace is written in the Chrome trace event format, which chrome://tracing and Perfetto open.
+        """
+        self.pid = os.getpid()
+        self.origin = time.perf_counter_ns()
+        self.events = []
+        self.counters = {}
+        self.memory = PeakMemory()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def microseconds(self, timestamp: int) -> float:
+        return (timestamp - self.origin) / 1000
+
+    def push(self) -> int:
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        return depth
+
+    def pop(self):
+        self._local.depth -= 1
+
+    def span(self, name: str, **args) -> Span:
+        """
+        Times a stage in a with block.
+
+        :param name: str
+            The name of the stage.
+        :param args: dict
+            Extra details shown with the span.
+        :return: Span
+            The span.
+        """
+        return Span(self, name, args)
+
+    def count(self, name: str, value: int = 1):
+        """
+        Adds to a counter.
+
+        :param name: str
+            The name of the counter.
+        :param value: int
+            The amount to add.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def counter_values(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+    def record(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+
+    def trace(self) -> dict:
+        """
+        Gets the trace in the Chrome trace event format.
+
+        :return: dict
+            The events, plus the final counters and the peak RSS of the process.
+        """
+        with self._lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'counters': counters, 'process_peak_rss_bytes': peak_rss()}}
+
+    def write(self, path: str):
+        """
+        Writes the trace to a JSON file.
+
+        :param path: str
+            The file to write.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
+
+_tracer = None
+
+def enable(path: str = None) -> Tracer:
+    """
+    Turns tracing on.
+
+    :param path: str
+        Where to write the trace when the program exits, default is not to write it automatically.
+    :return: Tracer
+        The tracer that records the spans and counters.
+    """
+    global _tracer
+    _tracer = Tracer()
+    if path is not None:
+        atexit.register(_tracer.write, path)
+    return _tracer
+
+def disable():
+    """
+    Turns tracing off.
+    """
+    global _tracer
+    _tracer = None
+
+def enabled() -> bool:
+    """
+    Whether tracing is on, for callers that would otherwise compute a counter value for nothing.
+    """
+    return _tracer is not None
+
+def span(name: str, **args):
+    """
+    Times a stage in a with block when tracing is on.
+
+    :param name: str
+        The name of the stage.
+    :param args: dict
+        Extra details shown with the span.
+    :return: Span
+        The span, or a shared span that does nothing when tracing is off.
+    """
+    if _tracer is None:
+        return NO_SPAN
+    return _tracer.span(name, **args)
+
+def count(name: str, value: int = 1):
+    """
+    Adds to a counter when tracing is on.
+
+    :param name: str
+        The name of the counter.
+    :param value: int
+        The amount to add.
+    """
+    if _tracer is not None:
+        _tracer.count(name, value)
+
+def traced(name: str = None):
+    """
+    Decorates a function so that each call is a span when tracing is on.
+
+    :param name: str
+        The name of the span, default is the name of the function.
+    :return: callable
+        The decorator.
+    """
+    def decorator(function):
+        label = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with _tracer.span(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+if os.environ.get(TRACE_ENVIRONMENT_VARIABLE):
+    enable(os.environ[TRACE_ENVIRONMENT_VARIABLE])
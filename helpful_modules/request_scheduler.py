@@ -0,0 +1,165 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import instrumentation
+
+# HTTP statuses that mean "slow down" or "try again later" rather than "this request is wrong"
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# The statuses a write that is not idempotent is retried on: a 429 is refused before anything is done, whereas a 5xx
+# may come back from a write that was carried out, which a retry would then repeat
+WRITE_RETRYABLE_STATUSES = {429}
+
+def error_status(error: Exception):
+    """
+    Gets the HTTP status of an error raised by gspread or googleapiclient.
+
+    :param error: Exception
+        The raised error.
+    :return: int
+        The HTTP status, or None if the error did not come from an HTTP response.
+    """
+    response = getattr(error, 'response', None)
+    if response is not None and hasattr(response, 'status_code'):
+        return response.status_code
+    resp = getattr(error, 'resp', None)
+    if resp is not None and hasattr(resp, 'status'):
+        return int(resp.status)
+    return None
+
+class TokenBucket:
+    def __init__(self, requests_per_minute: int):
+        """
+        Initializes a token bucket that allows bursts of up to requests_per_minute calls and refills at the same rate.
+
+        :param requests_per_minute: int
+            The per-minute quota to stay under.
+        """
+        self.capacity = requests_per_minute
+        self.rate = requests_per_minute / 60
+        self.tokens = float(requests_per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token, sleeping until one is available.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class RequestScheduler:
+    def __init__(self, requests_per_minute: int = 60, max_retries: int = 5, base_delay: float = 1.0,
+                 max_delay: float = 64.0):
+        """
+        Initializes the scheduler that Sheets/Drive calls go through. Calls are paced by a token bucket sized to the
+        per-minute quota, retried with jittered exponential backoff on 429/5xx responses (only on 429 for writes that
+        are not idempotent), and identical reads that are already in flight are coalesced into one call.
+
+        :param requests_per_minute: int
+            The per-minute quota to stay under, default is 60.
+        :param max_retries: int
+            How many times a call is retried before its error is raised, default is 5.
+        :param base_delay: float
+            Seconds to wait before the first retry, doubled on every further retry, default is 1.
+        :param max_delay: float
+            Upper bound on the wait between retries in seconds, default is 64.
+        """
+        self.bucket = TokenBucket(requests_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.counters = {'issued': 0, 'retried': 0, 'coalesced': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _execute(self, function, retryable, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self._count('issued')
+            instrumentation.count('api_calls')
+            try:
+                return function(*args, **kwargs)
+            except Exception as error:
+                if error_status(error) not in retryable or attempt >= self.max_retries:
+                    self._count('failed')
+                    raise
+            self._count('retried')
+            instrumentation.count('api_retries')
+            time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+            attempt += 1
+
+    def call(self, function, *args, key=None, idempotent=None, **kwargs):
+        """
+        Runs an API call under the quota, retrying it when the API asks to back off. Calls that are not idempotent,
+        e.g. add_worksheet or an append, are only retried on 429, since a 5xx may follow a write that went through.
+
+        :param function: callable
+            The call to make.
+        :param args: tuple
+            Positional arguments for the call.
+        :param key: hashable
+            Identifies a read, e.g. (spreadsheet ID, range). Concurrent calls with the same key share one request.
+            Leave as None for writes.
+        :param idempotent: bool
+            Whether repeating the call has the same effect as making it once, default is True for reads (calls with a
+            key) and False for writes. Writes of values or formatting to fixed ranges can be marked idempotent so
+            they are also retried on 5xx.
+        :param kwargs: dict
+            Keyword arguments for the call.
+        :return:
+            Whatever the call returns.
+        """
+        if idempotent is None:
+            idempotent = key is not None
+        retryable = RETRYABLE_STATUSES if idempotent else WRITE_RETRYABLE_STATUSES
+        if key is None:
+            return self._execute(function, retryable, *args, **kwargs)
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+            else:
+                self.counters['coalesced'] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._execute(function, retryable, *args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stats(self) -> dict:
+        """
+        Gets the number of calls issued, retried, coalesced and failed so far.
+
+        :return: dict
+            The counters.
+        """
+        with self._lock:
+            return dict(self.counters)
+
+scheduler = RequestScheduler()
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+from google.auth.exceptions import TransportError
+
+# Errors that mean the API could not be reached at all, as opposed to the API refusing the request
+NETWORK_ERRORS = (OSError, TransportError)
+
+class SheetCache:
+    def __init__(self, directory=None, ttl=None, max_bytes=512 * 1024 ** 2, max_age=7 * 24 * 3600, offline=None):
+        """
+        Initializes an on-disk, read-through cache of worksheet contents. Each worksheet is stored as a Parquet file of
+        its raw cell strings, keyed by spreadsheet ID and worksheet title and tagged with the Drive modifiedTime it was
+        downloaded at.
+
+        :param directory: str
+            Folder holding the cache, default is $GOOGLE_SHEETS_CACHE or ~/.cache/google_sheets.
+        :param ttl: int
+            Seconds an entry is served without asking Drive whether the spreadsheet changed, default is
+            $GOOGLE_SHEETS_CACHE_TTL or 0, i.e. the cheap modifiedTime is checked on every read and the worksheet is
+            only downloaded again when it changed. A positive TTL tolerates data that is up to that old.
+        :param max_bytes: int
+            Total size of the cache before the least recently used entries are evicted, default is 512 MB.
+        :param max_age: int
+            Seconds since last use after which an entry is evicted, default is 7 days.
+        :param offline: bool
+            Whether to serve only from the cache and never contact the API, default is $GOOGLE_SHEETS_OFFLINE.
+        """
+        if directory is None:
+            directory = os.environ.get('GOOGLE_SHEETS_CACHE', os.path.join('~', '.cache', 'google_sheets'))
+        if ttl is None:
+            ttl = float(os.environ.get('GOOGLE_SHEETS_CACHE_TTL', 0))
+        if offline is None:
+            offline = os.environ.get('GOOGLE_SHEETS_OFFLINE', '') not in ('', '0')
+        self.directory = os.path.expanduser(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(self.directory, 'index.json')
+
+    @staticmethod
+    def entry_name(spreadsheet_id: str, worksheet: str) -> str:
+        """
+        Builds the file name of the cache entry for a worksheet.
+
+        :param spreadsheet_id: str
+            ID of the Google Sheet.
+        :param worksheet: str
+            Title of the worksheet.
+        :return: str
+            Name of the Parquet file.
+        """
+        digest = hashlib.sha1(f"{spreadsheet_id}\0{worksheet}".encode('utf-8')).hexdigest()[:20]
+        return f"{digest}.parquet"
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_index(self, index: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(temp_path, self._index_path)
+
+    def _load(self, name: str) -> list:
+        frame = pd.read_parquet(os.path.join(self.directory, name))
+        return frame.values.tolist()
+
+    def _touch(self, name: str, checked: bool = False):
+        with self._lock:
+            index = self._read_index()
+            if name in index:
+                index[name]['last_used'] = time.time()
+                if checked:
+                    index[name]['checked_at'] = time.time()
+                self._write_index(index)
+
+    def get(self, spreadsheet_id: str, worksheet: str):
+        """
+        Returns the cached grid of a worksheet regardless of its age.
+
+        :param spreadsheet_id: str
+            ID of the Google Sheet.
+        :param worksheet: str
+            Title of the worksheet.
+        :return: list
+            Grid of cell strings with the header row first, or None if the worksheet is not cached.
+        """
+        name = self.entry_name(spreadsheet_id, worksheet)
+        with self._lock:
+            entry = self._read_index().get(name)
+        if entry is None or not os.path.exists(os.path.join(self.directory, name)):
+            return None
+        self._touch(name)
+        return self._load(name)
+
+    def put(self, spreadsheet_id: str, worksheet: str, revision: str, grid: list):
+        """
+        Stores the grid of a worksheet and evicts old entries if the cache is over its limits.
+
+        :param spreadsheet_id: str
+            ID of the Google Sheet.
+        :param worksheet: str
+            Title of the worksheet.
+        :param revision: str
+            Drive modifiedTime of the spreadsheet when the grid was downloaded.
+        :param grid: list
+            Grid of cell strings with the header row first.
+        """
+        name = self.entry_name(spreadsheet_id, worksheet)
+        width = max([len(row) for row in grid] + [0])
+        frame = pd.DataFrame([row + [''] * (width - len(row)) for row in grid],
+                             columns=[str(i) for i in range(width)], dtype=str)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        frame.to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+        now = time.time()
+        with self._lock:
+            index = self._read_index()
+            index[name] = {'spreadsheet_id': spreadsheet_id, 'worksheet': worksheet, 'revision': revision,
+                           'checked_at': now, 'last_used': now, 'bytes': os.path.getsize(path)}
+            self._evict(index, now)
+            self._write_index(index)
+
+    def _evict(self, index: dict, now: float):
+        for name in [name for name, entry in index.items() if now - entry['last_used'] > self.max_age]:
+            self._remove(index, name)
+        total = sum(entry['bytes'] for entry in index.values())
+        for name in sorted(index, key=lambda name: index[name]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= index[name]['bytes']
+            self._remove(index, name)
+
+    def _remove(self, index: dict, name: str):
+        del index[name]
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, spreadsheet_id: str = None, worksheet: str = None):
+        """
+        Removes cache entries so the next read downloads them again.
+
+        :param spreadsheet_id: str
+            ID of the Google Sheet to invalidate, default is every sheet.
+        :param worksheet: str
+            Title of the worksheet to invalidate, default is every worksheet.
+        """
+        with self._lock:
+            index = self._read_index()
+            for name, entry in list(index.items()):
+                if spreadsheet_id not in (None, entry['spreadsheet_id']):
+                    continue
+                if worksheet not in (None, entry['worksheet']):
+                    continue
+                self._remove(index, name)
+            self._write_index(index)
+
+    def read_through(self, spreadsheet_id: str, worksheet: str, get_revision, fetch) -> list:
+        """
+        Returns the grid of a worksheet from the cache when it is still current and downloads it otherwise. Entries
+        younger than the TTL are served without any API call; older ones are revalidated against the Drive
+        modifiedTime. In offline mode, or when the API cannot be reached, the cached grid is served as is.
+
+        :param spreadsheet_id: str
+            ID of the Google Sheet.
+        :param worksheet: str
+            Title of the worksheet.
+        :param get_revision: callable
+            Function returning the current Drive modifiedTime of the spreadsheet.
+        :param fetch: callable
+            Function downloading the grid of the worksheet.
+        :return: list
+            Grid of cell strings with the header row first.
+        """
+        name = self.entry_name(spreadsheet_id, worksheet)
+        with self._lock:
+            entry = self._read_index().get(name)
+        if entry is not None and not os.path.exists(os.path.join(self.directory, name)):
+            entry = None
+
+        if self.offline:
+            if entry is None:
+                raise LookupError(f"Worksheet '{worksheet}' of {spreadsheet_id} is not cached and the cache is offline.")
+            self._touch(name)
+            return self._load(name)
+
+        if entry is not None and time.time() - entry['checked_at'] < self.ttl:
+            self._touch(name)
+            return self._load(name)
+
+        try:
+            revision = get_revision()
+            if entry is not None and entry['revision'] == revision:
+                self._touch(name, checked=True)
+                return self._load(name)
+            grid = fetch()
+        except NETWORK_ERRORS:
+            if entry is None:
+                raise
+            self._touch(name)
+            return self._load(name)
+
+        self.put(spreadsheet_id, worksheet, revision, grid)
+        return grid
+
+_default_cache = None
+
+def default_cache(create: bool = True) -> SheetCache:
+    """
+    Returns the process-wide SheetCache configured from the environment.
+
+    :param create: bool
+        Whether to create the cache if this process has not used it yet, default is True.
+    :return: SheetCache
+        The shared cache, or None if it does not exist yet and create is False.
+    """
+    global _default_cache
+    if _default_cache is None and create:
+        _default_cache = SheetCache()
+    return _default_cache
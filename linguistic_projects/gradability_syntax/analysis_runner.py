@@ -0,0 +1,177 @@
+from dependencies import add_module_path
+
+# Add the relative path to the helpful_modules folder; its modules are only imported when first used
+add_module_path()
+
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from make_survey_one import open_sheet
+
+# The aggregate and plot stage of each kind of survey, as module and function names so the plot workers can import them
+ANALYSES = {
+    'faultless': ('analyze_survey_one_data', 'faultless_category_order', 'plot_category_order'),
+    'word_order': ('analyze_survey_two_data', 'scale_tally', 'plot_scale_tally'),
+}
+
+def load_manifest(path: str) -> list:
+    """
+    Load a manifest of surveys to analyze. The manifest is a JSON list with one entry per survey sheet, each with a
+    name, a kind (faultless or word_order), the link and worksheet of the sheet, and optionally the plot file.
+
+    :param path: str
+        The manifest file.
+    :return: list
+        The entries, with the plot file defaulting to data/<name>.jpg.
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    for entry in entries:
+        if entry['kind'] not in ANALYSES:
+            raise ValueError(f"Unknown kind of survey '{entry['kind']}' for '{entry['name']}'.")
+        entry.setdefault('plot', os.path.join('data', f"{entry['name']}.jpg"))
+    return entries
+
+def content_hash(kind: str, df: pd.DataFrame) -> str:
+    """
+    Hash the contents of a survey sheet together with the kind of analysis run on it.
+
+    :param kind: str
+        The kind of survey.
+    :param df: pd.DataFrame
+        The survey sheet.
+    :return: str
+        The hex digest.
+    """
+    digest = hashlib.sha256(kind.encode('utf-8'))
+    digest.update('\x1f'.join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+class AnalysisCache:
+    def __init__(self, directory: str = os.path.join('data', 'analysis_cache')):
+        """
+        Keeps the aggregate of every analyzed survey as a Parquet file named after the hash of the survey sheet, so
+        that surveys whose sheet did not change are neither aggregated nor plotted again.
+
+        :param directory: str
+            The cache folder.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.parquet")
+
+    def get(self, digest: str):
+        """
+        Get a cached aggregate.
+
+        :param digest: str
+            The hash of the survey sheet.
+        :return: pd.DataFrame
+            The aggregate, or None when it is not cached.
+        """
+        path = self.path(digest)
+        return pd.read_parquet(path) if os.path.exists(path) else None
+
+    def put(self, digest: str, aggregate: pd.DataFrame):
+        """
+        Cache an aggregate.
+
+        :param digest: str
+            The hash of the survey sheet.
+        :param aggregate: pd.DataFrame
+            The aggregate.
+        """
+        temporary_path = self.path(digest) + '.tmp'
+        aggregate.to_parquet(temporary_path, index=False)
+        os.replace(temporary_path, self.path(digest))
+
+def stage(kind: str, index: int):
+    """
+    Import the aggregate or plot function of a kind of survey.
+
+    :param kind: str
+        The kind of survey.
+    :param index: int
+        1 for the aggregate function, 2 for the plot function.
+    :return: callable
+        The function.
+    """
+    import importlib
+    return getattr(importlib.import_module(ANALYSES[kind][0]), ANALYSES[kind][index])
+
+def render_plot(kind: str, aggregate: pd.DataFrame, path: str) -> str:
+    """
+    Plot an aggregate, in a worker process.
+
+    :param kind: str
+        The kind of survey.
+    :param aggregate: pd.DataFrame
+        The aggregate.
+    :param path: str
+        The plot file.
+    :return: str
+        The plot file.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    stage(kind, 2)(aggregate, path)
+    return path
+
+def run_batch(entries: list, cache: AnalysisCache = None, fetch_workers: int = 8, plot_workers: int = None,
+              force: bool = False) -> dict:
+    """
+    Analyze many surveys. The sheets are downloaded concurrently, each one is aggregated as soon as it arrives, and
+    its plot is rendered in a pool of worker processes while the other sheets are still downloading. Surveys whose
+    sheet did not change since the last run and whose plot exists are skipped.
+
+    :param entries: list
+        The surveys, as returned by load_manifest.
+    :param cache: AnalysisCache
+        The cache of aggregates; default is data/analysis_cache.
+    :param fetch_workers: int
+        The number of sheets downloaded at once.
+    :param plot_workers: int
+        The number of plot worker processes, default is one per CPU.
+    :param force: bool
+        Whether to aggregate and plot every survey even when it is cached.
+    :return: dict
+        For each survey name, its status (cached or updated), content hash, aggregate and plot file.
+    """
+    cache = cache or AnalysisCache()
+    results = {}
+    # Spawned workers do not inherit the download threads of this process
+    context = multiprocessing.get_context('spawn')
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetchers, \
+            ProcessPoolExecutor(max_workers=plot_workers, mp_context=context) as plotters:
+        downloads = {fetchers.submit(open_sheet, entry['link'], entry['worksheet']): entry for entry in entries}
+        plots = {}
+        for download in as_completed(downloads):
+            entry = downloads[download]
+            survey_data = download.result()
+            digest = content_hash(entry['kind'], survey_data)
+            aggregate = None if force else cache.get(digest)
+            status = 'cached'
+            if aggregate is None:
+                aggregate = stage(entry['kind'], 1)(survey_data)
+                cache.put(digest, aggregate)
+                status = 'updated'
+            if status == 'updated' or not os.path.exists(entry['plot']):
+                plots[plotters.submit(render_plot, entry['kind'], aggregate, entry['plot'])] = entry['name']
+            results[entry['name']] = {'status': status, 'hash': digest, 'aggregate': aggregate, 'plot': entry['plot']}
+        for plot in as_completed(plots):
+            plot.result()
+    return results
+
+if __name__ == '__main__':
+    manifest = sys.argv[1] if len(sys.argv) > 1 else os.path.join('data', 'manifest.json')
+    for name, result in run_batch(load_manifest(manifest), force='--force' in sys.argv).items():
+        print(f"{name}: {result['status']} ({result['plot']})")
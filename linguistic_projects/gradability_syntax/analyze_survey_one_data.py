@@ -1,15 +1,36 @@
 from make_survey_one import open_sheet
-import matplotlib.pyplot as plt
-import seaborn as sns
+from response_aggregator import aggregate_responses
 import pandas as pd
 
-def get_data_from_survey(survey_data: pd.DataFrame, path: str = "data/faultless_results.jpg"):
-    survey_data['percent_yes'] = survey_data['percent_yes'].str.replace("%", "").astype(float)
+def faultless_category_order(survey_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compute the mean faultless disagreement rate of every (category, type), highest first.
+
+    :param survey_data: pd.DataFrame
+        The survey sheet with its percent_yes column.
+    :return: pd.DataFrame
+        One row per (category, type) with its mean percent_yes.
+    """
+    # Counts written by the response aggregator are already numbers; the Sheets formulas come back as "45%"
+    percent_yes = survey_data['percent_yes']
+    if not pd.api.types.is_numeric_dtype(percent_yes):
+        percent_yes = percent_yes.str.replace("%", "").astype(float)
 
     # Determine the order of semantic categories based on the mean faultless disagreement ratings
-    category_order = survey_data.groupby(['category', 'type'])['percent_yes'].mean().sort_values(ascending=False)
-    category_order = category_order.reset_index()
+    category_order = percent_yes.groupby([survey_data['category'], survey_data['type']]).mean()
+    return category_order.sort_values(ascending=False).reset_index()
+
+def plot_category_order(category_order: pd.DataFrame, path: str = "data/faultless_results.jpg"):
+    """
+    Plot the mean faultless disagreement rate of every (category, type) and save it to a file.
 
+    :param category_order: pd.DataFrame
+        The rates, as returned by faultless_category_order.
+    :param path: str
+        File path to save the plot.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     plt.figure(figsize=(15, 15))
 
     sns.set(font_scale=1.75)
@@ -27,6 +48,10 @@ def get_data_from_survey(survey_data: pd.DataFrame, path: str = "data/faultless_
     plt.title("Predicted Adjective Order based on Mean Faultless Disagreement Rate")
 
     plt.savefig(path)
+    plt.close('all')
+
+def get_data_from_survey(survey_data: pd.DataFrame, path: str = "data/faultless_results.jpg"):
+    plot_category_order(faultless_category_order(survey_data), path)
 
 if __name__ == '__main__':
     # Preprocess the data from Google Sheets into a Pandas DataFrame
@@ -34,5 +59,9 @@ if __name__ == '__main__':
     suvery_sheet_name = "Faultless Disagreement"
     survey_data = open_sheet(link, suvery_sheet_name)
 
+    # Count only the answers submitted since the last run, and write the counts back to the survey sheet
+    survey_data = aggregate_responses(link, survey_data, "data/faultless_responses.json",
+                                      survey_worksheet_name=suvery_sheet_name)
+
     # Visualize the Data
     get_data_from_survey(survey_data)
\ No newline at end of file
@@ -1,28 +1,31 @@
 from make_survey_one import open_sheet
-import matplotlib.pyplot as plt
-import seaborn as sns
 import pandas as pd
-from scipy.stats import kruskal
-from statistics import stdev as standard_deviation
+from survey_statistics import tally_scores, describe_groups, permutation_test, bootstrap_ci
 
-def get_scale_data(survey_data: pd.DataFrame, path: str = "data/word_order_results.jpg"):
+def scale_tally(survey_data: pd.DataFrame) -> pd.DataFrame:
     """
-    Generate a bar plot of mean preference ratings and save it to a file.
+    Count how many descriptions got each average preference rating.
 
     :param survey_data: pd.DataFrame
         Survey data containing the Likert scale ratings.
+    :return: pd.DataFrame
+        The count of each rating from 1 to 5.
+    """
+    return pd.DataFrame({'Rating': [*range(1, 6)], 'Average': tally_scores(survey_data['average_score'])})
+
+def plot_scale_tally(survey_data_averages: pd.DataFrame, path: str = "data/word_order_results.jpg"):
+    """
+    Generate a bar plot of mean preference ratings and save it to a file.
+
+    :param survey_data_averages: pd.DataFrame
+        The count of each rating, as returned by scale_tally.
     :param path: str
         File path to save the plot.
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     plt.clf()
     plt.figure(figsize=(9, 7))
-    # Calculate the mean preference ratings for each description
-
-    survey_data_plot = survey_data['average_score']
-    averages = {i:0 for i in range(1,6)}
-    for score in list(survey_data_plot):
-        averages[score] += 1
-    survey_data_averages = {'Rating': [*range(1, 6)], 'Average': list(averages.values())}
 
     ax = sns.barplot(data=survey_data_averages,
                      x='Rating',
@@ -39,38 +42,43 @@ def get_scale_data(survey_data: pd.DataFrame, path: str = "data/word_order_resul
 
     # Show the plot
     plt.savefig(path)
+    plt.close('all')
+
+def get_scale_data(survey_data: pd.DataFrame, path: str = "data/word_order_results.jpg"):
+    """
+    Generate a bar plot of mean preference ratings and save it to a file.
+
+    :param survey_data: pd.DataFrame
+        Survey data containing the Likert scale ratings.
+    :param path: str
+        File path to save the plot.
+    """
+    # Calculate the mean preference ratings for each description
+    plot_scale_tally(scale_tally(survey_data), path)
 
 if __name__ == '__main__':
     link = "https://docs.google.com/spreadsheets/d/1jxXRnLCp8mHE2MvJ5C8CwXuzFEj36_2tT0MFAaCtBp4/edit#gid=0"
     survey_sheet_name = "Word Order Preference"
     survey_data = open_sheet(link, survey_sheet_name)
 
-    average = lambda values: round(sum(values) / len(values), 2)
-    find_statistical_significance = lambda category_1, category_2, neutral_category: kruskal(category_1, neutral_category, category_2)
-
-    # Participants that preferred the alternate word order
-    alt_preference = survey_data['1'].tolist() + survey_data['2'].tolist()
-
-    # Participants that preferred neither
-    neutral_preference = survey_data['3'].tolist()
-
-    # Participants that preferred the Scontras and Cinque word order
-    scontras_preference = survey_data['4'].tolist() + survey_data['5'].tolist()
-
-    mean_alt = average(alt_preference)
-    sd_alt = standard_deviation(alt_preference)
-    print("Alt_Preference (M: %.2f, SD: %.2f)\n" % (mean_alt, sd_alt))
-
-    mean_neutral = average(neutral_preference)
-    sd_neutral = standard_deviation(neutral_preference)
-    print("Neutral_Preference (M: %.2f, SD: %.2f)\n" % (mean_neutral, sd_neutral))
-
-    mean_scontras = average(scontras_preference)
-    sd_scontras = standard_deviation(scontras_preference)
-    print("Scontras_Preference (M: %.2f, SD: %.2f)\n" % (mean_scontras, sd_scontras))
-
-    statistic, p_value = find_statistical_significance(alt_preference, scontras_preference, neutral_preference)
-    print(f"Kruskall statistic: {statistic}")
-    print(f"P-value: {p_value}")
+    preferences = {
+        # Participants that preferred the alternate word order
+        'Alt_Preference': survey_data[['1', '2']].to_numpy(dtype=float).ravel(order='F'),
+        # Participants that preferred neither
+        'Neutral_Preference': survey_data['3'].to_numpy(dtype=float),
+        # Participants that preferred the Scontras and Cinque word order
+        'Scontras_Preference': survey_data[['4', '5']].to_numpy(dtype=float).ravel(order='F'),
+    }
+
+    descriptives = describe_groups(preferences).join(bootstrap_ci(preferences, seed=58)[['low', 'high']])
+    for name, row in descriptives.iterrows():
+        print("%s (M: %.2f, SD: %.2f, 95%% CI: [%.2f, %.2f])\n"
+              % (name, row['mean'], row['sd'], row['low'], row['high']))
+
+    test = permutation_test({name: preferences[name] for name in ('Alt_Preference', 'Scontras_Preference',
+                                                                  'Neutral_Preference')}, seed=58)
+    print(f"Kruskall statistic: {test['statistic']}")
+    print(f"P-value: {test['p_value']}")
+    print(f"Permutation p-value: {test['permutation_p_value']}")
 
     get_scale_data(survey_data)
\ No newline at end of file
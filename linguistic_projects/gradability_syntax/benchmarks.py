@@ -0,0 +1,200 @@
+from dependencies import add_module_path
+
+# Add the relative path to the helpful_modules folder; its modules are only imported when first used
+add_module_path()
+
+import argparse
+import json
+import math
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from make_survey_one import get_samples, write_questions, build_survey, check_sample_size, write_new_sheet, \
+    open_sheet
+from make_survey_two import get_survey_data
+from stimulus_index import StimulusIndex
+
+# Sizes of the synthetic stimulus sheets, in rows
+SIZES = (10 ** 3, 10 ** 5, 10 ** 6)
+
+# A benchmark regresses when it is this much slower than its baseline
+THRESHOLD = 0.25
+
+CATEGORIES = ['age', 'physical', 'color', 'shape', 'size', 'value', 'speed', 'human propensity', 'texture']
+TYPES = ['relative', 'absolute', 'minimum', 'maximum']
+
+def synthetic_sheet(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate a stimulus sheet with one word per row, a tenth of them nouns and the rest adjectives spread over the
+    usual categories and types.
+
+    :param rows: int
+        The number of rows.
+    :param seed: int
+        The random seed.
+    :return: pd.DataFrame
+        The sheet, typed like a parsed stimulus sheet.
+    """
+    rng = np.random.default_rng(seed)
+    nouns = rng.random(rows) < 0.1
+    categories = np.array(CATEGORIES)[rng.integers(0, len(CATEGORIES), rows)]
+    types = np.array(TYPES)[rng.integers(0, len(TYPES), rows)]
+    return pd.DataFrame({
+        'word': pd.Series(np.arange(rows)).astype(str).radd('word'),
+        'class': pd.Categorical(np.where(nouns, 'noun', 'adjective')),
+        'category': pd.Categorical(np.where(nouns, 'thing', categories)),
+        'type': pd.Categorical(np.where(nouns, 'noun', types)),
+        'animate': rng.random(rows) < 0.3,
+    })
+
+def benchmark_cases(sheet: pd.DataFrame, directory: str) -> dict:
+    """
+    Build the benchmarks of one sheet. The number of survey questions grows with the sheet, one per hundred rows,
+    except in write_questions, which samples its fixed-size pool of adjectives first.
+
+    :param sheet: pd.DataFrame
+        The synthetic stimulus sheet.
+    :param directory: str
+        The folder of the local fake Sheets backend.
+    :return: dict
+        A function without arguments for each benchmark name.
+    """
+    n = max(len(sheet) // 100, 10)
+    nouns = sheet.loc[sheet['class'] == 'noun', 'word'].tolist()
+    age_adjectives = sheet.loc[sheet['category'] == 'age', 'word'].tolist()
+    physical_adjectives = sheet.loc[sheet['category'] == 'physical', 'word'].tolist()
+    adjectives = sheet.loc[sheet['class'] == 'adjective', 'word'].to_numpy()[:n]
+    index = StimulusIndex(sheet)
+    phrases = list(index.questions(adjectives, random_state=0).itertuples(index=False, name=None))
+    survey = build_survey(phrases)
+    uri = 'fake-sheets://' + directory
+    return {
+        'get_samples': lambda: get_samples(sheet, sample_size=n, random_state=0),
+        'write_questions': lambda: write_questions(sheet, n=n, random_state=0),
+        'stimulus_questions': lambda: StimulusIndex(sheet).questions(adjectives, random_state=0),
+        'get_survey_data': lambda: get_survey_data(nouns, age_adjectives, physical_adjectives, n=n, random_seed=0),
+        'build_survey': lambda: build_survey(phrases),
+        'check_sample_size': lambda: check_sample_size(sheet, survey, plot=False),
+        'write_new_sheet': lambda: write_new_sheet(uri, 'Faultless Disagreement', survey),
+        'open_sheet': lambda: open_sheet(uri, 'Faultless Disagreement'),
+    }
+
+def time_call(function, repeat: int) -> list:
+    """
+    Time a function several times, after one untimed run that warms up caches and lazy imports.
+
+    :param function: callable
+        The function.
+    :param repeat: int
+        The number of runs.
+    :return: list
+        The duration of each run, in seconds.
+    """
+    function()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def run_benchmarks(sizes=SIZES, repeat: int = 3, only: list = None) -> dict:
+    """
+    Run every benchmark on a synthetic sheet of each size.
+
+    :param sizes: tuple
+        The sheet sizes, in rows.
+    :param repeat: int
+        The number of runs of each benchmark; the fastest one is reported.
+    :param only: list
+        The benchmarks to run, default is all of them.
+    :return: dict
+        The environment and one result per benchmark and size, with the scaling exponent between consecutive sizes.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            cases = benchmark_cases(synthetic_sheet(rows), directory)
+            for name, function in cases.items():
+                if only and name not in only:
+                    continue
+                durations = time_call(function, repeat)
+                results.append({'benchmark': name, 'rows': rows, 'seconds': min(durations),
+                                'median': statistics.median(durations), 'repeat': repeat})
+    add_scaling(results)
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'machine': platform.machine(), 'results': results}
+
+def add_scaling(results: list):
+    """
+    Add to each result how its time grew from the previous size of the same benchmark, as the exponent k of
+    time ~ rows^k; an exponent well above 1 is a super-linear slowdown.
+
+    :param results: list
+        The results, in increasing size for each benchmark.
+    """
+    previous = {}
+    for result in results:
+        before = previous.get(result['benchmark'])
+        if before is not None and before['seconds'] > 0 and result['seconds'] > 0:
+            result['scaling'] = math.log(result['seconds'] / before['seconds']) / \
+                math.log(result['rows'] / before['rows'])
+        previous[result['benchmark']] = result
+
+def compare_to_baseline(report: dict, baseline: dict, threshold: float = THRESHOLD) -> list:
+    """
+    Compare a report with a baseline report of the same benchmarks.
+
+    :param report: dict
+        The report returned by run_benchmarks.
+    :param baseline: dict
+        An earlier report.
+    :param threshold: float
+        A benchmark regresses when its time exceeds the baseline by more than this fraction.
+    :return: list
+        The regressions, with the time of both reports and their ratio.
+    """
+    baseline_seconds = {(result['benchmark'], result['rows']): result['seconds'] for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        before = baseline_seconds.get((result['benchmark'], result['rows']))
+        if before is None or before <= 0:
+            continue
+        result['baseline'] = before
+        result['ratio'] = result['seconds'] / before
+        if result['ratio'] > 1 + threshold:
+            regressions.append({'benchmark': result['benchmark'], 'rows': result['rows'],
+                                'seconds': result['seconds'], 'baseline': before, 'ratio': result['ratio']})
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the survey pipeline on synthetic stimulus sheets.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', help="Names of the benchmarks to run.")
+    parser.add_argument('--output', default='benchmarks.json', help="Where to write the JSON report.")
+    parser.add_argument('--baseline', help="An earlier JSON report to compare with.")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    arguments = parser.parse_args()
+
+    report = run_benchmarks(arguments.sizes, repeat=arguments.repeat, only=arguments.only)
+    regressions = []
+    if arguments.baseline:
+        with open(arguments.baseline) as f:
+            regressions = compare_to_baseline(report, json.load(f), arguments.threshold)
+    report['regressions'] = regressions
+    with open(arguments.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for result in report['results']:
+        scaling = f", scaling {result['scaling']:.2f}" if 'scaling' in result else ''
+        print(f"{result['benchmark']:<18} {result['rows']:>8} rows: {result['seconds']:.4f}s{scaling}")
+    for regression in regressions:
+        print(f"Regression: {regression['benchmark']} at {regression['rows']} rows is "
+              f"{regression['ratio']:.2f}x its baseline")
+    sys.exit(1 if regressions else 0)
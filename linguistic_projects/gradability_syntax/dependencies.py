@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+from importlib import metadata
+
+# Get the absolute path of the current script
+script_path = os.path.dirname(os.path.abspath(__file__))
+script_path = '/'.join(script_path.split('/')[:-2])
+
+# Construct the relative path to the module
+module_path = os.path.join(script_path, 'helpful_modules')
+
+# The requirements of the imported module from another directory
+dependencies_file = os.path.join(module_path, "requirements.txt")
+
+def add_module_path():
+    """
+    Add the helpful_modules folder to sys.path so its modules can be imported when first needed.
+    """
+    if module_path not in sys.path:
+        sys.path.append(module_path)
+
+def check_dependencies(dependencies_file: str = dependencies_file, install: bool = True) -> list:
+    """
+    Check that every requirement in a requirements file is installed and optionally install the missing ones.
+
+    :param dependencies_file: str
+        The requirements file to check, default is the one of helpful_modules.
+    :param install: bool
+        Whether to pip install the missing requirements.
+    :return: list
+        The requirements that were missing.
+    """
+    with open(dependencies_file) as f:
+        dependencies = [line.strip() for line in f.read().splitlines() if line.strip()]
+
+    # Check if dependencies are installed
+    missing_dependencies = []
+    for dependency in dependencies:
+        try:
+            metadata.distribution(dependency)
+        except metadata.PackageNotFoundError:
+            missing_dependencies.append(dependency)
+
+    if missing_dependencies and install:
+        print("Installing missing dependencies...")
+        install_command = [sys.executable, "-m", "pip", "install", "-r", dependencies_file]
+        subprocess.run(install_command, check=True)
+        print("Dependencies installed.")
+    return missing_dependencies
+
+if __name__ == '__main__':
+    # Check that all dependencies are present for the imported module from another directory
+    check_dependencies(dependencies_file, install='--no-install' not in sys.argv)
@@ -1,109 +1,18 @@
-import sys
-import os
-import pkg_resources
-import subprocess
-
-# Get the absolute path of the current script
-script_path = os.path.dirname(os.path.abspath(__file__))
-script_path = '/'.join(script_path.split('/')[:-2])
-
-# Construct the relative path to the module
-module_path = os.path.join(script_path, 'helpful_modules')
-
-# Add the relative path to the sys.path list
-sys.path.append(module_path)
-
-def check_dependencies(dependencies_file):
-    with open(dependencies_file) as f:
-        dependencies = f.read().splitlines()
-
-    # Check if dependencies are installed
-    missing_dependencies = []
-    for dependency in dependencies:
-        try:
-            pkg_resources.get_distribution(dependency)
-        except pkg_resources.DistributionNotFound:
-            missing_dependencies.append(dependency)
-
-    if missing_dependencies:
-        print("Installing missing dependencies...")
-        install_command = ["pip", "install", "-r", dependencies_file]
-        subprocess.run(install_command, check=True)
-        print("Dependencies installed.")
-
-# Check that all dependencies are present for the imported module from another directory
-dependencies_file = os.path.join(module_path, "requirements.txt")
-check_dependencies(dependencies_file)
+from dependencies import add_module_path
 
-import pandas as pd
-import string, os, random, re
-from google_drive import GoogleSheetsAPI, GoogleDriveAPI
-import matplotlib.pyplot as plt
-
-def count_syllables(word):
-    """
-    Count the number of syllables in a word using the syllable counting algorithm.
-
-    :param word: str
-        The word to count syllables for.
-    :return: int
-        The number of syllables in the word.
-    """
-    word = word.lower()
-    if word == "i":
-        return 1
-
-    count = 0
-    vowels = 'aeiouy'
-    if word[0] in vowels:
-        count += 1
-
-    for index in range(1, len(word)):
-        if word[index] in vowels and word[index - 1] not in vowels:
-            count += 1
-
-    if word.endswith('e'):
-        count -= 1
-
-    if word.endswith('le') and len(word) > 2 and word[-3] not in vowels:
-        count += 1
-
-    return count
+# Add the relative path to the helpful_modules folder; its modules are only imported when first used
+add_module_path()
 
-def is_word_with_multiple_syllables(word):
-    """
-    Check if a word has multiple syllables.
-
-    :param word: str
-        The word to check.
-    :return: bool
-        True if the word has multiple syllables, False otherwise.
-    """
-    syllable_count = count_syllables(word)
-    if syllable_count > 1:
-        return True
-    else:
-        return False
-
-def get_adjective_modifier(adjective):
-    """
-    Get the comparative form of an adjective.
+import numpy as np
+import pandas as pd
+import os, random, asyncio
+from templates import FAULTLESS_DISAGREEMENT
+from instrumentation import traced
+from morphology import count_syllables, is_word_with_multiple_syllables, get_adjective_modifier, \
+    count_syllables_batch, get_adjective_modifiers
 
-    :param adjective: str
-        The adjective to modify.
-    :return: str
-        The modified adjective.
-    """
-    result = is_word_with_multiple_syllables(adjective)
-    if result:
-        return f"more {adjective}"
-    else:
-        if adjective == "best":
-            return "better"
-        elif re.search("e$", adjective):
-            return f"{adjective}r"
-        else:
-            return f"{adjective}er"
+# Column types of the stimulus sheets, applied as the sheet is parsed
+STIMULUS_DTYPES = {'animate': 'bool', 'class': 'category', 'category': 'category', 'type': 'category'}
 
 def random_string(cls: list, seed: int = None) -> str:
     """
@@ -112,12 +21,11 @@ def random_string(cls: list, seed: int = None) -> str:
     :param cls: list
         The list of strings.
     :param seed: int
-        The seed value to initialize the random number generator.
+        The seed value to initialize the random number generator; the global random state is left untouched.
     :return: str
         A random string from the list.
     """
-    random.seed(seed)
-    return random.choice(cls)
+    return random.Random(seed).choice(cls)
 
 def create_phrases(nouns: list, adjective: str, seed: int = None) -> str:
     """
@@ -146,15 +54,36 @@ def write_phrase(adjective: str, noun: str) -> str:
     :return: str
         The constructed phrase.
     """
-    adjective = get_adjective_modifier(adjective)
-    phrase = f"""Mary thinks this {noun} is {adjective} than that {noun}.
-John doesn't think so.
-Can they both be right or must one be wrong?"""
-    return phrase
+    return FAULTLESS_DISAGREEMENT.format(noun=noun, comparative=get_adjective_modifier(adjective))
 
-def get_samples(df, sample_size=45, all_categories=True, random_state=None):
+def allocate_samples(sizes, sample_size: int) -> np.ndarray:
     """
-    Get a sample of data from a DataFrame.
+    Split a sample size across strata in proportion to their sizes, using largest-remainder rounding so that the
+    allocations add up to exactly the sample size.
+
+    :param sizes: array-like
+        The number of rows in each stratum.
+    :param sample_size: int
+        The size of the sample; capped at the total number of rows.
+    :return: np.ndarray
+        The number of rows to draw from each stratum.
+    """
+    sizes = np.asarray(sizes, dtype=int)
+    total = sizes.sum()
+    if total == 0:
+        return np.zeros(len(sizes), dtype=int)
+    quotas = sizes * (min(sample_size, total) / total)
+    allocation = np.floor(quotas).astype(int)
+    remainder = min(sample_size, total) - allocation.sum()
+    largest_remainders = np.argsort(-(quotas - allocation), kind='stable')
+    allocation[largest_remainders[:remainder]] += 1
+    return allocation
+
+@traced()
+def get_samples(df, sample_size=45, all_categories=True, random_state=None, strata=('category', 'type', 'animate')):
+    """
+    Get a stratified sample of data from a DataFrame. Every stratum gets a share of the sample in proportion to its
+    size, and all strata are drawn in one vectorized step.
 
     :param df: pd.DataFrame
         The DataFrame to sample from.
@@ -162,30 +91,31 @@ def get_samples(df, sample_size=45, all_categories=True, random_state=None):
         The size of the sample.
     :param all_categories: bool
         Whether to sample from all categories or only specific categories.
-    :param random_state: int
+    :param random_state: int or np.random.Generator
         The random seed for reproducible sampling.
+    :param strata: tuple
+        The columns whose combinations define the strata; columns missing from the DataFrame are ignored.
     :return: pd.DataFrame
-        The sampled data.
-    """
-    sampled_data = pd.DataFrame()
-    if all_categories:
-        category_samples = df['category'].value_counts(normalize=True) * sample_size
-        type_samples = df.loc[df['category'].isin(category_samples.index)]['type'].value_counts(
-            normalize=True) * sample_size
-        for type in type_samples.index:
-            type_data = df[df['type'] == type] \
-                .sample(int(type_samples[type]),
-                        random_state=random_state)
-            sampled_data = pd.concat([sampled_data, type_data], ignore_index=True)
-    else:
-        category_samples = df.loc[df['category'].isin(['age', 'physical'])]['category'].value_counts(
-            normalize=True) * sample_size
-    for category in category_samples.index:
-        category_data = df[df['category'] == category] \
-            .sample(int(category_samples[category]),
-                    random_state=random_state)
-        sampled_data = pd.concat([sampled_data, category_data], ignore_index=True)
-    return sampled_data
+        The sampled data, grouped by stratum.
+    """
+    if not all_categories:
+        df = df.loc[df['category'].isin(['age', 'physical'])]
+    strata = [column for column in strata if column in df.columns]
+    if len(df) == 0 or not strata:
+        return df.sample(min(sample_size, len(df)), random_state=np.random.default_rng(random_state)) \
+            .reset_index(drop=True)
+
+    groups = df.groupby(strata, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    sizes = np.bincount(groups)
+    allocation = allocate_samples(sizes, sample_size)
+
+    # Shuffle inside every stratum by sorting on random keys, then keep the first rows of each stratum
+    rng = np.random.default_rng(random_state)
+    order = np.lexsort((rng.random(len(df)), groups))
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    rank = np.arange(len(df)) - starts[groups[order]]
+    selected = order[rank < allocation[groups[order]]]
+    return df.iloc[selected].reset_index(drop=True)
 
 def get_data(df: pd.DataFrame, cls: str, animate=False, sample=False, sample_size=45, random_state=None) -> list:
     """
@@ -201,17 +131,18 @@ def get_data(df: pd.DataFrame, cls: str, animate=False, sample=False, sample_siz
         Whether to sample the data.
     :param sample_size: int
         The size of the sample.
-    :param random_state: int
+    :param random_state: int or np.random.Generator
         The random seed for reproducible sampling.
     :return: list
         A list of words that match the specified criteria.
     """
     if sample:
-        df = get_samples(df, sample_size, random_state=random_state)
+        df = get_samples(df.loc[df['class'] == cls], sample_size, random_state=random_state)
     if animate:
         return df.loc[(df['class'] == cls) & (df['animate'] == True)]['word'].tolist()
     return df.loc[(df['class'] == cls)]['word'].tolist()
 
+@traced()
 def write_questions(sheet, n=45, random_state=None):
     """
     Write survey questions based on the sheet.
@@ -220,153 +151,361 @@ def write_questions(sheet, n=45, random_state=None):
         The sheet containing the data.
     :param n: int
         The number of questions to write.
-    :param random_state: int
+    :param random_state: int or np.random.Generator
         The random seed for reproducible question selection.
     :return: list
         A list of generated phrases along with their category and type.
     """
-    animate_nouns = get_data(sheet, 'noun', animate=True)
-    all_nouns = get_data(sheet, 'noun')
-    adjectives = get_data(sheet, 'adjective', sample=True, random_state=random_state)
-    phrases = []
-    for adjective in adjectives[:n]:
-        animate = sheet.loc[sheet['word'] == adjective]['animate'].values[0]
-        if animate:
-            phrase = create_phrases(animate_nouns, adjective)
-        else:
-            phrase = create_phrases(all_nouns, adjective)
-        category, type = sheet.loc[sheet['word'] == adjective][['category', 'type']].values.tolist()[0]
-        phrases.append((phrase, category, type))
-    return phrases
-
-def open_sheet(link: str, worksheet_name: str) -> pd.DataFrame:
+    from stimulus_index import StimulusIndex
+    index = StimulusIndex(sheet)
+    # One generator for both draws, so the nouns do not replay the stream that sampled the adjectives
+    rng = np.random.default_rng(random_state)
+    adjectives = get_data(sheet, 'adjective', sample=True, random_state=rng)
+    questions = index.questions(adjectives[:n], random_state=rng)
+    return list(questions.itertuples(index=False, name=None))
+
+@traced()
+def open_sheet(link: str, worksheet_name: str, use_cache: bool = True) -> pd.DataFrame:
     """
     Open a Google Sheet and convert it to a DataFrame.
 
     :param link: str
-        The link to the Google Sheet.
+        The link to the Google Sheet, or a local output URI as accepted by survey_output.open_writer.
     :param worksheet_name: str
         The name of the worksheet to open.
+    :param use_cache: bool
+        Whether to read through the local sheet cache instead of always downloading the worksheet.
     :return: pd.DataFrame
         The converted DataFrame.
     """
-    return GoogleSheetsAPI(link, worksheet_name=worksheet_name).open_csv()
+    if not link.startswith(('http://', 'https://')):
+        from survey_output import read_survey
+        return read_survey(link, worksheet_name)
+    from google_drive import GoogleSheetsAPI
+    from sheet_cache import default_cache
+    cache = default_cache() if use_cache else None
+    return GoogleSheetsAPI(link, worksheet_name=worksheet_name).open_csv(cache=cache)
+
+def iter_sheet(link: str, worksheet_name: str, page_size: int = 5000, dtypes: dict = None):
+    """
+    Read a Google Sheet page by page, for worksheets too large to hold as one DataFrame.
+
+    :param link: str
+        The link to the Google Sheet.
+    :param worksheet_name: str
+        The name of the worksheet to read.
+    :param page_size: int
+        The number of rows per page.
+    :param dtypes: dict
+        The column types to apply to each page, e.g. STIMULUS_DTYPES.
+    :return: generator
+        DataFrame chunks of at most page_size rows.
+    """
+    from google_drive import GoogleSheetsAPI
+    return GoogleSheetsAPI(link, worksheet_name=worksheet_name).iter_csv(page_size=page_size, dtypes=dtypes)
+
+def open_sheets(link: str, worksheet_names: list, use_cache: bool = True, max_concurrency: int = 4) -> dict:
+    """
+    Open several worksheets of a Google Sheet concurrently and convert each of them to a DataFrame.
+
+    :param link: str
+        The link to the Google Sheet.
+    :param worksheet_names: list
+        The names of the worksheets to open.
+    :param use_cache: bool
+        Whether to read through the local sheet cache instead of always downloading the worksheets.
+    :param max_concurrency: int
+        The maximum number of worksheets downloaded at once.
+    :return: dict
+        The converted DataFrames keyed by worksheet name.
+    """
+    from google_drive import AsyncGoogleSheetsAPI
+    from sheet_cache import default_cache
+    cache = default_cache() if use_cache else None
+    sheets = AsyncGoogleSheetsAPI(link, max_concurrency=max_concurrency, cache=cache)
+    return asyncio.run(sheets.open_csvs(worksheet_names))
 
-def write_new_sheet(link: str, worksheet_name: str, df: pd.DataFrame):
+def write_new_sheets(link: str, frames: dict, max_concurrency: int = 4):
     """
-    Write a new sheet to Google Drive.
+    Write several DataFrames to their own worksheets concurrently, creating the worksheets that do not exist yet.
 
     :param link: str
         The link to the Google Sheet.
+    :param frames: dict
+        The DataFrames to write keyed by worksheet name.
+    :param max_concurrency: int
+        The maximum number of worksheets written at once.
+    """
+    from google_drive import AsyncGoogleSheetsAPI
+    asyncio.run(AsyncGoogleSheetsAPI(link, max_concurrency=max_concurrency).write_sheets(frames))
+
+@traced()
+def write_new_sheet(link: str, worksheet_name: str, df):
+    """
+    Write a new sheet to Google Drive, or to the local output a URI selects.
+
+    :param link: str
+        The link to the Google Sheet, or a local output URI as accepted by survey_output.open_writer.
     :param worksheet_name: str
         The name of the worksheet to write.
-    :param df: pd.DataFrame
-        The DataFrame to write.
+    :param df: pd.DataFrame or iterable
+        The DataFrame to write, or its rows in chunks of DataFrames.
     """
-    try:
-        GoogleSheetsAPI(link).new_sheet(worksheet_name, df, format_sheet=False)
-    except:
-        GoogleSheetsAPI(link).update_sheet(worksheet_name, df, format_sheet=False)
+    from survey_output import write_survey
+    write_survey(link, worksheet_name, df)
 
-def new_data(data: dict = {}, **kwargs):
+def new_data(data: dict = None, **kwargs) -> dict:
     """
     Add new data to a dictionary.
 
     :param data: dict
-        The dictionary to add the data to.
+        The dictionary to add the data to; a new one is created if not given.
     :param kwargs: dict
         The data to add, with keys as the data names and values as the data values.
+    :return: dict
+        The dictionary with the data added.
     """
+    if data is None:
+        data = {}
     for key, value in kwargs.items():
         if key in data.keys():
             data[key].append(value)
         else:
             data[key] = [value]
+    return data
 
 def get_letter(i):
     """
     Get the letter representation for a given index.
 
     :param i: int
-        The index to get the letter for.
+        The index of the question; question 0 is answered in column B of the answers sheet.
     :return: str
         The letter representation.
     """
-    letters = [letter for letter in string.ascii_uppercase]
-    if i+1 not in range(len(letters)):
-        if i in range(len(letters) * 2):
-            i -= len(letters)
-            letter = "A" + letters[i]
-        else:
-            i -= len(letters) * 2
-            letter = "B" + letters[i]
-    else:
-        letter = letters[i + 1]
-    return letter
+    from survey_builder import column_letter
+    return column_letter(i + 1)
+
+@traced()
+def build_survey(phrases: list, answers_sheet: str = 'Faultless_Disagreement_Answers',
+                 formulas: bool = False) -> pd.DataFrame:
+    """
+    Build the faultless disagreement survey sheet. The answer counts start at zero and are filled in as numbers by
+    response_aggregator.aggregate_responses; with formulas, they are COUNTIF formulas that Sheets keeps up to date
+    instead, at the cost of rescanning every answer column on each recalculation.
+
+    :param phrases: list
+        The phrase, category and type of each question, as returned by write_questions.
+    :param answers_sheet: str
+        The name of the sheet the form answers are collected in.
+    :param formulas: bool
+        Whether to tally the answers with Sheets formulas rather than numbers, default is False.
+    :return: pd.DataFrame
+        One row per question.
+    """
+    from survey_builder import SurveyBuilder, column_letters
+    questions = pd.DataFrame(phrases, columns=['phrase', 'category', 'type'])
+    builder = SurveyBuilder(len(questions))
+    builder.add('question_type', 'multiple choice') \
+        .add('phrase', questions['phrase']) \
+        .add('option_1', 'They can both be right.') \
+        .add('option_2', 'One of them must be wrong.') \
+        .add('required', True) \
+        .add('category', questions['category']) \
+        .add('type', questions['type'])
+    if not formulas:
+        builder.add('yes', 0).add('no', 0).add('total', 0).add('percent_yes', np.nan)
+        return builder.build()
+    answer_columns = column_letters(np.arange(len(questions)) + 1)
+    builder.add_formula('yes', 'COUNTIF({sheet}!{answer}:{answer}, "They can both be right.")',
+                        sheet=answers_sheet, answer=answer_columns)
+    builder.add_formula('no', 'COUNTIF({sheet}!{answer}:{answer}, "One of them must be wrong.")',
+                        sheet=answers_sheet, answer=answer_columns)
+    builder.add_formula('total', 'SUM({yes}{row},{no}{row})')
+    builder.add_formula('percent_yes', '{yes}{row}/{total}{row}')
+    return builder.build()
+
+def compare_distributions(full: pd.Series, sample: pd.Series) -> dict:
+    """
+    Compares the distribution of one column in the sampled stimuli with its distribution in the larger set.
+
+    :param full: pd.Series
+        The column in the original set of stimuli
+    :param sample: pd.Series
+        The column in the sampled set of stimuli
+    :return: dict
+        The proportions of each value in both sets, the chi-square goodness of fit of the sample counts against the
+        proportions of the larger set with its p-value, and the KL divergence of the sample from the larger set.
+    """
+    from scipy.stats import chi2
+    counts = pd.concat([full.value_counts(), sample.value_counts()], axis=1, keys=['full', 'sample']).fillna(0)
+    counts = counts.loc[counts.sum(axis=1) > 0]
+    observed = counts['sample'].to_numpy(dtype=float)
+    full_pct = counts['full'].to_numpy(dtype=float) / counts['full'].sum()
+    sample_pct = observed / observed.sum()
+    expected = full_pct * observed.sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi_square = np.where(observed > 0, (observed - expected) ** 2 / expected, expected).sum()
+        kl = np.where(sample_pct > 0, sample_pct * np.log(sample_pct / full_pct), 0.0).sum()
+    degrees_of_freedom = max(len(counts) - 1, 1)
+    return {'proportions': pd.DataFrame({'full': full_pct, 'sample': sample_pct}, index=counts.index),
+            'chi_square': float(chi_square),
+            'p_value': float(chi2.sf(chi_square, degrees_of_freedom)),
+            'kl_divergence': float(kl)}
+
+def representativeness_report(sheet_1: pd.DataFrame, sheet_2: pd.DataFrame, columns=('category', 'type'),
+                              alpha: float = 0.05) -> dict:
+    """
+    Compares sampled stimuli with larger set without plotting, so that many samples can be validated quickly.
+
+    :param sheet_1: pd.DataFrame
+        Original set of stimuli
+    :param sheet_2: pd.DataFrame
+        Sampled set of stimuli
+    :param columns: tuple
+        The columns whose distributions are compared
+    :param alpha: float
+        A column is flagged when its chi-square p-value falls below alpha
+    :return: dict
+        The comparison of each column, as returned by compare_distributions, plus 'flagged', the columns whose
+        sample is not representative.
+    """
+    adjectives = sheet_1.loc[sheet_1['class'] == 'adjective']
+    report = {column: compare_distributions(adjectives[column], sheet_2[column]) for column in columns}
+    report['flagged'] = [column for column in columns if report[column]['p_value'] < alpha]
+    return report
 
-def check_sample_size(sheet_1: pd.DataFrame, sheet_2: pd.DataFrame):
+def plot_distributions(report: dict, path: str = 'data/'):
     """
-    Compares sampled stimuli with larger set and plots them to ensure that the samples pulled are representative.
+    Plots the proportions of every column in a representativeness report and saves them as
+    <column>_distribution.jpg.
+
+    :param report: dict
+        The report returned by representativeness_report
+    :param path: str
+        The folder to save the plots in
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    for column, comparison in report.items():
+        # Skip the flagged list and the handle of the plots
+        if not isinstance(comparison, dict):
+            continue
+        comparison['proportions'].plot(kind='bar', figsize=(10, 6))
+        plt.xticks(rotation=45)
+        plt.savefig(os.path.join(path, f"{column}_distribution.jpg"))
+        plt.close('all')
+
+@traced()
+def check_sample_size(sheet_1: pd.DataFrame, sheet_2: pd.DataFrame, plot: bool = None, background: bool = True,
+                      path: str = 'data/', alpha: float = 0.05) -> dict:
+    """
+    Compares sampled stimuli with larger set to ensure that the samples pulled are representative, and plots them.
 
     :param sheet_1: pd.DataFrame
         Original set of stimuli
     :param sheet_2: pd.DataFrame
         Sampled set of stimuli
+    :param plot: bool
+        Whether to plot the distributions; default only plots when a column is flagged
+    :param background: bool
+        Whether to plot in a separate process, so that the survey can be written while the plots render; wait on
+        report['plots'] to know they are saved and to see any error
+    :param path: str
+        The folder to save the plots in
+    :param alpha: float
+        A column is flagged when its chi-square p-value falls below alpha
+    :return: dict
+        The report returned by representativeness_report, with the Future of the background plots under 'plots', or
+        None when nothing is plotted in the background
+    """
+    report = representativeness_report(sheet_1, sheet_2, alpha=alpha)
+    plots = None
+    if plot or (plot is None and report['flagged']):
+        if background:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers=1)
+            plots = executor.submit(plot_distributions, dict(report), path)
+            # The worker exits once the plots are done; the interpreter waits for it at exit
+            executor.shutdown(wait=False)
+        else:
+            plot_distributions(report, path)
+    report['plots'] = plots
+    return report
+
+def faultless_variant(variant: int, seed_sequence, sheet: pd.DataFrame, n: int = 45) -> pd.DataFrame:
+    """
+    Build the survey of one participant group, with its own sample of adjectives, nouns and question order.
+
+    :param variant: int
+        The index of the participant group.
+    :param seed_sequence: np.random.SeedSequence
+        The random stream of this group.
+    :param sheet: pd.DataFrame
+        The stimulus sheet.
+    :param n: int
+        The number of questions.
+    :return: pd.DataFrame
+        The survey of this group.
     """
-    plt.clf()
-    sheet_1_category = sheet_1.loc[sheet_1['class']=='adjective']['category'].value_counts()
-    sheet_2_category = sheet_2['category'].value_counts()
-    sheet_1_type = sheet_1.loc[sheet_1['class']=='adjective']['type'].value_counts()
-    sheet_2_type = sheet_2['type'].value_counts()
+    rng = np.random.default_rng(seed_sequence)
+    phrases = write_questions(sheet, n=n, random_state=rng)
+    return build_survey([phrases[i] for i in rng.permutation(len(phrases))])
 
-    # combine counts into a single DataFrame and fill NaN values with 0
-    counts_1 = pd.concat([sheet_1_category, sheet_2_category], axis=1).fillna(0)
-    counts_2 = pd.concat([sheet_1_type, sheet_2_type], axis=1).fillna(0)
+def counterbalanced_surveys(phrases: list, k: int) -> list:
+    """
+    Build k surveys with the same questions, their order counterbalanced across groups with a Latin square.
 
-    # calculate percentage of total for each category and type
-    counts_pct_1 = counts_1.apply(lambda x: x / x.sum())
-    counts_pct_2 = counts_2.apply(lambda x: x / x.sum())
+    :param phrases: list
+        The phrase, category and type of each question, as returned by write_questions.
+    :param k: int
+        The number of participant groups.
+    :return: list
+        The survey of each group.
+    """
+    from survey_variants import latin_square_orders
+    return [build_survey([phrases[i] for i in order]) for order in latin_square_orders(len(phrases), k)]
 
-    # plot the resulting distributions
-    plt.figure()
-    counts_pct_1.plot(kind='bar', figsize=(10, 6))
-    plt.xticks(rotation=45)
-    plt.savefig("data/category_distribution.jpg")
+def make_variants(sheet: pd.DataFrame, k: int, n: int = 45, seed: int = None, workers: int = None) -> list:
+    """
+    Build k randomized surveys, one per participant group, in parallel. The result only depends on the seed, not on
+    the number of workers.
 
-    plt.figure()
-    counts_pct_2.plot(kind='bar', figsize=(10, 6))
-    plt.xticks(rotation=45)
-    plt.savefig("data/type_distribution.jpg")
+    :param sheet: pd.DataFrame
+        The stimulus sheet.
+    :param k: int
+        The number of participant groups.
+    :param n: int
+        The number of questions per survey.
+    :param seed: int
+        The study seed.
+    :param workers: int
+        The number of worker processes.
+    :return: list
+        The survey of each group.
+    """
+    from survey_variants import generate_variants
+    return generate_variants(faultless_variant, k, seed=seed, workers=workers, sheet=sheet, n=n)
 
 def make_directory_if_not_exist(path):
     os.makedirs(path, exist_ok=True)
 
 if __name__ == '__main__':
+    from google_drive import coerce_frame
     link = "https://docs.google.com/spreadsheets/d/1jxXRnLCp8mHE2MvJ5C8CwXuzFEj36_2tT0MFAaCtBp4/edit#gid=0"
     stimuli_worksheet_name = "adjectives_to_combine"
     survey_worksheet_name = "Faultless Disagreement"
-    sheet = open_sheet(link, stimuli_worksheet_name)
-    sheet['animate'] = sheet['animate'].map({'TRUE': True, 'FALSE': False})
+    # Where the survey is written: the Google Sheet by default, or a local output such as csv://data or forms.json
+    output = os.environ.get('SURVEY_OUTPUT', link)
+    sheet = coerce_frame(open_sheet(link, stimuli_worksheet_name), STIMULUS_DTYPES)
     phrases = write_questions(sheet, random_state=145)
-    survey_data = {}
-    i = 0
-    for phrase, category, type in phrases:
-        letter = get_letter(i)
-        new_data(survey_data,
-                 question_type='multiple choice',
-                 phrase=phrase,
-                 option_1='They can both be right.',
-                 option_2='One of them must be wrong.',
-                 required=True,
-                 category=category,
-                 type=type,
-                 yes=f'COUNTIF(Faultless_Disagreement_Answers!{letter}:{letter}, "They can both be right.")',
-                 no=f'COUNTIF(Faultless_Disagreement_Answers!{letter}:{letter}, "One of them must be wrong.")',
-                 total=f"SUM(H{i + 2},I{i + 2})",
-                 percent_yes=f'H{i + 2}/J{i + 2}')
-        i += 1
-    survey_data = pd.DataFrame(survey_data)
+    survey_data = build_survey(phrases)
     path = 'data/'
     make_directory_if_not_exist(path)
-    check_sample_size(sheet, survey_data)
-    write_new_sheet(link, survey_worksheet_name, survey_data)
\ No newline at end of file
+    report = check_sample_size(sheet, survey_data, plot=True)
+    for column in report['flagged']:
+        print(f"The sampled {column} distribution differs from the stimuli (p = {report[column]['p_value']:.3f}).")
+    write_new_sheet(output, survey_worksheet_name, survey_data)
+    if report['plots'] is not None:
+        report['plots'].result()
\ No newline at end of file
@@ -1,43 +1,14 @@
-import sys
-import os
-import pkg_resources
-import subprocess
-
-# Get the absolute path of the current script
-script_path = os.path.dirname(os.path.abspath(__file__))
-script_path = '/'.join(script_path.split('/')[:-2])
-
-# Construct the relative path to the module
-module_path = os.path.join(script_path, 'helpful_modules')
-
-# Add the relative path to the sys.path list
-sys.path.append(module_path)
-
-def check_dependencies(dependencies_file):
-    with open(dependencies_file) as f:
-        dependencies = f.read().splitlines()
-
-    # Check if dependencies are installed
-    missing_dependencies = []
-    for dependency in dependencies:
-        try:
-            pkg_resources.get_distribution(dependency)
-        except pkg_resources.DistributionNotFound:
-            missing_dependencies.append(dependency)
-
-    if missing_dependencies:
-        print("Installing missing dependencies...")
-        install_command = ["pip", "install", "-r", dependencies_file]
-        subprocess.run(install_command, check=True)
-        print("Dependencies installed.")
-
-# Check that all dependencies are present for the imported module from another directory
-dependencies_file = os.path.join(module_path, "requirements.txt")
-check_dependencies(dependencies_file)
+from dependencies import add_module_path
 
+# Add the relative path to the helpful_modules folder; its modules are only imported when first used
+add_module_path()
+
+import numpy as np
 import pandas as pd
-import random
-from make_survey_one import write_new_sheet, open_sheet, new_data
+import os, random, hashlib, itertools
+from make_survey_one import write_new_sheet, open_sheet
+from templates import ADJECTIVE_ORDER
+from instrumentation import traced
 
 def write_new_prompt(noun: str, adjective_1: str, adjective_2: str) -> tuple:
     """
@@ -52,12 +23,184 @@ def write_new_prompt(noun: str, adjective_1: str, adjective_2: str) -> tuple:
     :return: tuple
         The two strings with the adjectives in their respective orders
     """
-    return f"the {adjective_1} {adjective_2} {noun}", f"the {adjective_2} {adjective_1} {noun}"
+    return (ADJECTIVE_ORDER.format(adjective_1=adjective_1, adjective_2=adjective_2, noun=noun),
+            ADJECTIVE_ORDER.format(adjective_1=adjective_2, adjective_2=adjective_1, noun=noun))
+
+def triple_hash(noun: str, age: str, physical: str) -> int:
+    """
+    Hash a (noun, age adjective, physical adjective) triple to 64 bits.
+
+    :param noun: str
+        The noun
+    :param age: str
+        The age adjective
+    :param physical: str
+        The physical adjective
+    :return: int
+        The hash as an unsigned 64-bit integer.
+    """
+    digest = hashlib.blake2b(f"{noun}\x1f{age}\x1f{physical}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+class TripleExclusion:
+    def __init__(self, triples=()):
+        """
+        Initializes a compact set of (noun, age adjective, physical adjective) triples that must not be drawn again,
+        e.g. the stimuli of earlier surveys. Only a sorted array of 64-bit hashes is kept, 8 bytes per triple.
+
+        :param triples: iterable
+            The triples to exclude.
+        """
+        self.hashes = np.unique(np.fromiter((triple_hash(*triple) for triple in triples), dtype=np.uint64))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, triple) -> bool:
+        value = np.uint64(triple_hash(*triple))
+        position = np.searchsorted(self.hashes, value)
+        return position < len(self.hashes) and self.hashes[position] == value
+
+    def update(self, triples):
+        """
+        Add more triples to exclude.
+
+        :param triples: iterable
+            The triples to exclude.
+        """
+        new_hashes = np.fromiter((triple_hash(*triple) for triple in triples), dtype=np.uint64)
+        self.hashes = np.union1d(self.hashes, new_hashes)
+
+    def save(self, path: str):
+        """
+        Save the exclusion set to a .npy file.
+
+        :param path: str
+            The file to write.
+        """
+        np.save(path, self.hashes)
 
-def get_survey_data(nouns: list, age_adjectives: list, physical_adjectives: list, n: int = 10, random_seed:int = None) -> dict:
+    @classmethod
+    def load(cls, path: str):
+        """
+        Load an exclusion set saved with save().
+
+        :param path: str
+            The file to read.
+        :return: TripleExclusion
+            The exclusion set.
+        """
+        exclusion = cls()
+        exclusion.hashes = np.load(path)
+        return exclusion
+
+def iter_unique_triples(nouns: list, age_adjectives: list, physical_adjectives: list, rng: random.Random,
+                        exclude: TripleExclusion = None):
+    """
+    Draw distinct (noun, age adjective, physical adjective) triples without replacement from the Cartesian product of
+    the three lists. The product is never built: each draw is an index into it, drawn with a Fisher-Yates shuffle
+    that only remembers the positions it has swapped, so n draws take O(n) time and memory.
+
+    :param nouns: list
+        The list of nouns
+    :param age_adjectives: list
+        The list of adjectives in the semantic class 'age'
+    :param physical_adjectives: list
+        The list of adjectives in the semantic class 'physical'
+    :param rng: random.Random
+        The random number generator.
+    :param exclude: TripleExclusion
+        Triples that must not be drawn.
+    :return: generator
+        The triples, in random order, until the product is exhausted.
+    """
+    nouns, age_adjectives, physical_adjectives = [list(dict.fromkeys(words)) for words in
+                                                  (nouns, age_adjectives, physical_adjectives)]
+    adjective_pairs = len(age_adjectives) * len(physical_adjectives)
+    total = len(nouns) * adjective_pairs
+    swapped = {}
+    for position in range(total):
+        chosen = rng.randrange(position, total)
+        index = swapped.get(chosen, chosen)
+        swapped[chosen] = swapped.pop(position, position)
+        noun, pair = divmod(index, adjective_pairs)
+        age, physical = divmod(pair, len(physical_adjectives))
+        triple = (nouns[noun], age_adjectives[age], physical_adjectives[physical])
+        if exclude is not None and triple in exclude:
+            continue
+        yield triple
+
+def iter_prompts(nouns: list, age_adjectives: list, physical_adjectives: list, rng: random.Random,
+                 exclude: TripleExclusion = None):
+    """
+    Stream the two word orders of distinct, randomly drawn stimuli.
+
+    :param nouns: list
+        The list of nouns
+    :param age_adjectives: list
+        The list of adjectives in the semantic class 'age'
+    :param physical_adjectives: list
+        The list of adjectives in the semantic class 'physical'
+    :param rng: random.Random
+        The random number generator.
+    :param exclude: TripleExclusion
+        Triples that must not be drawn.
+    :return: generator
+        The (scontras, alt) prompts as returned by write_new_prompt.
+    """
+    for noun, age, physical in iter_unique_triples(nouns, age_adjectives, physical_adjectives, rng, exclude=exclude):
+        yield write_new_prompt(noun, age, physical)
+
+def render_survey_rows(triples: list) -> pd.DataFrame:
+    """
+    Render the survey rows of many (noun, age adjective, physical adjective) triples at once.
+
+    :param triples: list
+        The triples.
+    :return: pd.DataFrame
+        One survey row per triple.
+    """
+    nouns, ages, physicals = (np.array(words, dtype=object) for words in zip(*triples)) if triples else ([], [], [])
+    scontras = ADJECTIVE_ORDER.render(adjective_1=ages, adjective_2=physicals, noun=nouns)
+    alt = ADJECTIVE_ORDER.render(adjective_1=physicals, adjective_2=ages, noun=nouns)
+    return pd.DataFrame({'question': "Please select on the scale which word order you prefer.",
+                         'type': "scale",
+                         'required': True,
+                         'start': "1,5," + alt + "," + scontras,
+                         'end': ""},
+                        index=pd.RangeIndex(len(triples)))
+
+def iter_survey_chunks(nouns: list, age_adjectives: list, physical_adjectives: list, rng: random.Random,
+                       chunk_size: int = 65536, exclude: TripleExclusion = None):
+    """
+    Stream survey rows of distinct, randomly drawn stimuli in chunks, so that a writer can consume them without every
+    row being held in memory.
+
+    :param nouns: list
+        The list of nouns
+    :param age_adjectives: list
+        The list of adjectives in the semantic class 'age'
+    :param physical_adjectives: list
+        The list of adjectives in the semantic class 'physical'
+    :param rng: random.Random
+        The random number generator.
+    :param chunk_size: int
+        The number of rows per chunk.
+    :param exclude: TripleExclusion
+        Triples that must not be drawn.
+    :return: generator
+        DataFrames of at most chunk_size survey rows, until the combinations are exhausted.
+    """
+    triples = iter_unique_triples(nouns, age_adjectives, physical_adjectives, rng, exclude=exclude)
+    while chunk := list(itertools.islice(triples, chunk_size)):
+        yield render_survey_rows(chunk)
+
+@traced()
+def get_survey_data(nouns: list, age_adjectives: list, physical_adjectives: list, n: int = 10, random_seed:int = None,
+                    exclude: TripleExclusion = None) -> dict:
     """
     Function that creates the survey stimuli by randomly selecting items from three lists of stimuli. Items saved to a
-    dictionary, for later processing.
+    dictionary, for later processing. No (noun, age, physical) combination is used twice.
 
     :param nouns:
         The list of nouns
@@ -69,23 +212,68 @@ def get_survey_data(nouns: list, age_adjectives: list, physical_adjectives: list
         The number of stimuli to produce for this task
     :param random_seed:
         The random seed for reproducibility.
+    :param exclude:
+        Combinations already used in earlier surveys, which must not be drawn again
     :return: dict
         The dictionary object with all the stimuli organized for this task
     """
-    random.seed(random_seed)
-    df = {}
-    for i in range(n):
-        noun = random.choice(nouns)
-        age = random.choice(age_adjectives)
-        physical = random.choice(physical_adjectives)
-        scontras, alt = write_new_prompt(noun, age, physical)
-        new_data(df,
-                 question="Please select on the scale which word order you prefer.",
-                 type="scale",
-                 required=True,
-                 start=f"1,5,{alt},{scontras}",
-                 end="")
-    return df
+    rng = random.Random(random_seed)
+    triples = list(itertools.islice(iter_unique_triples(nouns, age_adjectives, physical_adjectives, rng,
+                                                        exclude=exclude), n))
+    if len(triples) < n:
+        raise ValueError(f"Only {len(triples)} unused combinations are available for {n} stimuli.")
+    return render_survey_rows(triples).to_dict('list')
+
+def word_order_variant(variant: int, seed_sequence, nouns: list, age_adjectives: list, physical_adjectives: list,
+                       n: int = 10) -> pd.DataFrame:
+    """
+    Build the word order survey of one participant group from its own random stream.
+
+    :param variant: int
+        The index of the participant group.
+    :param seed_sequence: np.random.SeedSequence
+        The random stream of this group.
+    :param nouns: list
+        The list of nouns
+    :param age_adjectives: list
+        The list of adjectives in the semantic class 'age'
+    :param physical_adjectives: list
+        The list of adjectives in the semantic class 'physical'
+    :param n: int
+        The number of stimuli to produce for this task
+    :return: pd.DataFrame
+        The survey of this group.
+    """
+    from survey_variants import seed_int
+    survey_data = get_survey_data(nouns, age_adjectives, physical_adjectives, n=n, random_seed=seed_int(seed_sequence))
+    return pd.DataFrame(survey_data)
+
+def make_variants(nouns: list, age_adjectives: list, physical_adjectives: list, k: int, n: int = 10, seed: int = None,
+                  workers: int = None) -> list:
+    """
+    Build k randomized word order surveys, one per participant group, in parallel. The result only depends on the
+    seed, not on the number of workers.
+
+    :param nouns: list
+        The list of nouns
+    :param age_adjectives: list
+        The list of adjectives in the semantic class 'age'
+    :param physical_adjectives: list
+        The list of adjectives in the semantic class 'physical'
+    :param k: int
+        The number of participant groups.
+    :param n: int
+        The number of stimuli per survey.
+    :param seed: int
+        The study seed.
+    :param workers: int
+        The number of worker processes.
+    :return: list
+        The survey of each group.
+    """
+    from survey_variants import generate_variants
+    return generate_variants(word_order_variant, k, seed=seed, workers=workers, nouns=nouns,
+                             age_adjectives=age_adjectives, physical_adjectives=physical_adjectives, n=n)
 
 if __name__ == '__main__':
     # Prepare the DataFrame of stimuli
@@ -95,6 +283,8 @@ if __name__ == '__main__':
 
     # The name of the new worksheet that will be used to create the survey
     survey_worksheet_name = "Word Order Preference"
+    # Where the survey is written: the Google Sheet by default, or a local output such as csv://data or forms.json
+    output = os.environ.get('SURVEY_OUTPUT', link)
 
     # The lists of stimuli
     nouns = sheet.loc[sheet['class'] == 'noun']['word'].tolist()
@@ -103,5 +293,5 @@ if __name__ == '__main__':
 
     # Run the program and write to new Google Sheet
     survey_data = get_survey_data(nouns, age_adjectives, physical_adjectives, n=10, random_seed=58)
-    survey_data = pd.DataFrame(survey_data).drop_duplicates(subset=['start'])
-    write_new_sheet(link, survey_worksheet_name, survey_data)
\ No newline at end of file
+    survey_data = pd.DataFrame(survey_data)
+    write_new_sheet(output, survey_worksheet_name, survey_data)
\ No newline at end of file
@@ -0,0 +1,136 @@
+import functools
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# Lexicon of comparatives that do not follow the -er/more rules
+IRREGULAR_COMPARATIVES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'irregular_comparatives.json')
+
+# Every run of vowels is one syllable, before the silent -e and syllabic -le corrections
+VOWEL_RUN = re.compile(r'[aeiouy]+')
+SILENT_E = re.compile(r'e$')
+SYLLABIC_LE = re.compile(r'[^aeiouy]le$')
+
+@functools.lru_cache(maxsize=2 ** 16)
+def count_syllables(word):
+    """
+    Count the number of syllables in a word using the syllable counting algorithm.
+
+    :param word: str
+        The word to count syllables for.
+    :return: int
+        The number of syllables in the word.
+    """
+    word = word.lower()
+    if word == "i":
+        return 1
+
+    count = 0
+    vowels = 'aeiouy'
+    if word[0] in vowels:
+        count += 1
+
+    for index in range(1, len(word)):
+        if word[index] in vowels and word[index - 1] not in vowels:
+            count += 1
+
+    if word.endswith('e'):
+        count -= 1
+
+    if word.endswith('le') and len(word) > 2 and word[-3] not in vowels:
+        count += 1
+
+    return count
+
+def is_word_with_multiple_syllables(word):
+    """
+    Check if a word has multiple syllables.
+
+    :param word: str
+        The word to check.
+    :return: bool
+        True if the word has multiple syllables, False otherwise.
+    """
+    syllable_count = count_syllables(word)
+    if syllable_count > 1:
+        return True
+    else:
+        return False
+
+@functools.lru_cache(maxsize=None)
+def load_irregular_comparatives(path: str = IRREGULAR_COMPARATIVES_FILE) -> dict:
+    """
+    Load the lexicon of irregular comparatives.
+
+    :param path: str
+        The JSON file mapping adjectives to their comparative forms.
+    :return: dict
+        The lexicon.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+@functools.lru_cache(maxsize=2 ** 16)
+def get_adjective_modifier(adjective):
+    """
+    Get the comparative form of an adjective.
+
+    :param adjective: str
+        The adjective to modify.
+    :return: str
+        The modified adjective.
+    """
+    irregulars = load_irregular_comparatives()
+    if adjective in irregulars:
+        return irregulars[adjective]
+    result = is_word_with_multiple_syllables(adjective)
+    if result:
+        return f"more {adjective}"
+    else:
+        if SILENT_E.search(adjective):
+            return f"{adjective}r"
+        else:
+            return f"{adjective}er"
+
+def count_syllables_batch(words) -> pd.Series:
+    """
+    Count the syllables of many words at once; gives the same counts as count_syllables.
+
+    :param words: list or pd.Series
+        The words to count syllables for.
+    :return: pd.Series
+        The number of syllables in each word, aligned with the input.
+    """
+    words = pd.Series(words, dtype=object).str.lower()
+    counts = words.str.count(VOWEL_RUN.pattern)
+    counts -= words.str.contains(SILENT_E).astype(int)
+    counts += words.str.contains(SYLLABIC_LE).astype(int)
+    counts[words == 'i'] = 1
+    return counts
+
+def get_adjective_modifiers(words, irregulars=None) -> pd.Series:
+    """
+    Get the comparative forms of many adjectives at once. Repeated adjectives are only inflected once.
+
+    :param words: list or pd.Series
+        The adjectives to modify.
+    :param irregulars: dict or str
+        The lexicon of irregular comparatives, or the path of a JSON file holding one, default is
+        irregular_comparatives.json.
+    :return: pd.Series
+        The modified adjectives, aligned with the input.
+    """
+    if irregulars is None or isinstance(irregulars, str):
+        irregulars = load_irregular_comparatives(irregulars or IRREGULAR_COMPARATIVES_FILE)
+    words = pd.Series(words, dtype=object)
+    codes, uniques = pd.factorize(words)
+    uniques = pd.Series(uniques, dtype=object)
+
+    multiple = count_syllables_batch(uniques).to_numpy() > 1
+    silent_e = uniques.str.contains(SILENT_E).to_numpy()
+    regular = np.where(multiple, 'more ' + uniques, np.where(silent_e, uniques + 'r', uniques + 'er'))
+    comparatives = uniques.map(irregulars).fillna(pd.Series(regular, dtype=object)).to_numpy(dtype=object)
+    return pd.Series(comparatives[codes], index=words.index, dtype=object)
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# The two options of every faultless disagreement question
+YES = 'They can both be right.'
+NO = 'One of them must be wrong.'
+
+class ResponseAggregator:
+    def __init__(self, survey: pd.DataFrame, state_path: str = None):
+        """
+        Keeps running yes/no counts of the answers to a faultless disagreement survey, per question and per
+        (category, type), so that each update only reads the answers appended since the last checkpoint. The counts,
+        the number of answer rows read and the sheet row of the last one are checkpointed to a JSON state file.
+
+        :param survey: pd.DataFrame
+            The survey sheet, as built by build_survey; question i is answered in column i + 1 of the answers sheet.
+        :param state_path: str
+            The state file; default is to keep the counts in memory only.
+        """
+        self.survey = survey.reset_index(drop=True)
+        self.state_path = state_path
+        self.fingerprint = hashlib.sha256('\n'.join(self.survey['phrase'].astype(str)).encode('utf-8')).hexdigest()
+        groups = self.survey[['category', 'type']].astype(str)
+        self.group_codes = groups.groupby(['category', 'type'], sort=False).ngroup().to_numpy()
+        self.groups = groups.drop_duplicates().reset_index(drop=True)
+        self.rows_read = 0
+        # The sheet row of the last answer counted; row 1 is the header
+        self.last_row = 1
+        self.yes = np.zeros(len(self.survey), dtype=np.int64)
+        self.no = np.zeros(len(self.survey), dtype=np.int64)
+        if state_path is not None and os.path.exists(state_path):
+            self.load()
+
+    def load(self):
+        """
+        Restore the counts from the state file.
+        """
+        with open(self.state_path) as f:
+            state = json.load(f)
+        if state['fingerprint'] != self.fingerprint:
+            raise ValueError(f"The state in '{self.state_path}' was built for a different survey.")
+        self.rows_read = state['rows_read']
+        # States saved before last_row was tracked assumed there were no blank rows
+        self.last_row = state.get('last_row', self.rows_read + 1)
+        self.yes = np.asarray(state['yes'], dtype=np.int64)
+        self.no = np.asarray(state['no'], dtype=np.int64)
+
+    def save(self):
+        """
+        Checkpoint the counts to the state file, replacing it atomically.
+        """
+        groups = self.group_counts()
+        state = {'fingerprint': self.fingerprint,
+                 'rows_read': self.rows_read,
+                 'last_row': self.last_row,
+                 'yes': self.yes.tolist(),
+                 'no': self.no.tolist(),
+                 'groups': groups[['category', 'type', 'yes', 'no', 'total']].to_dict('records')}
+        temporary_path = self.state_path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temporary_path, self.state_path)
+
+    def update(self, answers: pd.DataFrame) -> int:
+        """
+        Count a chunk of new answer rows.
+
+        :param answers: pd.DataFrame
+            Rows of the answers sheet that were not counted yet: a timestamp column then one column per question,
+            indexed by sheet row number.
+        :return: int
+            The number of rows counted.
+        """
+        values = answers.iloc[:, 1:len(self.survey) + 1].to_numpy(dtype=object)
+        width = values.shape[1]
+        self.yes[:width] += (values == YES).sum(axis=0)
+        self.no[:width] += (values == NO).sum(axis=0)
+        self.rows_read += len(answers)
+        if len(answers):
+            self.last_row = max(self.last_row, int(answers.index.max()))
+        return len(answers)
+
+    def consume(self, chunks) -> int:
+        """
+        Count chunks of new answer rows and checkpoint the state.
+
+        :param chunks: iterable
+            DataFrames of answer rows, as passed to update.
+        :return: int
+            The number of rows counted.
+        """
+        counted = sum(self.update(chunk) for chunk in chunks)
+        if self.state_path is not None:
+            self.save()
+        return counted
+
+    def results(self) -> pd.DataFrame:
+        """
+        Get the survey sheet with the counts filled in as numbers rather than formulas.
+
+        :return: pd.DataFrame
+            The survey with yes, no, total and percent_yes columns.
+        """
+        results = self.survey.copy()
+        results['yes'] = self.yes
+        results['no'] = self.no
+        results['total'] = self.yes + self.no
+        with np.errstate(divide='ignore', invalid='ignore'):
+            results['percent_yes'] = np.where(results['total'] > 0, 100 * self.yes / results['total'], np.nan)
+        return results
+
+    def group_counts(self) -> pd.DataFrame:
+        """
+        Get the counts of every (category, type).
+
+        :return: pd.DataFrame
+            One row per (category, type) with yes, no, total, percent_yes and the mean percent_yes of its questions.
+        """
+        percent_yes = self.results()['percent_yes'].to_numpy()
+        answered = ~np.isnan(percent_yes)
+        groups = self.groups.copy()
+        groups['yes'] = np.bincount(self.group_codes, weights=self.yes, minlength=len(groups)).astype(np.int64)
+        groups['no'] = np.bincount(self.group_codes, weights=self.no, minlength=len(groups)).astype(np.int64)
+        groups['total'] = groups['yes'] + groups['no']
+        groups['percent_yes'] = 100 * groups['yes'] / groups['total'].where(groups['total'] > 0)
+        sums = np.bincount(self.group_codes[answered], weights=percent_yes[answered], minlength=len(groups))
+        counts = np.bincount(self.group_codes[answered], minlength=len(groups))
+        groups['mean_percent_yes'] = sums / np.where(counts > 0, counts, np.nan)
+        return groups
+
+def iter_new_answers(link: str, answers_sheet: str, last_row: int, page_size: int = 5000):
+    """
+    Read the rows of an answers sheet that come after the rows already counted. The rows are indexed by their sheet
+    row number, so that blank rows in between do not shift where the next run starts.
+
+    :param link: str
+        The link to the Google Sheet, or a local output URI as accepted by survey_output.open_writer.
+    :param answers_sheet: str
+        The name of the sheet the form answers are collected in.
+    :param last_row: int
+        The sheet row of the last answer already counted; row 1 is the header.
+    :param page_size: int
+        The number of rows per page read from Google Sheets.
+    :return: generator
+        DataFrames of new answer rows.
+    """
+    if link.startswith(('http://', 'https://')):
+        from google_drive import GoogleSheetsAPI
+        yield from GoogleSheetsAPI(link, worksheet_name=answers_sheet).iter_csv(page_size=page_size,
+                                                                                start_row=last_row + 1)
+    else:
+        from survey_output import read_survey
+        answers = read_survey(link, answers_sheet)
+        answers.index = pd.RangeIndex(2, len(answers) + 2, name='row')
+        yield answers.loc[last_row + 1:]
+
+def aggregate_responses(link: str, survey: pd.DataFrame, state_path: str,
+                        answers_sheet: str = 'Faultless_Disagreement_Answers', output: str = None,
+                        survey_worksheet_name: str = 'Faultless Disagreement', write_back: bool = True) -> pd.DataFrame:
+    """
+    Count the answers appended since the last run, checkpoint the counts and write the survey back with the counts as
+    numbers, in place of the COUNTIF formulas.
+
+    :param link: str
+        The link to the Google Sheet holding the answers.
+    :param survey: pd.DataFrame
+        The survey sheet.
+    :param state_path: str
+        The state file.
+    :param answers_sheet: str
+        The name of the sheet the form answers are collected in.
+    :param output: str
+        Where to write the survey with its counts, as accepted by write_new_sheet; default is the sheet of the link.
+    :param survey_worksheet_name: str
+        The name of the worksheet to write.
+    :param write_back: bool
+        Whether to write the counts back at all, default is True.
+    :return: pd.DataFrame
+        The survey with yes, no, total and percent_yes columns.
+    """
+    aggregator = ResponseAggregator(survey, state_path)
+    aggregator.consume(iter_new_answers(link, answers_sheet, aggregator.last_row))
+    results = aggregator.results()
+    if write_back:
+        from make_survey_one import write_new_sheet
+        write_new_sheet(output or link, survey_worksheet_name, results)
+    return results
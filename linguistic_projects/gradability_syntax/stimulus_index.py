@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+from morphology import get_adjective_modifiers
+from templates import FAULTLESS_DISAGREEMENT
+
+class StimulusIndex:
+    # Columns stored as integer codes plus a table of categories
+    CODED_COLUMNS = ('class', 'category', 'type')
+
+    def __init__(self, sheet: pd.DataFrame):
+        """
+        Compiles a stimulus sheet into an index keyed by word, so that looking up the class, category, type and
+        animacy of many words costs one hash lookup per word instead of a scan of the sheet per word. When a word
+        appears more than once, its first row is used.
+
+        :param sheet: pd.DataFrame
+            The stimulus sheet with word, class, category, type and animate columns.
+        """
+        animate = self._animate(sheet['animate'])
+        nouns = (sheet['class'] == 'noun').to_numpy()
+        self.all_nouns = sheet['word'].to_numpy(dtype=object)[nouns]
+        self.animate_nouns = sheet['word'].to_numpy(dtype=object)[nouns & animate]
+
+        first = ~sheet['word'].duplicated(keep='first').to_numpy()
+        self.words = pd.Index(sheet['word'].to_numpy(dtype=object)[first])
+        self.animate = animate[first]
+        self.codes = {}
+        self.categories = {}
+        for column in self.CODED_COLUMNS:
+            categorical = pd.Categorical(sheet[column].to_numpy(dtype=object)[first])
+            self.codes[column] = categorical.codes
+            self.categories[column] = categorical.categories
+
+    @staticmethod
+    def _animate(column: pd.Series) -> np.ndarray:
+        if pd.api.types.is_bool_dtype(column.dtype):
+            return column.fillna(False).to_numpy(dtype=bool)
+        return column.astype(str).str.upper().eq('TRUE').to_numpy()
+
+    def __len__(self):
+        return len(self.words)
+
+    def locate(self, words) -> np.ndarray:
+        """
+        Finds the positions of words in the index.
+
+        :param words: list
+            The words to look up.
+        :return: np.ndarray
+            The position of each word.
+        """
+        positions = self.words.get_indexer(pd.Index(words, dtype=object))
+        if (positions < 0).any():
+            missing = [word for word, position in zip(words, positions) if position < 0]
+            raise KeyError(f"Words not in the stimulus sheet: {missing[:10]}")
+        return positions
+
+    def column(self, name: str, positions: np.ndarray) -> np.ndarray:
+        """
+        Decodes one coded column for the given positions.
+
+        :param name: str
+            One of class, category or type.
+        :param positions: np.ndarray
+            Positions returned by locate.
+        :return: np.ndarray
+            The decoded values; missing values come back as NaN.
+        """
+        return np.asarray(pd.Categorical.from_codes(self.codes[name][positions], self.categories[name]), dtype=object)
+
+    def choose_nouns(self, animate: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """
+        Picks one noun per question, from the animate nouns when the adjective needs an animate noun and from all
+        nouns otherwise.
+
+        :param animate: np.ndarray
+            Whether each adjective needs an animate noun.
+        :param rng: np.random.Generator
+            The random number generator.
+        :return: np.ndarray
+            The chosen nouns.
+        """
+        draws = rng.random(len(animate))
+        nouns = np.empty(len(animate), dtype=object)
+        for pool, mask in ((self.animate_nouns, animate), (self.all_nouns, ~animate)):
+            if mask.any():
+                if len(pool) == 0:
+                    raise ValueError("The stimulus sheet has no nouns to choose from.")
+                nouns[mask] = pool[(draws[mask] * len(pool)).astype(int)]
+        return nouns
+
+    def questions(self, adjectives, random_state=None) -> pd.DataFrame:
+        """
+        Writes the faultless disagreement question for every adjective in one vectorized pass.
+
+        :param adjectives: list
+            The adjectives to write questions for.
+        :param random_state: int or np.random.Generator
+            The random seed or generator used to choose the nouns.
+        :return: pd.DataFrame
+            The phrase, category and type of each question.
+        """
+        rng = np.random.default_rng(random_state)
+        positions = self.locate(adjectives)
+        nouns = self.choose_nouns(self.animate[positions], rng)
+        comparatives = get_adjective_modifiers(list(adjectives))
+        phrases = FAULTLESS_DISAGREEMENT.render(noun=nouns, comparative=comparatives)
+        return pd.DataFrame({'phrase': phrases,
+                             'category': self.column('category', positions),
+                             'type': self.column('type', positions)})
@@ -0,0 +1,137 @@
+import itertools
+import string
+
+import numpy as np
+import pandas as pd
+from templates import compile_template
+
+# Letters of every column Google Sheets allows (A to ZZZ), indexed from 0
+COLUMN_LETTERS = np.array([''.join(letters) for width in range(1, 4)
+                           for letters in itertools.product(string.ascii_uppercase, repeat=width)], dtype=object)
+
+def column_letter(index: int) -> str:
+    """
+    Get the A1 letters of a column.
+
+    :param index: int
+        The 0-based column index.
+    :return: str
+        The column letters, e.g. 0 -> 'A', 26 -> 'AA'.
+    """
+    if index < len(COLUMN_LETTERS):
+        return COLUMN_LETTERS[index]
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = string.ascii_uppercase[remainder] + letters
+    return letters
+
+def column_letters(indices) -> np.ndarray:
+    """
+    Get the A1 letters of many columns at once.
+
+    :param indices: array-like
+        The 0-based column indices.
+    :return: np.ndarray
+        The column letters.
+    """
+    indices = np.asarray(indices, dtype=int)
+    if len(indices) and indices.max() >= len(COLUMN_LETTERS):
+        return np.array([column_letter(index) for index in indices], dtype=object)
+    return COLUMN_LETTERS[indices]
+
+def render_column(template: str, n: int, **fields) -> np.ndarray:
+    """
+    Fill a str.format template for n rows at once. Each field is either a single value shared by every row or an
+    array with one value per row.
+
+    :param template: str
+        The template, e.g. 'SUM({yes}{row},{no}{row})'.
+    :param n: int
+        The number of rows.
+    :param fields: dict
+        The values of the template fields.
+    :return: np.ndarray
+        The rendered strings.
+    """
+    return compile_template(template).render(n, **fields)
+
+class SurveyBuilder:
+    def __init__(self, n: int):
+        """
+        Initializes a columnar builder for a survey sheet with n questions. Columns are added whole, as constants or
+        arrays, and formula columns are rendered for every row at once.
+
+        :param n: int
+            The number of questions.
+        """
+        self.n = n
+        self.columns = {}
+
+    def add(self, name: str, values):
+        """
+        Add a column.
+
+        :param name: str
+            The column name.
+        :param values:
+            A single value for every row, or one value per row.
+        :return: SurveyBuilder
+            The builder, so calls can be chained.
+        """
+        if isinstance(values, str) or np.ndim(values) == 0:
+            values = np.full(self.n, values, dtype=object)
+        elif isinstance(values, pd.Series):
+            values = values.to_numpy()
+        if len(values) != self.n:
+            raise ValueError(f"Column '{name}' has {len(values)} values for {self.n} questions.")
+        self.columns[name] = values
+        return self
+
+    def add_formula(self, name: str, template: str, **fields):
+        """
+        Add a column rendered from a template. The field 'row' is filled with the sheet row of each question, and
+        fields named after existing columns default to those columns' letters.
+
+        :param name: str
+            The column name.
+        :param template: str
+            The template, e.g. 'SUM({yes}{row},{no}{row})'.
+        :param fields: dict
+            The values of the other template fields.
+        :return: SurveyBuilder
+            The builder, so calls can be chained.
+        """
+        defaults = {column: self.letter(column) for column in self.columns}
+        defaults['row'] = self.rows()
+        return self.add(name, render_column(template, self.n, **{**defaults, **fields}))
+
+    def letter(self, name: str) -> str:
+        """
+        Get the A1 letters of a column in the built sheet.
+
+        :param name: str
+            The column name.
+        :return: str
+            The column letters.
+        """
+        return column_letter(list(self.columns).index(name))
+
+    def rows(self) -> np.ndarray:
+        """
+        Get the sheet row of every question, counting the header as row 1.
+
+        :return: np.ndarray
+            The row numbers.
+        """
+        return np.arange(2, self.n + 2)
+
+    def build(self) -> pd.DataFrame:
+        """
+        Build the survey sheet.
+
+        :return: pd.DataFrame
+            One row per question.
+        """
+        return pd.DataFrame(self.columns, index=pd.RangeIndex(self.n))
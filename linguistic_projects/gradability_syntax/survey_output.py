@@ -0,0 +1,361 @@
+from dependencies import add_module_path
+
+# Add the relative path to the helpful_modules folder; its modules are only imported when first used
+add_module_path()
+
+import abc
+import json
+import os
+from urllib.parse import urlparse
+
+import instrumentation
+import pandas as pd
+
+# File extension written by each local scheme when the URI names a folder rather than a file
+EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'forms': '.json', 'fake-sheets': '.csv'}
+
+class SurveyWriter(abc.ABC):
+    def __init__(self):
+        """
+        Base class of the survey writers. Rows are written in chunks with write() as they are generated, and the
+        output is complete once close() has been called, which leaving a with block does. Leaving it with an
+        exception calls abort() instead, so a partial survey is never committed.
+        """
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def write(self, chunk: pd.DataFrame):
+        """
+        Write a chunk of survey rows.
+
+        :param chunk: pd.DataFrame
+            The rows to write; every chunk has the same columns.
+        """
+        self._write(chunk)
+        self.rows_written += len(chunk)
+        instrumentation.count('rows_written', len(chunk))
+
+    @abc.abstractmethod
+    def _write(self, chunk: pd.DataFrame):
+        pass
+
+    def close(self):
+        """
+        Finish the output.
+        """
+
+    def abort(self):
+        """
+        Discard the rows written so far, leaving any earlier output in place.
+        """
+
+def _discard(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+class CSVWriter(SurveyWriter):
+    def __init__(self, path: str):
+        """
+        Writes the survey to a CSV file, appending each chunk to a temporary file that replaces the CSV file when
+        the writer is closed.
+
+        :param path: str
+            The CSV file.
+        """
+        super().__init__()
+        self.path = path
+        self.temporary_path = path + '.tmp'
+        self.file = open(self.temporary_path, 'w', newline='', encoding='utf-8')
+
+    def _write(self, chunk: pd.DataFrame):
+        chunk.to_csv(self.file, header=self.rows_written == 0, index=False)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            os.replace(self.temporary_path, self.path)
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+            _discard(self.temporary_path)
+
+class ParquetWriter(SurveyWriter):
+    def __init__(self, path: str):
+        """
+        Writes the survey to a Parquet file, one row group per chunk, through a temporary file that replaces the
+        Parquet file when the writer is closed.
+
+        :param path: str
+            The Parquet file.
+        """
+        super().__init__()
+        self.path = path
+        self.temporary_path = path + '.tmp'
+        self.writer = None
+
+    def _write(self, chunk: pd.DataFrame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self.writer is None:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            self.writer = pq.ParquetWriter(self.temporary_path, table.schema)
+        else:
+            table = pa.Table.from_pandas(chunk, schema=self.writer.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            os.replace(self.temporary_path, self.path)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            _discard(self.temporary_path)
+
+def form_item(row: dict) -> dict:
+    """
+    Convert a survey row into a Google Forms item. Rows of survey one become multiple choice questions and rows of
+    survey two become linear scales.
+
+    :param row: dict
+        The survey row.
+    :return: dict
+        The item, as expected by the createItem request of the Forms API.
+    """
+    kind = row.get('question_type', row.get('type'))
+    question = {'required': bool(row.get('required', False))}
+    if kind == 'multiple choice':
+        options = [row[column] for column in sorted(row) if column.startswith('option_')]
+        question['choiceQuestion'] = {'type': 'RADIO', 'options': [{'value': str(option)} for option in options]}
+    elif kind == 'scale':
+        low, high, low_label, high_label = str(row['start']).split(',', 3)
+        question['scaleQuestion'] = {'low': int(low), 'high': int(high), 'lowLabel': low_label,
+                                     'highLabel': high_label}
+    else:
+        question['textQuestion'] = {}
+    return {'title': str(row.get('phrase', row.get('question', ''))), 'questionItem': {'question': question}}
+
+class FormsBatchWriter(SurveyWriter):
+    def __init__(self, path: str):
+        """
+        Writes the survey as the body of a Forms API batchUpdate request, with one createItem request per row. The
+        JSON is written as rows arrive to a temporary file, which replaces the JSON file once the request is closed,
+        so the file can be uploaded as is.
+
+        :param path: str
+            The JSON file.
+        """
+        super().__init__()
+        self.path = path
+        self.temporary_path = path + '.tmp'
+        self.file = open(self.temporary_path, 'w', encoding='utf-8')
+        self.file.write('{"requests": [')
+
+    def _write(self, chunk: pd.DataFrame):
+        requests = []
+        for index, row in enumerate(chunk.to_dict('records'), start=self.rows_written):
+            requests.append(json.dumps({'createItem': {'item': form_item(row), 'location': {'index': index}}}))
+        if requests:
+            self.file.write((',\n' if self.rows_written else '\n') + ',\n'.join(requests))
+
+    def close(self):
+        if not self.file.closed:
+            self.file.write('\n]}\n')
+            self.file.close()
+            os.replace(self.temporary_path, self.path)
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+            _discard(self.temporary_path)
+
+class FakeSheetsAPI:
+    def __init__(self, directory: str, worksheet_name: str = 'Sheet1'):
+        """
+        A local stand-in for GoogleSheetsAPI that keeps each worksheet of a spreadsheet as a CSV file in a folder,
+        so that surveys can be built and read back offline and in tests.
+
+        :param directory: str
+            The folder standing in for the spreadsheet.
+        :param worksheet_name: str
+            Name of the worksheet, default is 'Sheet1'.
+        """
+        self.directory = directory
+        self.worksheet_name = worksheet_name
+
+    def path(self, worksheet_name: str = None) -> str:
+        """
+        Get the file of a worksheet.
+
+        :param worksheet_name: str
+            The name of the worksheet, default is the one given at creation.
+        :return: str
+            The CSV file of the worksheet.
+        """
+        return os.path.join(self.directory, f"{worksheet_name or self.worksheet_name}.csv")
+
+    def open_csv(self, cache=None) -> pd.DataFrame:
+        """
+        Reads the worksheet into a DataFrame.
+
+        :param cache: SheetCache
+            Ignored; the worksheet is already local.
+        :return: pd.DataFrame
+            The worksheet.
+        """
+        return pd.read_csv(self.path(), keep_default_na=False)
+
+    def write_sheet(self, worksheet: str, df: pd.DataFrame, format_sheet: bool = False):
+        """
+        Writes a DataFrame to a worksheet, replacing its contents.
+
+        :param worksheet: str
+            The name of the worksheet.
+        :param df: pd.DataFrame
+            The DataFrame to write.
+        :param format_sheet: bool
+            Ignored; the local worksheets have no formatting.
+        """
+        with FakeSheetsWriter(self.directory, worksheet) as writer:
+            writer.write(df)
+
+class FakeSheetsWriter(CSVWriter):
+    def __init__(self, directory: str, worksheet_name: str):
+        """
+        Writes the survey to a worksheet of a FakeSheetsAPI folder.
+
+        :param directory: str
+            The folder standing in for the spreadsheet.
+        :param worksheet_name: str
+            The name of the worksheet.
+        """
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(FakeSheetsAPI(directory).path(worksheet_name))
+
+class GoogleSheetsWriter(SurveyWriter):
+    def __init__(self, url: str, worksheet_name: str):
+        """
+        Writes the survey to a Google Sheet. The chunks are collected locally and uploaded in one write when the
+        writer is closed, so that the network is only used once per survey.
+
+        :param url: str
+            The link to the Google Sheet.
+        :param worksheet_name: str
+            The name of the worksheet.
+        """
+        super().__init__()
+        self.url = url
+        self.worksheet_name = worksheet_name
+        self.chunks = []
+
+    def _write(self, chunk: pd.DataFrame):
+        self.chunks.append(chunk)
+
+    def close(self):
+        if self.chunks:
+            from google_drive import GoogleSheetsAPI
+            df = pd.concat(self.chunks, ignore_index=True)
+            GoogleSheetsAPI(self.url).write_sheet(self.worksheet_name, df, format_sheet=False)
+            self.chunks = []
+
+    def abort(self):
+        self.chunks = []
+
+def local_path(uri: str, worksheet_name: str = None) -> tuple:
+    """
+    Split a local output URI into its scheme and file. URIs are either paths ending in .csv, .parquet or .json, or
+    scheme://path with the schemes csv, parquet, forms and fake-sheets; a path without an extension is a folder in
+    which the worksheet gets its own file.
+
+    :param uri: str
+        The output URI.
+    :param worksheet_name: str
+        The name of the worksheet, used when the URI names a folder.
+    :return: tuple
+        The scheme and the path.
+    """
+    parsed = urlparse(uri)
+    if parsed.scheme in EXTENSIONS:
+        scheme, path = parsed.scheme, parsed.netloc + parsed.path
+    else:
+        extension = os.path.splitext(uri)[1].lower()
+        schemes = {'.csv': 'csv', '.parquet': 'parquet', '.json': 'forms'}
+        if extension not in schemes:
+            raise ValueError(f"Unknown survey output '{uri}'.")
+        scheme, path = schemes[extension], uri
+    if scheme == 'fake-sheets':
+        return scheme, path
+    if not os.path.splitext(path)[1]:
+        path = os.path.join(path, f"{worksheet_name or 'survey'}{EXTENSIONS[scheme]}")
+    return scheme, path
+
+def open_writer(uri: str, worksheet_name: str = None) -> SurveyWriter:
+    """
+    Open the writer selected by an output URI: a Google Sheets link, a CSV, Parquet or Forms JSON file, or a
+    fake-sheets:// folder.
+
+    :param uri: str
+        The output URI.
+    :param worksheet_name: str
+        The name of the worksheet to write.
+    :return: SurveyWriter
+        The writer.
+    """
+    if urlparse(uri).scheme in ('http', 'https'):
+        return GoogleSheetsWriter(uri, worksheet_name)
+    scheme, path = local_path(uri, worksheet_name)
+    if scheme == 'fake-sheets':
+        return FakeSheetsWriter(path, worksheet_name)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    return {'csv': CSVWriter, 'parquet': ParquetWriter, 'forms': FormsBatchWriter}[scheme](path)
+
+def write_survey(uri: str, worksheet_name: str, data) -> int:
+    """
+    Write a survey to the output selected by a URI.
+
+    :param uri: str
+        The output URI, as accepted by open_writer.
+    :param worksheet_name: str
+        The name of the worksheet to write.
+    :param data: pd.DataFrame or iterable
+        The survey, or its rows in chunks of DataFrames.
+    :return: int
+        The number of rows written.
+    """
+    with open_writer(uri, worksheet_name) as writer:
+        for chunk in [data] if isinstance(data, pd.DataFrame) else data:
+            writer.write(chunk)
+    return writer.rows_written
+
+def read_survey(uri: str, worksheet_name: str = None) -> pd.DataFrame:
+    """
+    Read back a survey written to a local CSV, Parquet or fake-sheets:// output.
+
+    :param uri: str
+        The output URI.
+    :param worksheet_name: str
+        The name of the worksheet.
+    :return: pd.DataFrame
+        The survey.
+    """
+    scheme, path = local_path(uri, worksheet_name)
+    if scheme == 'fake-sheets':
+        return FakeSheetsAPI(path, worksheet_name).open_csv()
+    if scheme == 'parquet':
+        return pd.read_parquet(path)
+    if scheme == 'csv':
+        return pd.read_csv(path, keep_default_na=False)
+    raise ValueError(f"Cannot read surveys back from '{uri}'.")
@@ -0,0 +1,172 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from survey_variants import spawn_seeds, seed_int
+
+# Resampled values drawn per batch, which bounds the memory of one batch whatever the number of observations
+BATCH_VALUES = 2 ** 22
+
+def tally_scores(scores, levels: int = 5) -> np.ndarray:
+    """
+    Count how often each rating of a Likert scale was given.
+
+    :param scores: array-like
+        The ratings, from 1 to levels.
+    :param levels: int
+        The number of points of the scale.
+    :return: np.ndarray
+        The count of each rating, from 1 to levels.
+    :raises ValueError:
+        If a rating is not a whole number from 1 to levels.
+    """
+    values = pd.to_numeric(pd.Series(scores)).to_numpy(dtype=float)
+    invalid = (values != np.round(values)) | (values < 1) | (values > levels) | np.isnan(values)
+    if invalid.any():
+        raise ValueError(f"Ratings must be whole numbers from 1 to {levels}, got {values[invalid][:5].tolist()}")
+    return np.bincount(values.astype(np.int64), minlength=levels + 1)[1:levels + 1]
+
+def stack_groups(groups: dict) -> tuple:
+    """
+    Flatten named groups of observations into one array of values and one of group codes.
+
+    :param groups: dict
+        The observations of each group keyed by group name.
+    :return: tuple
+        The values, the group code of each value and the group names.
+    """
+    names = list(groups)
+    arrays = [np.asarray(groups[name], dtype=float).ravel() for name in names]
+    codes = np.repeat(np.arange(len(names)), [len(array) for array in arrays])
+    return np.concatenate(arrays) if arrays else np.empty(0), codes, names
+
+def describe_groups(groups: dict) -> pd.DataFrame:
+    """
+    Compute the size, mean and sample standard deviation of every group at once.
+
+    :param groups: dict
+        The observations of each group keyed by group name.
+    :return: pd.DataFrame
+        One row per group with n, mean and sd.
+    """
+    values, codes, names = stack_groups(groups)
+    counts = np.bincount(codes, minlength=len(names))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.bincount(codes, weights=values, minlength=len(names)) / counts
+        squares = np.bincount(codes, weights=(values - means[codes]) ** 2, minlength=len(names))
+        sds = np.sqrt(squares / (counts - 1))
+    return pd.DataFrame({'n': counts, 'mean': means, 'sd': sds}, index=pd.Index(names, name='group'))
+
+def kruskal_statistic(ranks: np.ndarray, codes: np.ndarray, k: int) -> np.ndarray:
+    """
+    Compute the Kruskal-Wallis H statistic, without the tie correction, for one or many labelings of the same ranks.
+
+    :param ranks: np.ndarray
+        The ranks of the pooled observations.
+    :param codes: np.ndarray
+        The group code of each observation, or one row of codes per labeling.
+    :param k: int
+        The number of groups.
+    :return: np.ndarray
+        The statistic of each labeling.
+    """
+    codes = np.atleast_2d(codes)
+    resamples, n = codes.shape
+    offsets = (np.arange(resamples) * k)[:, None]
+    rank_sums = np.bincount((codes + offsets).ravel(), weights=np.tile(ranks, resamples),
+                            minlength=resamples * k).reshape(resamples, k)
+    sizes = np.bincount(codes[0], minlength=k)
+    return 12 / (n * (n + 1)) * (rank_sums ** 2 / sizes).sum(axis=1) - 3 * (n + 1)
+
+def _permutation_batch(ranks: np.ndarray, codes: np.ndarray, k: int, observed: float, resamples: int,
+                       seed_sequence) -> int:
+    rng = np.random.default_rng(seed_sequence)
+    permuted = rng.permuted(np.broadcast_to(codes, (resamples, len(codes))), axis=1)
+    return int((kruskal_statistic(ranks, permuted, k) >= observed - 1e-12).sum())
+
+def _bootstrap_batch(values: np.ndarray, resamples: int, seed_sequence) -> np.ndarray:
+    rng = np.random.default_rng(seed_sequence)
+    return values[rng.integers(0, len(values), size=(resamples, len(values)))].mean(axis=1)
+
+def run_batches(function, total: int, size: int, seed: int, workers: int, *args) -> list:
+    """
+    Split total resamples into batches with their own random streams and run them across a process pool. Batch i
+    always gets the i-th stream spawned from the seed, so the results do not depend on the number of workers.
+
+    :param function: callable
+        A module-level function function(*args, resamples, seed_sequence).
+    :param total: int
+        The number of resamples.
+    :param size: int
+        The number of values resampled each time.
+    :param seed: int
+        The seed.
+    :param workers: int
+        The number of worker processes; 1 runs every batch in this process, default is one per CPU.
+    :param args: tuple
+        The first arguments of function.
+    :return: list
+        The result of each batch.
+    """
+    per_batch = max(1, min(total, BATCH_VALUES // max(size, 1)))
+    batches = [per_batch] * (total // per_batch) + ([total % per_batch] if total % per_batch else [])
+    seeds = spawn_seeds(seed, len(batches))
+    if workers == 1 or len(batches) == 1:
+        return [function(*args, resamples, seed_sequence) for resamples, seed_sequence in zip(batches, seeds)]
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+        return list(pool.map(function, *[[arg] * len(batches) for arg in args], batches, seeds))
+
+def permutation_test(groups: dict, n_resamples: int = 10000, seed: int = 0, workers: int = None) -> dict:
+    """
+    Test whether the groups come from the same distribution, with the Kruskal-Wallis statistic and its p-value both
+    from the chi-square approximation and from shuffling the group labels.
+
+    :param groups: dict
+        The observations of each group keyed by group name.
+    :param n_resamples: int
+        The number of label permutations.
+    :param seed: int
+        The seed, for reproducible p-values.
+    :param workers: int
+        The number of worker processes.
+    :return: dict
+        The statistic, the chi-square p_value and the permutation_p_value.
+    """
+    from scipy.stats import kruskal, rankdata
+    statistic, p_value = kruskal(*[np.asarray(group, dtype=float) for group in groups.values()])
+    values, codes, names = stack_groups(groups)
+    ranks = rankdata(values)
+    observed = kruskal_statistic(ranks, codes, len(names))[0]
+    exceed = sum(run_batches(_permutation_batch, n_resamples, len(values), seed, workers,
+                             ranks, codes, len(names), observed))
+    return {'statistic': float(statistic), 'p_value': float(p_value),
+            'permutation_p_value': (exceed + 1) / (n_resamples + 1)}
+
+def bootstrap_ci(groups: dict, n_resamples: int = 10000, confidence: float = 0.95, seed: int = 0,
+                 workers: int = None) -> pd.DataFrame:
+    """
+    Compute percentile bootstrap confidence intervals of the mean of every group.
+
+    :param groups: dict
+        The observations of each group keyed by group name.
+    :param n_resamples: int
+        The number of bootstrap resamples per group.
+    :param confidence: float
+        The confidence level of the intervals.
+    :param seed: int
+        The seed, for reproducible intervals.
+    :param workers: int
+        The number of worker processes.
+    :return: pd.DataFrame
+        One row per group with the mean and the low and high bounds.
+    """
+    rows = []
+    for name, seed_sequence in zip(groups, spawn_seeds(seed, len(groups))):
+        values = np.asarray(groups[name], dtype=float).ravel()
+        batches = run_batches(_bootstrap_batch, n_resamples, len(values), seed_int(seed_sequence), workers, values)
+        means = np.concatenate(batches)
+        low, high = np.quantile(means, [(1 - confidence) / 2, (1 + confidence) / 2])
+        rows.append({'group': name, 'mean': values.mean(), 'low': low, 'high': high})
+    return pd.DataFrame(rows).set_index('group')
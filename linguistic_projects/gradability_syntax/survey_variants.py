@@ -0,0 +1,69 @@
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+def spawn_seeds(seed, k: int) -> list:
+    """
+    Derive one independent random stream per survey variant from a single study seed.
+
+    :param seed: int
+        The study seed; None draws fresh entropy.
+    :param k: int
+        The number of variants.
+    :return: list
+        One np.random.SeedSequence per variant.
+    """
+    return np.random.SeedSequence(seed).spawn(k)
+
+def seed_int(seed_sequence: np.random.SeedSequence) -> int:
+    """
+    Turn a SeedSequence into an integer seed, for code that seeds random.Random.
+
+    :param seed_sequence: np.random.SeedSequence
+        The seed sequence of one variant.
+    :return: int
+        A 64-bit integer seed.
+    """
+    return int(seed_sequence.generate_state(1, dtype=np.uint64)[0])
+
+def latin_square_orders(n: int, k: int) -> list:
+    """
+    Counterbalance the order of n items across k groups by rotating the list, so that every item appears at evenly
+    spaced positions across the groups.
+
+    :param n: int
+        The number of items.
+    :param k: int
+        The number of groups.
+    :return: list
+        One array of item indices per group.
+    """
+    return [np.roll(np.arange(n), -(variant * n // k)) for variant in range(k)]
+
+def generate_variants(build, k: int, seed=None, workers: int = None, **kwargs) -> list:
+    """
+    Build k survey variants, one per participant group, across a process pool. Variant i is always built from the
+    i-th stream spawned from the seed, so the results are identical whatever the number of workers.
+
+    :param build: callable
+        A module-level function build(variant, seed_sequence, **kwargs) returning one variant.
+    :param k: int
+        The number of variants.
+    :param seed: int
+        The study seed.
+    :param workers: int
+        The number of worker processes; 1 builds every variant in this process, default is one per CPU.
+    :param kwargs: dict
+        Arguments passed to every call of build, e.g. the stimulus sheet.
+    :return: list
+        The variants, in variant order.
+    """
+    seeds = spawn_seeds(seed, k)
+    build = functools.partial(build, **kwargs)
+    if workers == 1:
+        return [build(variant, seed_sequence) for variant, seed_sequence in enumerate(seeds)]
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(build, range(k), seeds, chunksize=max(1, k // (4 * workers))))
@@ -0,0 +1,109 @@
+import functools
+import string
+
+import numpy as np
+import pandas as pd
+
+class PromptTemplate:
+    def __init__(self, text: str):
+        """
+        Compiles a str.format template once into its literal text and fields, so that it can be rendered for many
+        rows at once. Rows that repeat the same field values are rendered once and share the same string object.
+
+        :param text: str
+            The template, e.g. 'the {adjective_1} {adjective_2} {noun}'.
+        """
+        self.text = text
+        self.parts = [(literal, field) for literal, field, _, _ in string.Formatter().parse(text)]
+        self.fields = tuple(dict.fromkeys(field for _, field in self.parts if field is not None))
+
+    def __repr__(self):
+        return f"PromptTemplate({self.text!r})"
+
+    def format(self, **fields) -> str:
+        """
+        Render the template once.
+
+        :param fields: dict
+            The values of the template fields.
+        :return: str
+            The rendered string.
+        """
+        return self.text.format_map(fields)
+
+    def render(self, n: int = None, **fields) -> np.ndarray:
+        """
+        Render the template for many rows at once. Each field is either a single value shared by every row or an
+        array with one value per row.
+
+        :param n: int
+            The number of rows; default is the length of the array fields.
+        :param fields: dict
+            The values of the template fields.
+        :return: np.ndarray
+            The rendered strings.
+        """
+        constants = {}
+        columns = {}
+        for field in self.fields:
+            value = fields[field]
+            if isinstance(value, str) or np.ndim(value) == 0:
+                constants[field] = str(value)
+            else:
+                columns[field] = np.asarray(value, dtype=object)
+        if n is None:
+            n = len(next(iter(columns.values()))) if columns else 1
+
+        # Number every distinct combination of the array fields, so that each one is only rendered once
+        codes = {}
+        uniques = {}
+        combination = np.zeros(n, dtype=np.int64)
+        for field, values in columns.items():
+            codes[field], field_uniques = pd.factorize(values, use_na_sentinel=False)
+            uniques[field] = field_uniques.astype(str).astype(object)
+            combination = pd.factorize(combination * len(field_uniques) + codes[field])[0]
+        first_rows = np.unique(combination, return_index=True)[1] if n else np.empty(0, dtype=int)
+
+        rendered = np.full(len(first_rows), '', dtype=object)
+        for literal, field in self.parts:
+            if literal:
+                rendered = rendered + literal
+            if field in constants:
+                rendered = rendered + constants[field]
+            elif field is not None:
+                rendered = rendered + uniques[field][codes[field][first_rows]]
+        return rendered[combination]
+
+    def stream(self, chunks, **constants):
+        """
+        Render the template chunk by chunk, so that rows can be handed to a writer as they are rendered.
+
+        :param chunks: iterable
+            Dictionaries or DataFrames with one array per varying field.
+        :param constants: dict
+            The values of the fields shared by every row.
+        :return: generator
+            The rendered strings of each chunk.
+        """
+        for chunk in chunks:
+            yield self.render(**{**constants, **{field: chunk[field] for field in chunk}})
+
+@functools.lru_cache(maxsize=256)
+def compile_template(text: str) -> PromptTemplate:
+    """
+    Compile a template, reusing the compiled template of a text seen before.
+
+    :param text: str
+        The template.
+    :return: PromptTemplate
+        The compiled template.
+    """
+    return PromptTemplate(text)
+
+# The faultless disagreement question of survey one
+FAULTLESS_DISAGREEMENT = compile_template("Mary thinks this {noun} is {comparative} than that {noun}.\n"
+                                          "John doesn't think so.\n"
+                                          "Can they both be right or must one be wrong?")
+
+# One word order of the two adjectives of survey two
+ADJECTIVE_ORDER = compile_template("the {adjective_1} {adjective_2} {noun}")
@@ -1,6 +1,36 @@
 import unittest
-from make_survey_one import count_syllables, is_word_with_multiple_syllables, get_adjective_modifier, random_string, create_phrases
-from make_survey_two import write_new_prompt
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from make_survey_one import random_string, create_phrases, allocate_samples, get_samples, \
+    representativeness_report, check_sample_size, build_survey, write_questions
+from morphology import count_syllables, is_word_with_multiple_syllables, get_adjective_modifier, \
+    count_syllables_batch, get_adjective_modifiers
+from make_survey_two import write_new_prompt, get_survey_data, iter_unique_triples, TripleExclusion, iter_survey_chunks
+from stimulus_index import StimulusIndex
+from survey_builder import column_letter, column_letters, SurveyBuilder
+from survey_variants import generate_variants, latin_square_orders
+from templates import PromptTemplate, FAULTLESS_DISAGREEMENT
+from survey_output import write_survey, read_survey, open_writer, FakeSheetsAPI, SurveyWriter
+from survey_statistics import tally_scores, describe_groups, permutation_test, bootstrap_ci
+from analysis_runner import AnalysisCache, content_hash, run_batch
+from benchmarks import synthetic_sheet, add_scaling, compare_to_baseline
+from response_aggregator import ResponseAggregator, aggregate_responses, YES, NO
+import make_survey_two
+import random
+import numpy as np
+import pandas as pd
+from google_drive import cell_text, diff_ranges, chunk_ranges, records_frame, coerce_frame, concat_frames, FormatSpec, \
+    DEFAULT_FORMAT, GoogleSheetsAPI, AsyncGoogleSheetsAPI, client_registry
+from unittest import mock
+import sheet_cache
+from sheet_cache import SheetCache
+from request_scheduler import RequestScheduler
+import instrumentation
 
 class SurveyOneTests(unittest.TestCase):
 
@@ -19,10 +49,40 @@ class SurveyOneTests(unittest.TestCase):
         self.assertEqual(get_adjective_modifier("best"), "better")
         self.assertEqual(get_adjective_modifier("happy"), "more happy")
 
+    def test_count_syllables_batch(self):
+        words = ["hello", "world", "beautiful", "table", "I", "the"]
+        self.assertEqual(count_syllables_batch(words).tolist(), [count_syllables(word) for word in words])
+
+    def test_get_adjective_modifiers(self):
+        self.assertEqual(get_adjective_modifiers(["big", "best", "happy", "big", "wide"]).tolist(),
+                         ["biger", "better", "more happy", "biger", "wider"])
+        self.assertEqual(get_adjective_modifiers(["bad", "bad"], irregulars={"bad": "worse"}).tolist(), ["worse", "worse"])
+        self.assertEqual(get_adjective_modifiers([]).tolist(), [])
+
+    def test_allocate_samples(self):
+        self.assertEqual(allocate_samples([10, 7, 3], 10).tolist(), [5, 4, 1])
+        self.assertEqual(allocate_samples([2, 1], 50).tolist(), [2, 1])
+
+    def test_get_samples(self):
+        df = pd.DataFrame({'word': [f'word{i}' for i in range(100)],
+                           'category': ['age'] * 60 + ['physical'] * 40,
+                           'type': ['relative', 'absolute'] * 50})
+        sample = get_samples(df, sample_size=45, random_state=145)
+        self.assertEqual(len(sample), 45)
+        self.assertEqual(sample['category'].value_counts().to_dict(), {'age': 27, 'physical': 18})
+        self.assertTrue(sample.equals(get_samples(df, sample_size=45, random_state=145)))
+
     def test_random_string(self):
         cls = ["apple", "banana", "orange"]
         self.assertEqual(random_string(cls, seed=123), "apple")
 
+    def test_random_string_keeps_global_state(self):
+        random.seed(1)
+        expected = random.random()
+        random.seed(1)
+        random_string(["apple", "banana", "orange"], seed=123)
+        self.assertEqual(random.random(), expected)
+
     def test_create_phrases(self):
         nouns = ["cat", "dog", "bird"]
         adjective = "slow"
@@ -30,6 +90,97 @@ class SurveyOneTests(unittest.TestCase):
 John doesn't think so.
 Can they both be right or must one be wrong?""")
 
+    def test_representativeness_report(self):
+        sheet = pd.DataFrame({'class': ['adjective'] * 60 + ['noun'] * 10,
+                              'category': ['color', 'size', 'age'] * 20 + ['thing'] * 10,
+                              'type': ['relative', 'absolute'] * 30 + ['noun'] * 10})
+        report = representativeness_report(sheet, sheet.iloc[:30])
+        self.assertEqual(report['flagged'], [])
+        self.assertAlmostEqual(report['category']['kl_divergence'], 0.0)
+        self.assertNotIn('thing', report['category']['proportions'].index)
+        skewed = sheet[sheet['category'] == 'color']
+        self.assertIn('category', representativeness_report(sheet, skewed)['flagged'])
+
+    def test_check_sample_size_skips_plots(self):
+        sheet = pd.DataFrame({'class': ['adjective'] * 6, 'category': ['color', 'size'] * 3, 'type': ['relative'] * 6})
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(check_sample_size(sheet, sheet, path=directory)['plots'])
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_check_sample_size_background_plots(self):
+        sheet = pd.DataFrame({'class': ['adjective'] * 6, 'category': ['color', 'size'] * 3, 'type': ['relative'] * 6})
+        with tempfile.TemporaryDirectory() as directory:
+            check_sample_size(sheet, sheet, plot=True, path=directory)['plots'].result(timeout=60)
+            self.assertIn('category_distribution.jpg', os.listdir(directory))
+            plots = check_sample_size(sheet, sheet, plot=True, path=os.path.join(directory, 'missing'))['plots']
+            self.assertRaises(FileNotFoundError, plots.result, 60)
+
+class StimulusIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sheet = pd.DataFrame({'word': ['cat', 'chair', 'slow', 'old', 'slow'],
+                                   'class': ['noun', 'noun', 'adjective', 'adjective', 'adjective'],
+                                   'category': ['', '', 'speed', 'age', 'color'],
+                                   'type': ['', '', 'relative', 'relative', 'absolute'],
+                                   'animate': ['TRUE', 'FALSE', 'TRUE', 'FALSE', 'FALSE']})
+
+    def test_questions(self):
+        questions = StimulusIndex(self.sheet).questions(['slow', 'old'], random_state=1)
+        self.assertEqual(questions['category'].tolist(), ['speed', 'age'])
+        self.assertEqual(questions['type'].tolist(), ['relative', 'relative'])
+        self.assertEqual(questions['phrase'][0], """Mary thinks this cat is slower than that cat.
+John doesn't think so.
+Can they both be right or must one be wrong?""")
+
+    def test_unknown_word(self):
+        self.assertRaises(KeyError, StimulusIndex(self.sheet).locate, ['fast'])
+
+    def test_write_questions_shares_one_generator(self):
+        with mock.patch.object(StimulusIndex, 'questions', autospec=True,
+                               side_effect=StimulusIndex.questions) as questions:
+            phrases = write_questions(self.sheet, n=3, random_state=5)
+        self.assertIsInstance(questions.call_args.kwargs['random_state'], np.random.Generator)
+        self.assertEqual(write_questions(self.sheet, n=3, random_state=np.random.default_rng(5)), phrases)
+
+class SurveyBuilderTests(unittest.TestCase):
+
+    def test_column_letters(self):
+        self.assertEqual(column_letters([0, 25, 26, 77, 18277]).tolist(), ['A', 'Z', 'AA', 'BZ', 'ZZZ'])
+        self.assertEqual(column_letter(18278), 'AAAA')
+
+    def test_formulas(self):
+        builder = SurveyBuilder(2).add('yes', [1, 2]).add('no', [3, 4])
+        builder.add_formula('total', 'SUM({yes}{row},{no}{row})')
+        self.assertEqual(builder.build()['total'].tolist(), ['SUM(A2,B2)', 'SUM(A3,B3)'])
+        self.assertRaises(ValueError, builder.add, 'phrase', ['only one'])
+
+class TemplateTests(unittest.TestCase):
+
+    def test_render_matches_format(self):
+        nouns = ['cat', 'dog', 'cat']
+        comparatives = ['slower', 'slower', 'slower']
+        rendered = FAULTLESS_DISAGREEMENT.render(noun=nouns, comparative=comparatives)
+        self.assertEqual(list(rendered), [FAULTLESS_DISAGREEMENT.format(noun=noun, comparative=comparative)
+                                          for noun, comparative in zip(nouns, comparatives)])
+        self.assertIs(rendered[0], rendered[2])
+
+    def test_render_constants(self):
+        template = PromptTemplate('{a}-{b}{row}')
+        self.assertEqual(list(template.render(3, a='x', b='y', row=[2, 3, 4])), ['x-y2', 'x-y3', 'x-y4'])
+        self.assertEqual(list(template.stream([{'row': [1]}, {'row': [2, 3]}], a='x', b='y'))[1].tolist(), ['x-y2', 'x-y3'])
+
+class SurveyVariantsTests(unittest.TestCase):
+
+    def test_variants_do_not_depend_on_workers(self):
+        kwargs = dict(nouns=['chair', 'table', 'lamp'], age_adjectives=['old', 'new'],
+                      physical_adjectives=['soft', 'hard'], n=4)
+        serial = generate_variants(make_survey_two.word_order_variant, 4, seed=58, workers=1, **kwargs)
+        parallel = generate_variants(make_survey_two.word_order_variant, 4, seed=58, workers=2, **kwargs)
+        self.assertTrue(all(a.equals(b) for a, b in zip(serial, parallel)))
+
+    def test_latin_square_orders(self):
+        self.assertEqual([order.tolist() for order in latin_square_orders(4, 2)], [[0, 1, 2, 3], [2, 3, 0, 1]])
+
 class SurveyTwoTests(unittest.TestCase):
 
     def test_write_new_prompt(self):
@@ -38,5 +189,700 @@ class SurveyTwoTests(unittest.TestCase):
         noun = 'chair'
         self.assertEqual(write_new_prompt(noun, adjective_1, adjective_2), ("the old soft chair", "the soft old chair"))
 
+    def test_unique_triples(self):
+        triples = list(iter_unique_triples(['chair', 'table', 'chair'], ['old', 'new'], ['soft', 'hard'], random.Random(3)))
+        self.assertEqual(len(triples), 8)
+        self.assertEqual(len(set(triples)), 8)
+
+    def test_exclusion(self):
+        nouns, ages, physicals = ['chair', 'table'], ['old', 'new'], ['soft', 'hard']
+        used = list(iter_unique_triples(nouns, ages, physicals, random.Random(0)))[:5]
+        exclusion = TripleExclusion(used)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'used.npy')
+            exclusion.save(path)
+            exclusion = TripleExclusion.load(path)
+        self.assertIn(used[0], exclusion)
+        remaining = list(iter_unique_triples(nouns, ages, physicals, random.Random(1), exclude=exclusion))
+        self.assertEqual(len(remaining), 3)
+        self.assertFalse(set(remaining) & set(used))
+
+    def test_survey_chunks(self):
+        chunks = list(iter_survey_chunks(['chair', 'table'], ['old', 'new'], ['soft', 'hard'], random.Random(2), chunk_size=3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 2])
+        self.assertEqual(pd.concat(chunks)['start'].nunique(), 8)
+
+    def test_survey_data_too_large(self):
+        self.assertEqual(len(get_survey_data(['chair'], ['old'], ['soft', 'hard'], n=2, random_seed=1)['start']), 2)
+        with self.assertRaises(ValueError):
+            get_survey_data(['chair'], ['old'], ['soft', 'hard'], n=3)
+
+class SurveyOutputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.survey = pd.DataFrame(get_survey_data(['chair', 'table'], ['old', 'new'], ['soft'], n=4, random_seed=5))
+
+    def test_local_round_trip(self):
+        for uri in ('csv://' + self.directory.name, os.path.join(self.directory.name, 'survey.parquet'),
+                    'fake-sheets://' + self.directory.name):
+            chunks = [self.survey.iloc[:3], self.survey.iloc[3:]]
+            self.assertEqual(write_survey(uri, 'Word Order Preference', chunks), 4)
+            pd.testing.assert_frame_equal(read_survey(uri, 'Word Order Preference'), self.survey)
+        sheets = FakeSheetsAPI(self.directory.name, 'Word Order Preference')
+        pd.testing.assert_frame_equal(sheets.open_csv(), self.survey)
+
+    def test_forms_batch(self):
+        path = os.path.join(self.directory.name, 'form.json')
+        with open_writer(path) as writer:
+            writer.write(self.survey.iloc[:1])
+            writer.write(self.survey.iloc[1:])
+        with open(path) as f:
+            requests = json.load(f)['requests']
+        self.assertEqual([request['createItem']['location']['index'] for request in requests], [0, 1, 2, 3])
+        scale = requests[0]['createItem']['item']['questionItem']['question']['scaleQuestion']
+        self.assertEqual((scale['low'], scale['high']), (1, 5))
+        self.assertEqual('1,5,' + scale['lowLabel'] + ',' + scale['highLabel'], self.survey['start'][0])
+
+    def test_failed_write_is_discarded(self):
+        for uri in ('csv://' + self.directory.name, os.path.join(self.directory.name, 'survey.parquet'),
+                    os.path.join(self.directory.name, 'form.json')):
+            with self.assertRaises(RuntimeError):
+                with open_writer(uri, 'Word Order Preference') as writer:
+                    writer.write(self.survey.iloc[:2])
+                    raise RuntimeError("the generator failed")
+            self.assertEqual(writer.rows_written, 2)
+        self.assertEqual(os.listdir(self.directory.name), [])
+        with mock.patch('google_drive.GoogleSheetsAPI') as sheets:
+            with self.assertRaises(RuntimeError):
+                with open_writer('https://docs.google.com/spreadsheets/d/x', 'Survey') as writer:
+                    writer.write(self.survey)
+                    raise RuntimeError("the generator failed")
+            sheets.assert_not_called()
+
+    def test_incomplete_writer(self):
+        class RowCounter(SurveyWriter):
+            pass
+
+        self.assertRaises(TypeError, RowCounter)
+
+class ResponseAggregatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.uri = 'fake-sheets://' + self.directory.name
+        self.state_path = os.path.join(self.directory.name, 'state.json')
+        self.survey = build_survey([('phrase 1', 'color', 'relative'), ('phrase 2', 'color', 'relative'),
+                                    ('phrase 3', 'size', 'absolute')])
+        self.answers = pd.DataFrame({'Timestamp': ['1', '2', '3'], 'B': [YES, NO, YES], 'C': [YES, YES, NO],
+                                     'D': [NO, NO, YES]})
+
+    def test_incremental_counts(self):
+        write_survey(self.uri, 'Faultless_Disagreement_Answers', self.answers.iloc[:2])
+        aggregate_responses(self.uri, self.survey, self.state_path)
+        write_survey(self.uri, 'Faultless_Disagreement_Answers', self.answers)
+        results = aggregate_responses(self.uri, self.survey, self.state_path)
+        self.assertEqual(results['yes'].tolist(), [2, 2, 1])
+        self.assertEqual(results['total'].tolist(), [3, 3, 3])
+        self.assertEqual(ResponseAggregator(self.survey, self.state_path).rows_read, 3)
+        written = read_survey(self.uri, 'Faultless Disagreement')
+        self.assertEqual(written['yes'].tolist(), [2, 2, 1])
+        self.assertEqual(written['percent_yes'].round(1).tolist(), [66.7, 66.7, 33.3])
+
+    def test_survey_counts_are_numbers(self):
+        self.assertEqual(self.survey[['yes', 'no', 'total']].values.tolist(), [[0, 0, 0]] * 3)
+        formulas = build_survey([('phrase 1', 'color', 'relative')], formulas=True)
+        self.assertTrue(formulas['yes'][0].startswith('COUNTIF(Faultless_Disagreement_Answers!B:B'))
+
+    def test_group_counts(self):
+        aggregator = ResponseAggregator(self.survey)
+        aggregator.update(self.answers)
+        groups = aggregator.group_counts()
+        self.assertEqual(groups[['category', 'type', 'yes', 'no']].values.tolist(),
+                         [['color', 'relative', 4, 2], ['size', 'absolute', 1, 2]])
+
+    def test_state_of_other_survey(self):
+        ResponseAggregator(self.survey, self.state_path).save()
+        with self.assertRaises(ValueError):
+            ResponseAggregator(self.survey.iloc[:2], self.state_path)
+
+class SurveyStatisticsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.groups = {'alt': [3, 5, 2, 8, 6], 'neutral': [1, 0, 2, 1], 'scontras': [9, 12, 7, 10, 11, 8]}
+
+    def test_tally_scores(self):
+        self.assertEqual(tally_scores([1, 2, 2, 5, '3']).tolist(), [1, 2, 1, 0, 1])
+        self.assertEqual(tally_scores([1.0, 4.0]).tolist(), [1, 0, 0, 1, 0])
+        for scores in ([1, 2.5], [0, 1], [1, 6], [1, None]):
+            self.assertRaises(ValueError, tally_scores, scores)
+
+    def test_describe_groups(self):
+        import statistics
+        descriptives = describe_groups(self.groups)
+        for name, values in self.groups.items():
+            self.assertAlmostEqual(descriptives.loc[name, 'mean'], statistics.mean(values))
+            self.assertAlmostEqual(descriptives.loc[name, 'sd'], statistics.stdev(values))
+
+    def test_resampling_is_reproducible(self):
+        from scipy.stats import kruskal
+        test = permutation_test(self.groups, n_resamples=2000, seed=1, workers=1)
+        self.assertAlmostEqual(test['statistic'], kruskal(*self.groups.values()).statistic)
+        self.assertLess(test['permutation_p_value'], 0.01)
+        self.assertEqual(test, permutation_test(self.groups, n_resamples=2000, seed=1, workers=1))
+        intervals = bootstrap_ci(self.groups, n_resamples=2000, seed=1, workers=1)
+        self.assertTrue((intervals['low'] <= intervals['mean']).all() and (intervals['mean'] <= intervals['high']).all())
+        pd.testing.assert_frame_equal(intervals, bootstrap_ci(self.groups, n_resamples=2000, seed=1, workers=1))
+
+class AnalysisRunnerTests(unittest.TestCase):
+
+    def test_unchanged_surveys_are_skipped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            uri = 'fake-sheets://' + directory
+            survey = pd.DataFrame({'category': ['color', 'size'], 'type': ['relative', 'absolute'],
+                                   'percent_yes': ['50%', '20%']})
+            write_survey(uri, 'Faultless Disagreement', survey)
+            plot = os.path.join(directory, 'wave_1.jpg')
+            open(plot, 'w').close()
+            cache = AnalysisCache(os.path.join(directory, 'cache'))
+            digest = content_hash('faultless', read_survey(uri, 'Faultless Disagreement'))
+            cache.put(digest, pd.DataFrame({'category': ['color'], 'type': ['relative'], 'percent_yes': [50.0]}))
+            entry = {'name': 'wave_1', 'kind': 'faultless', 'link': uri, 'worksheet': 'Faultless Disagreement',
+                     'plot': plot}
+            result = run_batch([entry], cache=cache)['wave_1']
+            self.assertEqual((result['status'], result['hash']), ('cached', digest))
+            self.assertNotEqual(content_hash('word_order', survey), content_hash('faultless', survey))
+
+class BenchmarkTests(unittest.TestCase):
+
+    def test_synthetic_sheet(self):
+        sheet = synthetic_sheet(1000)
+        self.assertEqual(len(sheet), 1000)
+        self.assertTrue(sheet['word'].is_unique)
+        self.assertEqual(len(write_questions(sheet, n=10, random_state=0)), 10)
+
+    def test_scaling_and_regressions(self):
+        results = [{'benchmark': 'get_samples', 'rows': 1000, 'seconds': 0.01},
+                   {'benchmark': 'get_samples', 'rows': 100000, 'seconds': 10.0}]
+        add_scaling(results)
+        self.assertAlmostEqual(results[1]['scaling'], 1.5)
+        baseline = {'results': [{'benchmark': 'get_samples', 'rows': 1000, 'seconds': 0.01},
+                                {'benchmark': 'get_samples', 'rows': 100000, 'seconds': 5.0}]}
+        regressions = compare_to_baseline({'results': results}, baseline, threshold=0.25)
+        self.assertEqual([(regression['rows'], regression['ratio']) for regression in regressions], [(100000, 2.0)])
+
+class InstrumentationTests(unittest.TestCase):
+
+    def tearDown(self):
+        instrumentation.disable()
+
+    def test_off_by_default(self):
+        self.assertIs(instrumentation.span('open_csv'), instrumentation.NO_SPAN)
+        instrumentation.count('api_calls')
+
+    def test_spans_and_counters(self):
+        tracer = instrumentation.enable()
+        with instrumentation.span('build', rows=3):
+            with instrumentation.span('write_new_sheet'):
+                instrumentation.count('rows_written', 3)
+        spans = [event for event in tracer.trace()['traceEvents'] if event['ph'] == 'X']
+        self.assertEqual([span['name'] for span in spans], ['write_new_sheet', 'build'])
+        self.assertEqual(spans[1]['args']['rows'], 3)
+        self.assertEqual(spans[1]['args']['rows_written'], 3)
+        self.assertEqual(spans[0]['args']['depth'], 1)
+        self.assertGreaterEqual(spans[1]['dur'], spans[0]['dur'])
+
+    @unittest.skipUnless(os.path.exists('/proc/self/statm'), "needs /proc to read the RSS")
+    def test_spans_measure_their_own_memory(self):
+        tracer = instrumentation.enable()
+        with instrumentation.span('outer'):
+            with instrumentation.span('allocate'):
+                block = b'\x01' * (64 * 2 ** 20)
+                del block
+            with instrumentation.span('idle'):
+                pass
+        spans = self.by_name(tracer)
+        # The allocation is freed before the span ends, so only the peak sees it
+        self.assertLess(abs(spans['allocate']['rss_delta_bytes']), 32 * 2 ** 20)
+        self.assertGreaterEqual(spans['allocate']['peak_rss_bytes'] - spans['allocate']['rss_bytes'], 32 * 2 ** 20)
+        # Later spans do not inherit the peak, but the enclosing span does
+        self.assertLess(spans['idle']['peak_rss_bytes'] - spans['idle']['rss_bytes'], 32 * 2 ** 20)
+        self.assertGreaterEqual(spans['outer']['peak_rss_bytes'], spans['allocate']['peak_rss_bytes'])
+
+    @unittest.skipUnless(os.path.exists('/proc/self/statm'), "needs /proc to read the RSS")
+    def test_spans_sample_memory_without_clear_refs(self):
+        tracer = instrumentation.enable()
+        with mock.patch('instrumentation.reset_high_water_rss', return_value=False):
+            with instrumentation.span('allocate'):
+                block = b'\x01' * (64 * 2 ** 20)
+                time.sleep(0.1)
+                del block
+            with instrumentation.span('idle'):
+                time.sleep(0.05)
+        spans = self.by_name(tracer)
+        self.assertGreaterEqual(spans['allocate']['peak_rss_bytes'] - spans['allocate']['rss_bytes'], 32 * 2 ** 20)
+        self.assertLess(spans['idle']['peak_rss_bytes'] - spans['idle']['rss_bytes'], 32 * 2 ** 20)
+
+    @staticmethod
+    def by_name(tracer):
+        return {event['name']: event['args'] for event in tracer.trace()['traceEvents'] if event['ph'] == 'X'}
+
+class StartupTests(unittest.TestCase):
+    # Importing the survey scripts must not pull in network or plotting backends, and must stay fast
+    HEAVY_MODULES = ['gspread', 'googleapiclient', 'matplotlib', 'pkg_resources']
+    IMPORT_BUDGET = 3.0
+
+    def test_import_is_lazy_and_fast(self):
+        code = ("import json, sys, time; start = time.perf_counter(); import make_survey_one, make_survey_two; "
+                "print(json.dumps({'seconds': time.perf_counter() - start, "
+                "'modules': [name for name in %r if name in sys.modules]}))" % self.HEAVY_MODULES)
+        output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output)
+        self.assertEqual(result['modules'], [])
+        self.assertLess(result['seconds'], self.IMPORT_BUDGET)
+
+    def test_library_modules_do_not_import_scripts(self):
+        code = "import sys, stimulus_index; print('make_survey_one' in sys.modules)"
+        output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), 'False')
+
+class GoogleDriveTests(unittest.TestCase):
+
+    def test_diff_ranges(self):
+        old = [['word', 'animate'], ['cat', 'TRUE'], ['dog', 'TRUE']]
+        self.assertEqual(diff_ranges(old, [['word', 'animate'], ['cat', True], ['dog', True]]), [])
+        self.assertEqual(diff_ranges(old, [['word', 'animate'], ['cat', True], ['dog', False]]), [(3, 2, [[False]])])
+        self.assertEqual(diff_ranges(old, [['word', 'animate'], ['cat', True]]), [(3, 1, [['', '']])])
+
+    def test_chunk_ranges(self):
+        ranges = [(1, 1, [['a', 'b'], ['c', 'd'], ['e', 'f']])]
+        self.assertEqual(chunk_ranges(ranges, max_cells=4), [[(1, 1, [['a', 'b'], ['c', 'd']])], [(3, 1, [['e', 'f']])]])
+
+    def test_cell_text(self):
+        self.assertEqual(cell_text(True), 'TRUE')
+        self.assertEqual(cell_text(2.0), '2')
+        self.assertEqual(cell_text(None), '')
+
+    def test_records_frame(self):
+        df = records_frame([['word', 'syllables'], ['happy', '2'], ['old', '']])
+        self.assertEqual(df.to_dict('records'), [{'word': 'happy', 'syllables': 2}, {'word': 'old', 'syllables': ''}])
+
+    def test_coerce_frame(self):
+        chunk = coerce_frame(records_frame([['word', 'animate', 'type'], ['cat', 'TRUE', 'n'], ['old', '', 'age']]),
+                             {'animate': 'bool', 'type': 'category'})
+        self.assertEqual(chunk['animate'].tolist(), [True, False])
+        self.assertEqual(chunk['type'].dtype, 'category')
+        other = coerce_frame(records_frame([['word', 'animate', 'type'], ['new', 'FALSE', 'age']]), {'type': 'category'})
+        self.assertEqual(concat_frames([chunk, other])['type'].dtype, 'category')
+
+    def test_format_spec(self):
+        requests = DEFAULT_FORMAT.requests(7)
+        self.assertEqual([list(request)[0] for request in requests],
+                         ['updateSheetProperties', 'repeatCell', 'repeatCell', 'updateDimensionProperties'])
+        self.assertEqual(requests[1]['repeatCell']['fields'],
+                         'userEnteredFormat.horizontalAlignment,userEnteredFormat.textFormat.bold,'
+                         'userEnteredFormat.verticalAlignment')
+        self.assertEqual(FormatSpec(frozen_rows=1).key(), FormatSpec(frozen_rows=1).key())
+
+    def test_format_spec_clamps_to_columns(self):
+        requests = DEFAULT_FORMAT.requests(7, col_count=3)
+        self.assertEqual([list(request)[0] for request in requests],
+                         ['updateSheetProperties', 'repeatCell', 'updateDimensionProperties'])
+        self.assertEqual(DEFAULT_FORMAT.requests(7, col_count=8)[2]['repeatCell']['range']['endColumnIndex'], 8)
+
+    def test_format_spec_reads_live_state(self):
+        def metadata(frozen_rows, width, bold):
+            return {'sheets': [{'properties': {'sheetId': 7, 'gridProperties': {'frozenRowCount': frozen_rows,
+                                                                                  'frozenColumnCount': 1}},
+                                'data': [{'columnMetadata': [{'pixelSize': width}], 'rowData': [{'values': [
+                                    {'userEnteredFormat': {'horizontalAlignment': 'CENTER',
+                                                           'verticalAlignment': 'MIDDLE',
+                                                           'textFormat': {'bold': bold, 'italic': False}}}]}]},
+                                         {'startRow': 1, 'startColumn': 5, 'columnMetadata': [{}], 'rowData': [
+                                             {'values': [{'userEnteredFormat': {'horizontalAlignment': 'CENTER',
+                                                                                'verticalAlignment': 'MIDDLE'}}]}]}]}]}
+        self.assertTrue(DEFAULT_FORMAT.is_applied(metadata(1, 25, True), 7, col_count=26))
+        self.assertFalse(DEFAULT_FORMAT.is_applied(metadata(0, 25, True), 7, col_count=26))
+        self.assertFalse(DEFAULT_FORMAT.is_applied(metadata(1, 100, True), 7, col_count=26))
+        self.assertFalse(DEFAULT_FORMAT.is_applied(metadata(1, 25, False), 7, col_count=26))
+        self.assertTrue(DEFAULT_FORMAT.is_applied(metadata(1, 25, False), 7, col_count=26, cells=False))
+        self.assertFalse(DEFAULT_FORMAT.is_applied(metadata(1, 25, True), 8, col_count=26))
+        params = DEFAULT_FORMAT.metadata_params('Survey', col_count=26)
+        self.assertEqual(params['ranges'], ["'Survey'!A1", "'Survey'!F2"])
+
+class FakeWorksheet:
+    def __init__(self, title, sheet_id, col_count=26, grid=None):
+        self.title = title
+        self.id = sheet_id
+        self.grid = grid or []
+        self.reads = 0
+        # Like a gspread handle, the size is what the worksheet had when it was opened, until refreshed or resized
+        self._properties = {'gridProperties': {'rowCount': len(self.grid), 'columnCount': col_count}}
+
+    @property
+    def row_count(self):
+        return self._properties['gridProperties']['rowCount']
+
+    @property
+    def col_count(self):
+        return self._properties['gridProperties']['columnCount']
+
+    def row_values(self, row):
+        return self.grid[row - 1]
+
+    def get_all_values(self, value_render_option=None):
+        self.reads += 1
+        return [list(row) for row in self.grid]
+
+    def resize(self, rows, cols):
+        self.grid.extend([] for _ in range(rows - len(self.grid)))
+        self._properties['gridProperties'].update(rowCount=rows, columnCount=cols)
+
+    def get(self, a1_range, pad_values=False):
+        import gspread
+        grid_range = gspread.utils.a1_range_to_grid_range(a1_range)
+        return [row[grid_range['startColumnIndex']:grid_range['endColumnIndex']]
+                for row in self.grid[grid_range['startRowIndex']:grid_range['endRowIndex']]]
+
+class FakeSpreadsheet:
+    def __init__(self, worksheets, metadata=None):
+        self.id = 'sheet-id'
+        self.worksheets = {worksheet.title: worksheet for worksheet in worksheets}
+        for worksheet in worksheets:
+            worksheet.spreadsheet = self
+        self.metadata = metadata or {'sheets': []}
+        self.metadata_reads = []
+        self.batches = []
+        self.revision = 0
+
+    def get_lastUpdateTime(self):
+        return f'2024-01-01T00:00:{self.revision:02d}Z'
+
+    def edit(self, title, row, col, value):
+        # An edit made outside this process, e.g. by hand in the browser
+        grid = self.worksheets[title].grid
+        grid.extend([] for _ in range(row - len(grid)))
+        grid[row - 1].extend([''] * (col - len(grid[row - 1])))
+        grid[row - 1][col - 1] = value
+        self.revision += 1
+
+    def values_batch_update(self, body):
+        import gspread
+        for data in body['data']:
+            title, a1_range = data['range'].rsplit('!', 1)
+            start = gspread.utils.a1_range_to_grid_range(a1_range)
+            for row_offset, row in enumerate(data['values']):
+                for col_offset, value in enumerate(row):
+                    self.edit(title.strip("'"), start['startRowIndex'] + row_offset + 1,
+                              start['startColumnIndex'] + col_offset + 1, cell_text(value))
+        self.revision += 1
+
+    def worksheet(self, title):
+        return self.worksheets[title]
+
+    def fetch_sheet_metadata(self, params):
+        if params['fields'] == 'sheets.properties.gridProperties':
+            worksheet = self.worksheets[params['ranges'].rsplit('!', 1)[0].strip("'")]
+            return {'sheets': [{'properties': {'gridProperties': {'rowCount': len(worksheet.grid),
+                                                                  'columnCount': worksheet.col_count}}}]}
+        self.metadata_reads.append(params)
+        return self.metadata
+
+    def batch_update(self, body):
+        self.batches.append(body)
+
+class FakeClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+        self.opened = []
+
+    def open_by_url(self, url):
+        self.opened.append(url)
+        return self.spreadsheet
+
+class GoogleSheetsAPITests(unittest.TestCase):
+    URL = 'https://docs.google.com/spreadsheets/d/sheet-id/edit'
+
+    def setUp(self):
+        client_registry.clear()
+        self.addCleanup(client_registry.clear)
+        self.spreadsheet = FakeSpreadsheet([FakeWorksheet('Survey', 7)])
+        self.client = FakeClient(self.spreadsheet)
+        patches = [mock.patch('google_drive.service_account.Credentials.from_service_account_file'),
+                   mock.patch('google_drive.gs.service_account', return_value=self.client)]
+        self.credentials, self.service_account = [patch.start() for patch in patches]
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+    def test_registry_reuses_clients(self):
+        first = GoogleSheetsAPI(self.URL, worksheet_name='Survey')
+        first.open_google_worksheet()
+        second = GoogleSheetsAPI(self.URL.replace('/edit', '/edit#gid=7'), worksheet_name='Survey')
+        second.open_google_worksheet()
+        self.assertIs(first.ws, second.ws)
+        self.assertIs(first.credentials, second.credentials)
+        self.assertEqual(self.credentials.call_count, 1)
+        self.assertEqual(self.service_account.call_count, 1)
+        self.assertEqual(len(self.client.opened), 1)
+
+    def test_registry_invalidate_and_clear(self):
+        GoogleSheetsAPI(self.URL, worksheet_name='Survey').open_google_worksheet()
+        client_registry.invalidate(self.URL, 'Survey')
+        GoogleSheetsAPI(self.URL, worksheet_name='Survey').open_google_worksheet()
+        self.assertEqual(len(self.client.opened), 1)
+        client_registry.invalidate(self.URL)
+        GoogleSheetsAPI(self.URL, worksheet_name='Survey').open_google_worksheet()
+        self.assertEqual(len(self.client.opened), 2)
+        self.assertEqual(self.credentials.call_count, 1)
+        client_registry.clear()
+        GoogleSheetsAPI(self.URL, worksheet_name='Survey').open_google_worksheet()
+        self.assertEqual(len(self.client.opened), 3)
+        self.assertEqual((self.credentials.call_count, self.service_account.call_count), (2, 2))
+
+    def test_format_follows_the_live_sheet(self):
+        api = GoogleSheetsAPI(self.URL, worksheet_name='Survey')
+        api.open_google_worksheet()
+        self.spreadsheet.metadata = {'sheets': [{'properties': {'sheetId': 7, 'gridProperties': {}}}]}
+        api.format(api.ws)
+        self.assertEqual(len(self.spreadsheet.batches), 1)
+        # Someone unfreezes the header by hand, which the memo alone would not see
+        api.format(api.ws)
+        self.assertEqual(len(self.spreadsheet.batches), 2)
+        self.spreadsheet.metadata = {'sheets': [{'properties': {'sheetId': 7, 'gridProperties': {
+            'frozenRowCount': 1, 'frozenColumnCount': 1}}, 'data': [{'columnMetadata': [{'pixelSize': 25}]}]}]}
+        api.format(api.ws)
+        self.assertEqual(len(self.spreadsheet.batches), 2)
+        self.assertFalse(self.spreadsheet.metadata_reads[-1]['includeGridData'])
+
+    def test_pages_rows_appended_after_open(self):
+        answers = FakeWorksheet('Answers', 8, grid=[['Timestamp', 'Q1'], ['1', YES]])
+        self.spreadsheet.worksheets['Answers'] = answers
+        api = GoogleSheetsAPI(self.URL, worksheet_name='Answers')
+        self.assertEqual(pd.concat(api.iter_csv(page_size=2)).index.tolist(), [2])
+        answers.grid.extend([['2', NO], ['3', YES], ['4', NO]])
+        self.assertEqual(api.ws.row_count, 2)
+        pages = list(GoogleSheetsAPI(self.URL, worksheet_name='Answers').iter_csv(page_size=2, start_row=3))
+        self.assertEqual([page.index.tolist() for page in pages], [[3, 4], [5]])
+        self.assertEqual(api.ws.row_count, 5)
+
+    def test_write_values_follows_external_edits(self):
+        api = GoogleSheetsAPI(self.URL, worksheet_name='Survey')
+        api.open_google_worksheet()
+        worksheet = api.ws
+
+        def contents():
+            rows = [[cell for cell in row] for row in worksheet.grid]
+            while rows and not any(rows[-1]):
+                rows.pop()
+            return [row[:max([i + 1 for i, cell in enumerate(row) if cell] + [0])] for row in rows]
+
+        frame = pd.DataFrame({'phrase': ['a', 'b'], 'yes': [1, 2]})
+        with mock.patch('sheet_cache._default_cache', None):
+            self.assertEqual(api.write_values(worksheet, frame), 6)
+            # Writing only invalidates a cache this process already uses
+            self.assertIsNone(sheet_cache._default_cache)
+        self.assertEqual(contents(), [['phrase', 'yes'], ['a', '1'], ['b', '2']])
+        self.assertEqual(api.write_values(worksheet, frame), 0)
+        self.assertEqual(worksheet.reads, 1)
+
+        grown = pd.DataFrame({'phrase': ['a', 'b', 'c'], 'yes': [1, 2, 3], 'no': [0, 0, 1]})
+        self.assertEqual(api.write_values(worksheet, grown), 6)
+        self.assertEqual(contents(), [['phrase', 'yes', 'no'], ['a', '1', '0'], ['b', '2', '0'], ['c', '3', '1']])
+
+        shrunk = grown.head(1)
+        api.write_values(worksheet, shrunk)
+        self.assertEqual(contents(), [['phrase', 'yes', 'no'], ['a', '1', '0']])
+
+        # Cells changed by hand are read back and overwritten, not diffed away against the stale snapshot
+        self.spreadsheet.edit('Survey', 2, 2, '9')
+        self.spreadsheet.edit('Survey', 4, 1, 'stray')
+        self.assertEqual(api.write_values(worksheet, shrunk), 2)
+        self.assertEqual(contents(), [['phrase', 'yes', 'no'], ['a', '1', '0']])
+        self.assertEqual(worksheet.reads, 2)
+
+    def test_blank_answer_rows_are_not_counted_twice(self):
+        survey = build_survey([('phrase 1', 'color', 'relative'), ('phrase 2', 'size', 'absolute')])
+        answers = FakeWorksheet('Answers', 8, grid=[['Timestamp', 'Q1', 'Q2'], ['1', YES, NO], ['', '', ''],
+                                                    ['2', NO, NO]])
+        self.spreadsheet.worksheets['Answers'] = answers
+        with tempfile.TemporaryDirectory() as directory:
+            state_path = os.path.join(directory, 'state.json')
+            first = aggregate_responses(self.URL, survey, state_path, answers_sheet='Answers', write_back=False)
+            self.assertEqual(first['total'].tolist(), [2, 2])
+            answers.grid.append(['3', YES, YES])
+            second = aggregate_responses(self.URL, survey, state_path, answers_sheet='Answers', write_back=False)
+            self.assertEqual(second['yes'].tolist(), [2, 1])
+            self.assertEqual(second['total'].tolist(), [3, 3])
+            self.assertEqual(ResponseAggregator(survey, state_path).last_row, 5)
+
+class FakeSheetsCalls:
+    # Stands in for GoogleSheetsAPI, recording how many calls run at once and on which threads
+    lock = threading.Lock()
+    running = 0
+    most_running = 0
+    threads = set()
+    written = {}
+
+    def __init__(self, url, worksheet_name='Sheet1'):
+        FakeSheetsCalls.threads.add(threading.current_thread())
+        self.worksheet_name = worksheet_name
+
+    def _call(self, seconds):
+        with FakeSheetsCalls.lock:
+            FakeSheetsCalls.running += 1
+            FakeSheetsCalls.most_running = max(FakeSheetsCalls.most_running, FakeSheetsCalls.running)
+        time.sleep(seconds)
+        with FakeSheetsCalls.lock:
+            FakeSheetsCalls.running -= 1
+
+    def open_csv(self, cache=None):
+        # Later worksheets answer sooner, so results would come back out of order if they were not reordered
+        self._call(0.005 * (20 - int(self.worksheet_name[len('Sheet'):])))
+        return pd.DataFrame({'worksheet': [self.worksheet_name]})
+
+    def write_sheet(self, worksheet_name, df, format_sheet=False):
+        self._call(0.01)
+        FakeSheetsCalls.written[worksheet_name] = df
+
+class AsyncGoogleSheetsAPITests(unittest.TestCase):
+
+    def setUp(self):
+        FakeSheetsCalls.most_running = 0
+        FakeSheetsCalls.threads = set()
+        FakeSheetsCalls.written = {}
+        patch = mock.patch('google_drive.GoogleSheetsAPI', FakeSheetsCalls)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_open_csvs(self):
+        import asyncio
+        names = [f"Sheet{i}" for i in range(12)]
+        frames = asyncio.run(AsyncGoogleSheetsAPI('url', max_concurrency=3).open_csvs(names))
+        self.assertEqual(list(frames), names)
+        self.assertEqual([frame['worksheet'][0] for frame in frames.values()], names)
+        self.assertEqual(FakeSheetsCalls.most_running, 3)
+        self.assertNotIn(threading.main_thread(), FakeSheetsCalls.threads)
+
+    def test_write_sheets(self):
+        import asyncio
+        frames = {f"Sheet{i}": pd.DataFrame({'i': [i]}) for i in range(6)}
+        asyncio.run(AsyncGoogleSheetsAPI('url', max_concurrency=2).write_sheets(frames))
+        self.assertEqual(FakeSheetsCalls.written, frames)
+        self.assertLessEqual(FakeSheetsCalls.most_running, 2)
+        self.assertNotIn(threading.main_thread(), FakeSheetsCalls.threads)
+
+class SheetCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.grid = [['word', 'class'], ['old', 'adjective']]
+        self.fetches = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fetch(self):
+        self.fetches.append(1)
+        return self.grid
+
+    def test_read_through(self):
+        cache = SheetCache(self.directory.name, ttl=0)
+        self.assertEqual(cache.read_through('id', 'Sheet1', lambda: 'rev-1', self.fetch), self.grid)
+        self.assertEqual(cache.read_through('id', 'Sheet1', lambda: 'rev-1', self.fetch), self.grid)
+        self.assertEqual(len(self.fetches), 1)
+        cache.read_through('id', 'Sheet1', lambda: 'rev-2', self.fetch)
+        self.assertEqual(len(self.fetches), 2)
+
+    def test_revalidates_by_default(self):
+        cache = SheetCache(self.directory.name)
+        cache.read_through('id', 'Sheet1', lambda: 'rev-1', self.fetch)
+        cache.read_through('id', 'Sheet1', lambda: 'rev-2', self.fetch)
+        self.assertEqual(len(self.fetches), 2)
+        stale = SheetCache(self.directory.name, ttl=3600)
+        stale.read_through('id', 'Sheet1', lambda: 'rev-3', self.fetch)
+        self.assertEqual(len(self.fetches), 2)
+
+    def test_offline(self):
+        SheetCache(self.directory.name).put('id', 'Sheet1', 'rev-1', self.grid)
+        offline = SheetCache(self.directory.name, offline=True)
+        self.assertEqual(offline.read_through('id', 'Sheet1', lambda: 'rev-2', self.fetch), self.grid)
+        self.assertRaises(LookupError, offline.read_through, 'id', 'Sheet2', lambda: 'rev-2', self.fetch)
+        self.assertEqual(self.fetches, [])
+
+    def test_size_eviction(self):
+        cache = SheetCache(self.directory.name, max_bytes=1)
+        cache.put('id', 'Sheet1', 'rev-1', self.grid)
+        self.assertIsNone(cache.get('id', 'Sheet1'))
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.response = FakeResponse(status_code)
+
+class RequestSchedulerTests(unittest.TestCase):
+
+    def test_retries_rate_limited_calls(self):
+        scheduler = RequestScheduler(requests_per_minute=600, base_delay=0)
+        responses = [FakeAPIError(429), FakeAPIError(503), 'values']
+
+        def call():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.assertEqual(scheduler.call(call, idempotent=True), 'values')
+        self.assertEqual(scheduler.stats()['retried'], 2)
+
+    def test_retries_writes_only_when_rate_limited(self):
+        scheduler = RequestScheduler(requests_per_minute=600, base_delay=0)
+        responses = [FakeAPIError(429), FakeAPIError(500), 'added']
+
+        def add_worksheet():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.assertRaises(FakeAPIError, scheduler.call, add_worksheet)
+        self.assertEqual(scheduler.stats(), {'issued': 2, 'retried': 1, 'coalesced': 0, 'failed': 1})
+        self.assertEqual(responses, ['added'])
+
+    def test_does_not_retry_client_errors(self):
+        scheduler = RequestScheduler(requests_per_minute=600, base_delay=0)
+
+        def call():
+            raise FakeAPIError(400)
+
+        self.assertRaises(FakeAPIError, scheduler.call, call)
+        self.assertEqual(scheduler.stats(), {'issued': 1, 'retried': 0, 'coalesced': 0, 'failed': 1})
+
+    def test_coalesces_identical_reads(self):
+        scheduler = RequestScheduler(requests_per_minute=600)
+        started = threading.Event()
+
+        def call():
+            started.set()
+            time.sleep(0.1)
+            return 'values'
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(scheduler.call(call, key='range')))
+        first.start()
+        started.wait()
+        results.append(scheduler.call(call, key='range'))
+        first.join()
+        self.assertEqual(results, ['values', 'values'])
+        self.assertEqual(scheduler.stats()['issued'], 1)
+        self.assertEqual(scheduler.stats()['coalesced'], 1)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,140 @@
+import collections
+import functools
+import json
+import os
+import re
+import string
+import sys
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+CONTRACTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'english_contractions.json')
+
+# A URL, or a hashtag or mention that stops where a URL starts, so one scan gives the same result as replacing URLs
+# first, then hashtags, then mentions
+URL = r'http[s]?://(?:[a-z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-f][0-9a-f]))+'
+LINKS = re.compile(rf'(?P<URL>{URL})|(?P<HASHTAG>#(?:(?!{URL})\w)+)|(?P<MENTION>@(?:(?!{URL})\w)+)')
+
+# The punctuation class of the notebook. The backslash in string.punctuation escapes the "]" after it, so "]" is
+# removed and the backslash itself is not; keep it that way to match the notebook
+PUNCTUATION_CLASS = '[' + re.sub('[<>]', '', string.punctuation) + '“”¨«»®´·º½¾¿¡§£₤‘’' + ']'
+
+# After the contractions are expanded the words are joined by single spaces, so deleting punctuation can only leave
+# runs of spaces behind
+SPACES = re.compile(' {2,}')
+
+@functools.lru_cache(maxsize=None)
+def load_contractions(path: str = CONTRACTIONS_FILE) -> dict:
+    """
+    Load the contraction table once, keeping at most the first two words of each expansion as the notebook did.
+
+    :param path: str
+        The JSON file mapping contractions to their expansions.
+    :return: dict
+        The expansions keyed by contraction.
+    """
+    with open(path, encoding='utf-8') as f:
+        contractions = json.load(f)
+    return {contraction: ' '.join(expansion.split()[:2]) for contraction, expansion in contractions.items()}
+
+@functools.lru_cache(maxsize=None)
+def deletion_table() -> dict:
+    """
+    Build the str.translate table that deletes the punctuation and the angle brackets, which the notebook removed
+    with two regex passes.
+
+    :return: dict
+        The table.
+    """
+    punctuation = re.compile(PUNCTUATION_CLASS)
+    candidates = string.punctuation + '“”¨«»®´·º½¾¿¡§£₤‘’'
+    deleted = {character for character in candidates if punctuation.fullmatch(character)} | {'<', '>'}
+    return str.maketrans('', '', ''.join(sorted(deleted)))
+
+@functools.lru_cache(maxsize=None)
+def digit_table() -> dict:
+    """
+    Build the str.translate table that deletes every character \\d matches, i.e. every Unicode decimal digit.
+
+    :return: dict
+        The table.
+    """
+    return dict.fromkeys(code for code in range(sys.maxunicode + 1) if unicodedata.category(chr(code)) == 'Nd')
+
+def _link_token(match) -> str:
+    return f"<{match.lastgroup}>"
+
+def normalize_text(text: str, path: str = CONTRACTIONS_FILE) -> str:
+    """
+    Normalize one comment: lowercase it, replace URLs, hashtags and mentions, expand contractions, then drop
+    punctuation and digits and collapse whitespace.
+
+    :param text: str
+        The comment.
+    :param path: str
+        The contraction table.
+    :return: str
+        The normalized comment.
+    """
+    contractions = load_contractions(path)
+    text = text.lower()
+    # Most comments have no links, so skip the scan for them
+    if '#' in text or '@' in text or 'http' in text:
+        text = LINKS.sub(_link_token, text)
+    text = ' '.join([contractions.get(word, word) for word in text.split()])
+    text = SPACES.sub(' ', text.translate(deletion_table()))
+    return text.translate(digit_table())
+
+def normalize_data(data: pd.Series, path: str = CONTRACTIONS_FILE) -> pd.Series:
+    """
+    Normalize a column of comments, with the same output as the notebook's normalize_data.
+
+    :param data: pd.Series
+        The comments; missing ones, e.g. empty cells of a CSV, are normalized as empty comments.
+    :param path: str
+        The contraction table.
+    :return: pd.Series
+        The normalized comments.
+    """
+    texts = data.fillna('').astype(str)
+    return pd.Series([normalize_text(text, path) for text in texts], index=data.index, dtype=object)
+
+def _normalize_chunk(chunk: pd.DataFrame, column: str) -> pd.DataFrame:
+    chunk[column] = normalize_data(chunk[column])
+    return chunk
+
+def normalize_file(path: str, column: str = 'comment_text', chunksize: int = 20000, workers: int = None,
+                   start_row: int = 0):
+    """
+    Read a CSV of comments in chunks and normalize them across a process pool, yielding the chunks in file order.
+
+    :param path: str
+        The CSV file, e.g. train.csv or test.csv.
+    :param column: str
+        The column of comments.
+    :param chunksize: int
+        The number of rows per chunk.
+    :param workers: int
+        The number of worker processes; 1 normalizes in this process, default is one per CPU.
+    :param start_row: int
+        The number of data rows to skip, e.g. to resume after the rows already processed.
+    :return: generator
+        The chunks with the column normalized.
+    """
+    # Ids are hex strings, some all digits, which would lose their leading zeros as numbers
+    chunks = pd.read_csv(path, chunksize=chunksize, skiprows=range(1, start_row + 1), dtype={'id': str})
+    if workers == 1:
+        yield from (_normalize_chunk(chunk, column) for chunk in chunks)
+        return
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keep only a few chunks per worker in flight, so memory does not grow with the file
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_normalize_chunk, chunk, column))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,313 @@
+import argparse
+import collections
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from normalizer import normalize_data
+
+# The artifacts loaded in this process, keyed by model file and modification time, so each worker loads them once
+# and picks up a model exported again
+_artifacts = {}
+
+# What a model file holds
+ARTIFACT_KEYS = ('vectorizer', 'model', 'column', 'tagset')
+
+def save_artifacts(path: str, vectorizer, model, column: str = 'comment_text', tagset: list = None):
+    """
+    Save a fitted vectorizer and model as a model file for scoring. It is written to a temporary file first so that
+    an interrupted save keeps the last model file, and scorers reading it never see half a file.
+
+    :param path: str
+        The model file.
+    :param vectorizer:
+        The fitted vectorizer, e.g. the notebook's TfidfVectorizer or the streaming trainer's HashingVectorizer.
+    :param model:
+        The fitted multilabel classifier.
+    :param column: str
+        The column of comments.
+    :param tagset: list
+        The labels in the order the model predicts them, default is the tagset of the competition.
+    """
+    import joblib
+    from streaming_training import TAGSET
+    artifacts = {'vectorizer': vectorizer, 'model': model, 'column': column, 'tagset': list(tagset or TAGSET)}
+    temporary_path = path + '.tmp'
+    joblib.dump(artifacts, temporary_path)
+    os.replace(temporary_path, path)
+
+def load_artifacts(path: str) -> dict:
+    """
+    Load a model file saved with save_artifacts, once per process and again whenever the file changes.
+
+    :param path: str
+        The model file.
+    :return: dict
+        The vectorizer, the model, the column of comments and the tagset.
+    :raises ValueError:
+        If the file is not a model file, e.g. a training checkpoint.
+    """
+    key = (path, os.stat(path).st_mtime_ns)
+    if key not in _artifacts:
+        import joblib
+        artifacts = joblib.load(path)
+        if not isinstance(artifacts, dict) or not set(ARTIFACT_KEYS) <= set(artifacts):
+            raise ValueError(f"{path} is not a model file; save one with save_artifacts or StreamingTrainer.export")
+        for stale in [cached for cached in _artifacts if cached[0] == path]:
+            del _artifacts[stale]
+        _artifacts[key] = artifacts
+    return _artifacts[key]
+
+def score_comments(comments: pd.Series, artifacts: dict, probabilities: bool = False) -> pd.DataFrame:
+    """
+    Normalize, vectorize and score comments.
+
+    :param comments: pd.Series
+        The raw comments.
+    :param artifacts: dict
+        The loaded model file.
+    :param probabilities: bool
+        Whether to return the probability of each label instead of 0 or 1.
+    :return: pd.DataFrame
+        One column per label of the tagset, with the index of the comments.
+    """
+    X = artifacts['vectorizer'].transform(normalize_data(comments))
+    if probabilities:
+        scores = artifacts['model'].predict_proba(X)
+        # MultiOutputClassifier gives one array of both classes per label, OneVsRestClassifier one column per label
+        if isinstance(scores, list):
+            scores = np.column_stack([proba[:, 1] for proba in scores])
+    else:
+        scores = artifacts['model'].predict(X).astype(np.int8)
+    return pd.DataFrame(scores, index=comments.index, columns=artifacts['tagset'])
+
+def _score_chunk(chunk: pd.DataFrame, model_path: str, probabilities: bool) -> pd.DataFrame:
+    artifacts = load_artifacts(model_path)
+    scores = score_comments(chunk[artifacts['column']], artifacts, probabilities)
+    return pd.concat([chunk.drop(columns=artifacts['tagset'], errors='ignore'), scores], axis=1)
+
+class CSVWriter:
+    def __init__(self, path: str):
+        """
+        Appends chunks of scores to a CSV file, with the header written once.
+
+        :param path: str
+            The output file.
+        """
+        self.path = path
+        self.header = True
+
+    def write(self, chunk: pd.DataFrame):
+        chunk.to_csv(self.path, mode='w' if self.header else 'a', header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        pass
+
+class ParquetWriter:
+    def __init__(self, path: str):
+        """
+        Appends chunks of scores to a Parquet file as row groups.
+
+        :param path: str
+            The output file.
+        """
+        self.path = path
+        self.writer = None
+
+    def write(self, chunk: pd.DataFrame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+def open_writer(path: str):
+    """
+    Open the writer of an output file from its extension, .parquet or else CSV.
+
+    :param path: str
+        The output file.
+    :return: CSVWriter or ParquetWriter
+        The writer.
+    """
+    return ParquetWriter(path) if path.endswith('.parquet') else CSVWriter(path)
+
+def score_file(path: str, output: str, model_path: str, chunksize: int = 20000, workers: int = None,
+               probabilities: bool = False) -> int:
+    """
+    Score a CSV of comments in fixed-size chunks across a process pool and write each chunk, in file order, as soon
+    as it is scored. Each worker loads the artifacts once, and only a few chunks per worker are in memory at a time.
+
+    :param path: str
+        The CSV file, e.g. test.csv.
+    :param output: str
+        The output file, CSV or .parquet, with the input columns and one column per label of the tagset.
+    :param model_path: str
+        The model file exported by the streaming trainer.
+    :param chunksize: int
+        The number of rows per chunk.
+    :param workers: int
+        The number of worker processes; 1 scores in this process, default is one per CPU.
+    :param probabilities: bool
+        Whether to write the probability of each label instead of 0 or 1.
+    :return: int
+        The number of comments scored.
+    """
+    # Ids are hex strings, some all digits, which would lose their leading zeros as numbers
+    chunks = pd.read_csv(path, chunksize=chunksize, dtype={'id': str})
+    writer = open_writer(output)
+    rows = 0
+    try:
+        if workers == 1:
+            for chunk in chunks:
+                scored = _score_chunk(chunk, model_path, probabilities)
+                writer.write(scored)
+                rows += len(scored)
+            return rows
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_artifacts, initargs=(model_path,)) as pool:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(pool.submit(_score_chunk, chunk, model_path, probabilities))
+                if len(pending) >= 2 * workers:
+                    scored = pending.popleft().result()
+                    writer.write(scored)
+                    rows += len(scored)
+            while pending:
+                scored = pending.popleft().result()
+                writer.write(scored)
+                rows += len(scored)
+        return rows
+    finally:
+        writer.close()
+
+class MicroBatcher:
+    def __init__(self, model_path: str, max_batch: int = 64, max_delay: float = 0.005, probabilities: bool = True):
+        """
+        Scores single comments with low latency. Comments submitted from any thread are gathered by a background
+        thread for at most max_delay seconds or max_batch comments, then scored together in one call to the model.
+
+        :param model_path: str
+            The model file exported by the streaming trainer.
+        :param max_batch: int
+            The most comments scored together.
+        :param max_delay: float
+            The longest a comment waits for others to join its batch, in seconds.
+        :param probabilities: bool
+            Whether to return the probability of each label instead of 0 or 1.
+        """
+        # Loaded now so a bad model file fails here, and again for each batch so a new export is picked up
+        load_artifacts(model_path)
+        self.model_path = model_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.probabilities = probabilities
+        self.closed = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, comment: str) -> Future:
+        """
+        Queue a comment for scoring.
+
+        :param comment: str
+            The raw comment.
+        :return: Future
+            The future of the scores, a dict keyed by label.
+        :raises RuntimeError:
+            If the batcher is closed.
+        """
+        future = Future()
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("Cannot submit a comment to a closed MicroBatcher.")
+            self._queue.put((comment, future))
+        return future
+
+    def score(self, comment: str, timeout: float = None) -> dict:
+        """
+        Score a comment, waiting for its batch.
+
+        :param comment: str
+            The raw comment.
+        :param timeout: float
+            The longest to wait, in seconds, default is no limit.
+        :return: dict
+            The score of each label.
+        """
+        return self.submit(comment).result(timeout)
+
+    def _run(self):
+        closing = False
+        while not closing:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            self._score_batch(batch)
+
+    def _score_batch(self, batch: list):
+        comments, futures = zip(*batch)
+        try:
+            artifacts = load_artifacts(self.model_path)
+            scores = score_comments(pd.Series(comments, dtype=object), artifacts, self.probabilities)
+        except Exception as error:
+            for future in futures:
+                future.set_exception(error)
+            return
+        for future, row in zip(futures, scores.to_dict('records')):
+            future.set_result(row)
+
+    def close(self):
+        """
+        Score the comments already queued and stop the background thread. Closing twice does nothing.
+        """
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score a CSV of comments with a trained toxic comment model.")
+    parser.add_argument('path', nargs='?', default='test.csv')
+    parser.add_argument('output', nargs='?', default='final_output.csv')
+    parser.add_argument('--model', default='toxic_model.joblib')
+    parser.add_argument('--chunksize', type=int, default=20000)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--probabilities', action='store_true')
+    arguments = parser.parse_args()
+
+    rows = score_file(arguments.path, arguments.output, arguments.model, chunksize=arguments.chunksize,
+                      workers=arguments.workers, probabilities=arguments.probabilities)
+    print(f"Scored {rows} comments into {arguments.output}")
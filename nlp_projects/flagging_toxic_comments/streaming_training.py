@@ -0,0 +1,245 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from normalizer import normalize_file
+
+TAGSET = ['toxic', 'severe_toxic', 'obscene', 'threat', 'insult', 'identity_hate']
+
+# Hashed features per comment; the weights of the six classifiers take 6 * N_FEATURES floats whatever the corpus size
+N_FEATURES = 2 ** 20
+
+def make_vectorizer(n_features: int = N_FEATURES):
+    """
+    Make the stateless counterpart of the notebook's TfidfVectorizer, with the same tokens and stop words. It needs no
+    vocabulary, so chunks can be vectorized as they are read.
+
+    :param n_features: int
+        The number of hashed features.
+    :return: HashingVectorizer
+        The vectorizer.
+    """
+    from sklearn.feature_extraction.text import HashingVectorizer
+    return HashingVectorizer(n_features=n_features, stop_words='english', token_pattern=r"<?\w+>?",
+                             alternate_sign=False, norm='l2')
+
+def make_model(random_state: int = 0):
+    """
+    Make one logistic regression per label of the tagset trained with stochastic gradient descent, the incremental
+    counterpart of the notebook's OneVsRestClassifier(LogisticRegression()).
+
+    :param random_state: int
+        The seed of the gradient descent.
+    :return: MultiOutputClassifier
+        The model.
+    """
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.multioutput import MultiOutputClassifier
+    return MultiOutputClassifier(SGDClassifier(loss='log_loss', random_state=random_state))
+
+def _vstack(top, bottom):
+    from scipy.sparse import vstack
+    return vstack([top, bottom], format='csr')
+
+def _dump(value, path: str):
+    # Written to a temporary file first so that an interrupted save keeps the last file
+    import joblib
+    temporary_path = path + '.tmp'
+    joblib.dump(value, temporary_path)
+    os.replace(temporary_path, path)
+
+class StreamingTrainer:
+    def __init__(self, n_features: int = N_FEATURES, holdout_fraction: float = 0.1, holdout_rows: int = 20000,
+                 column: str = 'comment_text'):
+        """
+        Initializes a model trained one chunk of comments at a time. A fixed share of the comments, chosen by a hash
+        of their id, is held out to measure the accuracy as training goes; at most holdout_rows of them are kept, and
+        the held-out comments past that are neither kept nor trained on, so the split never changes.
+
+        :param n_features: int
+            The number of hashed features.
+        :param holdout_fraction: float
+            The share of comments held out.
+        :param holdout_rows: int
+            The most held-out comments kept.
+        :param column: str
+            The column of comments.
+        """
+        self.vectorizer = make_vectorizer(n_features)
+        self.model = make_model()
+        self.holdout_fraction = holdout_fraction
+        self.holdout_rows = holdout_rows
+        self.column = column
+        self.rows_read = 0
+        self.rows_trained = 0
+        self.holdout_X = None
+        self.holdout_y = np.empty((0, len(TAGSET)), dtype=np.int8)
+        self.history = []
+
+    def held_out(self, ids: pd.Series) -> np.ndarray:
+        """
+        Choose the held-out comments from their ids, the same way in every run.
+
+        :param ids: pd.Series
+            The comment ids.
+        :return: np.ndarray
+            Whether each comment is held out.
+        """
+        hashes = pd.util.hash_array(ids.astype(str).to_numpy(dtype=object))
+        return hashes % 10000 < self.holdout_fraction * 10000
+
+    def update(self, chunk: pd.DataFrame):
+        """
+        Train on a chunk of normalized comments and keep its held-out comments.
+
+        :param chunk: pd.DataFrame
+            The comments, with an id column, the comment column and the tagset columns.
+        """
+        X = self.vectorizer.transform(chunk[self.column].astype(str))
+        y = chunk[TAGSET].to_numpy(dtype=np.int8)
+        held_out = self.held_out(chunk['id'])
+        room = self.holdout_rows - self.holdout_y.shape[0]
+        if room > 0 and held_out.any():
+            rows = np.flatnonzero(held_out)[:room]
+            self.holdout_X = X[rows] if self.holdout_X is None else _vstack(self.holdout_X, X[rows])
+            self.holdout_y = np.concatenate([self.holdout_y, y[rows]])
+        train = ~held_out
+        if train.any():
+            if not hasattr(self.model, 'estimators_'):
+                self.model.partial_fit(X[train], y[train], classes=[np.array([0, 1])] * len(TAGSET))
+            else:
+                self.model.partial_fit(X[train], y[train])
+            self.rows_trained += int(train.sum())
+        self.rows_read += len(chunk)
+
+    def evaluate(self):
+        """
+        Compute the accuracy on the held-out comments, as the share of comments whose six labels are all right.
+
+        :return: float
+            The accuracy, or None before there is a trained model and a held-out comment.
+        """
+        if self.holdout_X is None or not hasattr(self.model, 'estimators_'):
+            return None
+        from sklearn.metrics import accuracy_score
+        return accuracy_score(self.holdout_y, self.model.predict(self.holdout_X))
+
+    def save(self, path: str):
+        """
+        Save the vectorizer, the model and the training state, held-out comments included, as a plain dict to resume
+        training from. It is written to a temporary file first so that an interrupted save keeps the last checkpoint.
+
+        :param path: str
+            The checkpoint file.
+        """
+        _dump(vars(self), path)
+
+    def export(self, path: str):
+        """
+        Save only what scoring needs, the vectorizer, the model, the column of comments and the tagset, so that
+        scoring does not load the held-out comments and training state of the checkpoint.
+
+        :param path: str
+            The model file.
+        """
+        from scoring import save_artifacts
+        save_artifacts(path, self.vectorizer, self.model, column=self.column, tagset=TAGSET)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Load a trainer saved with save.
+
+        :param path: str
+            The checkpoint file.
+        :return: StreamingTrainer
+            The trainer.
+        """
+        import joblib
+        trainer = cls.__new__(cls)
+        trainer.__dict__.update(joblib.load(path))
+        return trainer
+
+    def train(self, path: str, checkpoint: str = None, chunksize: int = 20000, workers: int = None,
+              checkpoint_every: int = 1, model_path: str = None):
+        """
+        Train on a CSV of labeled comments, starting after the rows already read, e.g. when resuming from a
+        checkpoint.
+
+        :param path: str
+            The CSV file, e.g. train.csv.
+        :param checkpoint: str
+            The checkpoint file, default is not to save checkpoints.
+        :param chunksize: int
+            The number of rows per chunk.
+        :param workers: int
+            The number of processes normalizing the comments.
+        :param checkpoint_every: int
+            The number of chunks between checkpoints.
+        :param model_path: str
+            The model file for scoring, exported with every checkpoint and at the end, default is not to export it.
+        :return: generator
+            The progress after each chunk: rows read and trained on and the held-out accuracy.
+        """
+        chunks = normalize_file(path, self.column, chunksize=chunksize, workers=workers, start_row=self.rows_read)
+        for number, chunk in enumerate(chunks, start=1):
+            self.update(chunk)
+            progress = {'rows_read': self.rows_read, 'rows_trained': self.rows_trained,
+                        'holdout_rows': int(self.holdout_y.shape[0]), 'accuracy': self.evaluate()}
+            self.history.append(progress)
+            if number % checkpoint_every == 0:
+                self._checkpoint(checkpoint, model_path)
+            yield progress
+        self._checkpoint(checkpoint, model_path)
+
+    def _checkpoint(self, checkpoint: str, model_path: str):
+        if checkpoint:
+            self.save(checkpoint)
+        if model_path and hasattr(self.model, 'estimators_'):
+            self.export(model_path)
+
+def train_streaming(path: str, checkpoint: str, chunksize: int = 20000, workers: int = None, resume: bool = True,
+                    model_path: str = None, **kwargs):
+    """
+    Train the tagset model on a CSV of labeled comments, resuming from the checkpoint when there is one.
+
+    :param path: str
+        The CSV file, e.g. train.csv.
+    :param checkpoint: str
+        The checkpoint file.
+    :param chunksize: int
+        The number of rows per chunk.
+    :param workers: int
+        The number of processes normalizing the comments.
+    :param resume: bool
+        Whether to continue from the checkpoint rather than start over.
+    :param model_path: str
+        The model file for scoring, default is not to export it.
+    :param kwargs: dict
+        The settings of a new StreamingTrainer.
+    :return: generator
+        The progress after each chunk.
+    """
+    if resume and os.path.exists(checkpoint):
+        trainer = StreamingTrainer.load(checkpoint)
+    else:
+        trainer = StreamingTrainer(**kwargs)
+    yield from trainer.train(path, checkpoint, chunksize=chunksize, workers=workers, model_path=model_path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train the toxic comment model on a CSV larger than memory.")
+    parser.add_argument('path', nargs='?', default='train.csv')
+    parser.add_argument('--checkpoint', default='toxic_checkpoint.joblib')
+    parser.add_argument('--model', default='toxic_model.joblib', help="The model file for scoring.")
+    parser.add_argument('--chunksize', type=int, default=20000)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--fresh', action='store_true', help="Start over instead of resuming from the checkpoint.")
+    arguments = parser.parse_args()
+
+    for progress in train_streaming(arguments.path, arguments.checkpoint, chunksize=arguments.chunksize,
+                                    workers=arguments.workers, resume=not arguments.fresh,
+                                    model_path=arguments.model):
+        accuracy = 'n/a' if progress['accuracy'] is None else '{:.2%}'.format(progress['accuracy'])
+        print(f"{progress['rows_read']} rows read, {progress['rows_trained']} trained on, "
+              f"held-out accuracy {accuracy}")
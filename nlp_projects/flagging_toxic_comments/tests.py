@@ -0,0 +1,265 @@
+import unittest
+import json
+import os
+import re
+import string
+import tempfile
+from unittest import mock
+import joblib
+import numpy as np
+import pandas as pd
+from normalizer import normalize_data, normalize_file, load_contractions, CONTRACTIONS_FILE
+from streaming_training import StreamingTrainer, train_streaming, TAGSET
+import scoring
+from scoring import score_file, score_comments, load_artifacts, save_artifacts, MicroBatcher
+
+def notebook_normalize_data(data):
+    # The notebook's normalize_data before it moved to normalizer.py, kept to check the module gives the same output
+    with open(CONTRACTIONS_FILE, encoding='utf-8') as f:
+        contractions = json.load(f)
+    data = data.str.lower()
+    data = data.str.replace(r'http[s]?://(?:[a-z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-f][0-9a-f]))+', '<URL>',
+                            regex=True)
+    data = data.str.replace(r'#(\w+)', '<HASHTAG>', regex=True)
+    data = data.str.replace(r'@(\w+)', '<MENTION>', regex=True)
+    data = data.apply(lambda text: notebook_normalize_contractions(text, contractions))
+    punctuation = '[' + re.sub('[<>]', '', string.punctuation) + '“”¨«»®´·º½¾¿¡§£₤‘’' + ']'
+    data = data.str.replace(punctuation, '', regex=True)
+    data = data.str.replace('(<(?!=(URL|HASHTAG|MENTION))|(?!(URL|HASHTAG|MENTION))>)', '', regex=True)
+    data = data.str.replace(r'\s+', ' ', regex=True)
+    data = data.str.replace(r'\d+', '', regex=True)
+    return data
+
+def notebook_normalize_contractions(text, contractions):
+    new_token_list = []
+    for word in text.split():
+        if word.lower() in contractions:
+            new_token_list.extend(contractions[word.lower()].split()[:2])
+        else:
+            new_token_list.append(word)
+    return " ".join(new_token_list).strip(" ")
+
+COMMENTS = [
+    "Hello World! It's 2024, you're WRONG.",
+    "See http://example.com/a?b=1 and https://t.co/AbC#frag now",
+    "#Wikipedia @Admin please stop #http://x.y @abchttps://q.r",
+    "I can't   believe\nthis\tpage — “quotes” «guillemets» ½ price £5",
+    "<b>bold</b> a\\b [brackets] e-mail x@y 1 2 3abc",
+    "",
+    "y'all'd've ain't won't",
+    "Ünïcödé café ٣ digits १२३",
+]
+
+class NormalizerTests(unittest.TestCase):
+
+    def test_matches_the_notebook(self):
+        comments = pd.Series(COMMENTS, dtype=object)
+        # The notebook ran on pandas before strings were inferred as Arrow strings, whose regexes treat \d differently
+        with pd.option_context('future.infer_string', False):
+            expected = notebook_normalize_data(comments)
+        self.assertEqual(normalize_data(comments).tolist(), expected.tolist())
+
+    def test_backslash_survives_like_in_the_notebook(self):
+        self.assertEqual(normalize_data(pd.Series(['a\\b [c]'])).tolist(), ['a\\b c'])
+
+    def test_contractions_are_loaded_once(self):
+        self.assertIs(load_contractions(), load_contractions())
+        self.assertEqual(load_contractions()["can't"], 'cannot')
+
+    def test_file_chunks_match_in_memory(self):
+        comments = COMMENTS * 5
+        ids = [f'{number:04d}' for number in range(len(comments))]
+        frame = pd.DataFrame({'id': ids, 'comment_text': comments})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'comments.csv')
+            frame.to_csv(path, index=False)
+            expected = normalize_data(pd.read_csv(path)['comment_text']).tolist()
+            for workers in (1, 2):
+                chunks = list(normalize_file(path, chunksize=7, workers=workers))
+                self.assertEqual(len(chunks), 6)
+                result = pd.concat(chunks)
+                self.assertEqual(result['id'].tolist(), ids)
+                self.assertEqual(result['comment_text'].tolist(), expected)
+            resumed = pd.concat(normalize_file(path, chunksize=7, workers=1, start_row=10))
+            self.assertEqual(resumed['id'].tolist(), ids[10:])
+
+def labeled_corpus(rows: int = 400, seed: int = 0) -> pd.DataFrame:
+    # Toxic comments use their own words, so a few chunks are enough to learn the labels
+    rng = np.random.default_rng(seed)
+    toxic = rng.random(rows) < 0.3
+    words = {True: ['idiot', 'stupid', 'moron', 'loser'], False: ['thanks', 'article', 'source', 'edit', 'page']}
+    comments = [' '.join(rng.choice(words[bool(flag)], 6)) + " I'm sure" for flag in toxic]
+    corpus = pd.DataFrame({'id': [f'{number:016x}' for number in range(rows)], 'comment_text': comments})
+    for label in TAGSET:
+        corpus[label] = toxic.astype(int) if label in ('toxic', 'insult') else 0
+    return corpus
+
+class StreamingTrainerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'train.csv')
+        labeled_corpus().to_csv(self.path, index=False)
+        self.settings = {'n_features': 2 ** 12, 'holdout_fraction': 0.2}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_trains_chunk_by_chunk(self):
+        trainer = StreamingTrainer(**self.settings)
+        progress = list(trainer.train(self.path, chunksize=100, workers=1))
+        self.assertEqual([step['rows_read'] for step in progress], [100, 200, 300, 400])
+        for step in progress:
+            self.assertEqual(step['rows_trained'] + step['holdout_rows'], step['rows_read'])
+        self.assertGreater(progress[-1]['holdout_rows'], 0)
+        self.assertGreaterEqual(progress[-1]['accuracy'], 0.9)
+        self.assertEqual(trainer.history, progress)
+
+    def test_resumes_from_checkpoint(self):
+        checkpoint = os.path.join(self.directory.name, 'model.joblib')
+        uninterrupted = StreamingTrainer(**self.settings)
+        list(uninterrupted.train(self.path, chunksize=100, workers=1))
+
+        steps = train_streaming(self.path, checkpoint, chunksize=100, workers=1, **self.settings)
+        next(steps)
+        next(steps)
+        steps.close()
+        self.assertEqual(StreamingTrainer.load(checkpoint).rows_read, 200)
+        resumed = [step['rows_read'] for step in train_streaming(self.path, checkpoint, chunksize=100, workers=1)]
+        self.assertEqual(resumed, [300, 400])
+
+        trainer = StreamingTrainer.load(checkpoint)
+        self.assertEqual(trainer.rows_read, 400)
+        self.assertEqual(len(trainer.history), 4)
+        self.assertEqual(trainer.holdout_y.tolist(), uninterrupted.holdout_y.tolist())
+        for estimator, expected in zip(trainer.model.estimators_, uninterrupted.model.estimators_):
+            np.testing.assert_allclose(estimator.coef_, expected.coef_)
+
+    def test_exports_a_model_for_scoring(self):
+        checkpoint = os.path.join(self.directory.name, 'checkpoint.joblib')
+        model_path = os.path.join(self.directory.name, 'model.joblib')
+        list(train_streaming(self.path, checkpoint, chunksize=100, workers=1, model_path=model_path, **self.settings))
+        model = joblib.load(model_path)
+        self.assertEqual(sorted(model), ['column', 'model', 'tagset', 'vectorizer'])
+        self.assertLess(os.path.getsize(model_path), os.path.getsize(checkpoint))
+        self.assertIn('holdout_X', joblib.load(checkpoint))
+
+class ScoringTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        train = os.path.join(cls.directory.name, 'train.csv')
+        labeled_corpus().to_csv(train, index=False)
+        trainer = StreamingTrainer(n_features=2 ** 12, holdout_fraction=0.2)
+        list(trainer.train(train, chunksize=100, workers=1))
+        cls.model_path = os.path.join(cls.directory.name, 'model.joblib')
+        trainer.export(cls.model_path)
+        cls.test_path = os.path.join(cls.directory.name, 'test.csv')
+        labeled_corpus(rows=50, seed=1).drop(columns=TAGSET).to_csv(cls.test_path, index=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def output(self, name: str) -> str:
+        return os.path.join(self.directory.name, name)
+
+    def test_score_file(self):
+        for workers in (1, 2):
+            self.assertEqual(score_file(self.test_path, self.output(f'{workers}.csv'), self.model_path, chunksize=12,
+                                        workers=workers), 50)
+        one, two = (pd.read_csv(self.output(name), dtype={'id': str}) for name in ('1.csv', '2.csv'))
+        pd.testing.assert_frame_equal(one, two)
+        comments = pd.read_csv(self.test_path, dtype={'id': str})
+        self.assertEqual(list(one.columns), ['id', 'comment_text', *TAGSET])
+        self.assertEqual(one['id'].tolist(), comments['id'].tolist())
+        toxic = comments['comment_text'].str.contains('idiot|stupid|moron|loser').astype(int)
+        self.assertGreaterEqual((one['toxic'] == toxic).mean(), 0.9)
+
+    def test_score_file_probabilities_to_parquet(self):
+        output = self.output('scores.parquet')
+        self.assertEqual(score_file(self.test_path, output, self.model_path, chunksize=12, workers=1,
+                                    probabilities=True), 50)
+        scores = pd.read_parquet(output)
+        self.assertEqual(len(scores), 50)
+        self.assertTrue(scores[TAGSET].apply(lambda column: column.between(0, 1)).all().all())
+
+    def count_batches(self):
+        batches = []
+        def score(comments, *args):
+            batches.append(len(comments))
+            return score_comments(comments, *args)
+        return batches, mock.patch.object(scoring, 'score_comments', side_effect=score)
+
+    def test_batcher_flushes_when_full(self):
+        batches, patch = self.count_batches()
+        with patch, MicroBatcher(self.model_path, max_batch=3, max_delay=60) as batcher:
+            futures = [batcher.submit(comment) for comment in ['you idiot', 'thanks for the edit', 'stupid loser']]
+            results = [future.result(timeout=10) for future in futures]
+        self.assertEqual(batches, [3])
+        self.assertEqual(sorted(results[0]), sorted(TAGSET))
+        self.assertGreater(results[0]['toxic'], results[1]['toxic'])
+
+    def test_batcher_flushes_after_delay(self):
+        batches, patch = self.count_batches()
+        with patch, MicroBatcher(self.model_path, max_batch=64, max_delay=0.01, probabilities=False) as batcher:
+            self.assertEqual(batcher.score('you idiot', timeout=10)['toxic'], 1)
+            self.assertEqual(batcher.score('thanks for the edit', timeout=10)['toxic'], 0)
+        self.assertEqual(batches, [1, 1])
+
+    def test_batcher_close_scores_queued_comments(self):
+        batcher = MicroBatcher(self.model_path, max_batch=64, max_delay=60)
+        futures = [batcher.submit(comment) for comment in ['you idiot', 'thanks']]
+        batcher.close()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertFalse(batcher._thread.is_alive())
+        self.assertRaises(RuntimeError, batcher.submit, 'too late')
+        batcher.close()
+
+    def test_batcher_reports_errors(self):
+        with mock.patch.object(scoring, 'score_comments', side_effect=ValueError('bad batch')), \
+                MicroBatcher(self.model_path, max_delay=0.01) as batcher:
+            self.assertRaises(ValueError, batcher.score, 'you idiot', 10)
+
+    def test_artifacts_are_loaded_once(self):
+        self.assertIs(load_artifacts(self.model_path), load_artifacts(self.model_path))
+
+    def test_artifacts_follow_a_new_export(self):
+        path = self.output('exported.joblib')
+        artifacts = load_artifacts(self.model_path)
+        save_artifacts(path, artifacts['vectorizer'], artifacts['model'])
+        first = load_artifacts(path)
+        save_artifacts(path, artifacts['vectorizer'], artifacts['model'], tagset=list(reversed(TAGSET)))
+        # Make sure the new file has a new modification time even on coarse clocks
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(load_artifacts(path)['tagset'], list(reversed(TAGSET)))
+        self.assertIsNot(load_artifacts(path), first)
+        self.assertEqual([key for key in scoring._artifacts if key[0] == path], [(path, os.stat(path).st_mtime_ns)])
+
+    def test_checkpoint_is_not_a_model_file(self):
+        checkpoint = self.output('checkpoint.joblib')
+        joblib.dump({'vectorizer': None, 'holdout_X': None}, checkpoint)
+        self.assertRaises(ValueError, load_artifacts, checkpoint)
+
+    def test_scores_the_notebook_model(self):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.multiclass import OneVsRestClassifier
+        corpus = labeled_corpus()
+        # The notebook's own vectorizer and model, fitted on every label it has seen both values of
+        tagset = ['toxic', 'insult']
+        vectorizer = TfidfVectorizer(stop_words='english', token_pattern=r"<?\w+>?")
+        X = vectorizer.fit_transform(normalize_data(corpus['comment_text']))
+        model = OneVsRestClassifier(LogisticRegression()).fit(X, corpus[tagset])
+        path = self.output('notebook.joblib')
+        save_artifacts(path, vectorizer, model, tagset=tagset)
+        output = self.output('notebook.csv')
+        self.assertEqual(score_file(self.test_path, output, path, chunksize=20, workers=1, probabilities=True), 50)
+        scores = pd.read_csv(output)
+        self.assertEqual(list(scores.columns), ['id', 'comment_text', *tagset])
+        self.assertTrue(scores[tagset].apply(lambda column: column.between(0, 1)).all().all())
+
+if __name__ == '__main__':
+    unittest.main()